@@ -0,0 +1,179 @@
+/*
+Input and output helpers shared by the scanners.
+
+Output is gathered in a large arena and written with a few big write()
+calls instead of one stdio call per token or character. Build with
+-DLEX_STDIO to go through stdio instead, e.g. for comparison.
+
+Input named on the command line is memory mapped and scanned in place
+with yy_scan_buffer(), which avoids copying it through stdio.
+*/
+
+#include <errno.h>
+#include <fcntl.h>
+#include <stdarg.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#define ECHO out_write(yytext, yyleng)
+
+#ifdef LEX_STDIO
+
+static void out_write(char const * s, size_t len) {
+    fwrite(s, 1, len, stdout);
+}
+
+static void out_putc(char c) {
+    putchar(c);
+}
+
+static void out_puts(char const * s) {
+    fputs(s, stdout);
+}
+
+#define out_printf printf
+
+static void out_flush(void) {
+    fflush(stdout);
+}
+
+#else
+
+enum {
+    OUT_SZ = 1 << 20
+    };
+
+static char   s_out[OUT_SZ];
+static size_t s_out_len;
+
+static void write_all(char const * s, size_t len) {
+    while (len) {
+        ssize_t n = write(STDOUT_FILENO, s, len);
+
+        if (n < 0) {
+            if (errno == EINTR) {
+                continue;
+                }
+
+            perror("write");
+            _exit(1);
+            }
+
+        s += n;
+        len -= n;
+        }
+}
+
+static void out_flush(void) {
+    write_all(s_out, s_out_len);
+    s_out_len = 0;
+}
+
+static void out_write(char const * s, size_t len) {
+    if (len > OUT_SZ - s_out_len) {
+        out_flush();
+
+        /* too big for the arena: write it straight through */
+        if (len > OUT_SZ) {
+            write_all(s, len);
+            return;
+            }
+        }
+
+    memcpy(&s_out[s_out_len], s, len);
+    s_out_len += len;
+}
+
+static void out_putc(char c) {
+    if (s_out_len == OUT_SZ) {
+        out_flush();
+        }
+
+    s_out[s_out_len++] = c;
+}
+
+static void out_puts(char const * s) {
+    out_write(s, strlen(s));
+}
+
+static void out_printf(char const * format, ...) {
+    va_list args;
+    size_t space = OUT_SZ - s_out_len;
+    char * buf;
+    int len;
+
+    va_start(args, format);
+    len = vsnprintf(&s_out[s_out_len], space, format, args);
+    va_end(args);
+
+    if (len < 0) {
+        return;
+        }
+
+    if ((size_t)len < space) {
+        s_out_len += len;
+        return;
+        }
+
+    /* too big for the rest of the arena: format it on its own */
+    buf = malloc((size_t)len + 1);
+
+    if (!buf) {
+        perror("malloc");
+        exit(1);
+        }
+
+    va_start(args, format);
+    vsnprintf(buf, (size_t)len + 1, format, args);
+    va_end(args);
+
+    out_write(buf, len);
+    free(buf);
+}
+
+#endif
+
+/* Flush the output on every exit path, including exit(1) on errors */
+static void out_init(void) {
+    atexit(out_flush);
+}
+
+/* Map the named file for yy_scan_buffer(), which needs the text followed
+   by two NUL bytes. The file is mapped privately over an anonymous region
+   two bytes longer than the file, so the bytes after the end are zero
+   whether or not the file ends on a page boundary. Flex writes into the
+   buffer while scanning, which only touches our private copy. */
+static char * map_file(char const * path, size_t * size) {
+    struct stat st;
+    char * base;
+    int fd;
+
+    fd = open(path, O_RDONLY);
+
+    if (fd < 0 || fstat(fd, &st) < 0) {
+        perror(path);
+        exit(1);
+        }
+
+    *size = st.st_size + 2;
+    base = mmap(NULL, *size, PROT_READ | PROT_WRITE,
+                MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+
+    if (base == MAP_FAILED) {
+        perror(path);
+        exit(1);
+        }
+
+    if (st.st_size && mmap(base, st.st_size, PROT_READ | PROT_WRITE,
+                           MAP_PRIVATE | MAP_FIXED, fd, 0) == MAP_FAILED) {
+        perror(path);
+        exit(1);
+        }
+
+    close(fd);
+    return base;
+}
@@ -0,0 +1,39 @@
+"""Post-process a book: python ppx COMMAND [options], or from the zipapp,
+python ppx.pyz COMMAND [options]. Without a command, render.
+
+commands:
+  render  write the HTML and text books from the XML book
+  check   check that the XML book parses and numbers, without writing it
+  serve   render books on request from a Unix socket
+
+Each command takes -h for its options. Only the modules a command needs
+are imported.
+"""
+# pylint: disable=import-outside-toplevel
+
+import sys
+
+COMMANDS = ('render', 'check', 'serve')
+
+def run():
+    args = sys.argv[1:]
+
+    if args and args[0] in ('-h', '--help'):
+        print(__doc__)
+        return
+
+    command = args.pop(0) if args and args[0] in COMMANDS else 'render'
+    prog = f'ppx {command}'
+
+    if command == 'serve':
+        import server
+        server.serve(server.parse_args(args, prog))
+    else:
+        import main
+
+        if command == 'check':
+            main.check(args, prog)
+        else:
+            main.main(args, prog)
+
+run()
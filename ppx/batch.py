@@ -0,0 +1,319 @@
+#!/usr/bin/python
+
+"""Build a corpus of books, rebuilding only those whose inputs changed.
+
+Each directory of the corpus with a source text is a book. A build checks
+the source with lex/syntax, converts its quotes with lex/quotes, scans it
+into the XML book with lex/xml, and writes the books with ppx, with any
+arguments given after --. The outputs are written to a build directory
+in the book, and moved beside the source when all are done.
+
+The journal records each book built: a hash of its inputs, and the hashes
+of its outputs. The inputs are the source, style.css, the images with
+their dimensions, the ppx arguments, and the ppx and lex programs. A book
+whose inputs and outputs are as recorded is skipped, so a run that was
+stopped resumes at the first book it had not finished.
+
+The manifest lists the outputs of every book with their hashes, in the
+format of sha256sum. The outputs that are new or changed since the last
+build of their book are printed, one path a line, for publishing.
+
+With --profile, the driver and each run of ppx are sampled, and the
+samples written together as collapsed stacks, those of ppx under the
+name of their book.
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import cache
+import images
+import quotes
+import sampler
+import scan
+
+PPX_DIR = os.path.dirname(os.path.abspath(__file__))
+LEX_DIR = os.path.join(os.path.dirname(PPX_DIR), 'lex')
+MAIN = os.path.join(PPX_DIR, 'main.py')
+
+SOURCE = 'x.txt'
+LEX_PROGRAMS = ('syntax', 'quotes', 'xml', 'contractions.txt')
+
+JOURNAL = '.ppx-journal'
+MANIFEST = 'manifest.sha256'
+BUILD_DIR = '.ppx-build'
+
+# The intermediate files of a build, left in the build directory
+SCANNED = 'x.txt'
+XML = 'x.xml'
+PROFILE = 'profile.txt'
+
+def file_hash(path):
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as file:
+        while chunk := file.read(1 << 16):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def read(path):
+    """The bytes of a file, or nothing if it does not exist"""
+    try:
+        with open(path, 'rb') as file:
+            return file.read()
+    except FileNotFoundError:
+        return b''
+
+def tool_version(lex_dir):
+    """The hash of the programs that build a book: the ppx modules, and
+    the scanners with their data. A missing scanner stops the run here,
+    before any book is touched.
+    """
+    paths = sorted(glob.glob(os.path.join(PPX_DIR, '*.py')))
+    parts = [read(path) for path in paths]
+    parts.append(read(os.path.join(PPX_DIR, 'search.js')))
+
+    for name in LEX_PROGRAMS:
+        with open(os.path.join(lex_dir, name), 'rb') as file:
+            parts.append(file.read())
+
+    return cache.make_key(*parts)
+
+def input_key(book, source, tools, args):
+    """The hash of everything a book's outputs are made from"""
+    files = images.scan(os.path.join(book, 'images'),
+                        use_cache='--no-cache' not in args)
+    listing = '\n'.join(' '.join(map(str, item)) for item in files)
+    return cache.make_key(b'batch', read(os.path.join(book, source)),
+                          read(os.path.join(book, 'style.css')),
+                          listing.encode('utf-8'), tools.encode('utf-8'),
+                          '\0'.join(args).encode('utf-8'))
+
+def load_journal(path):
+    """The last entry of each book. An entry cut short by a stopped run is
+    left out, and its book built again.
+    """
+    entries = {}
+
+    try:
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+
+                entries[entry['book']] = entry
+    except FileNotFoundError:
+        pass
+
+    return entries
+
+def replace(path, lines):
+    """Write the file whole, or not at all"""
+    temp = f'{path}.{os.getpid()}.tmp'
+
+    with open(temp, 'w', encoding='utf-8') as file:
+        file.writelines(lines)
+
+    os.replace(temp, path)
+
+def is_current(book, entry, key):
+    if not entry or entry['inputs'] != key:
+        return False
+
+    try:
+        return all(file_hash(os.path.join(book, name)) == value
+                   for name, value in entry['outputs'].items())
+    except FileNotFoundError:
+        return False
+
+class BuildError(Exception):
+    """A stage of a build failed"""
+
+def run(command, **kwargs):
+    result = subprocess.run(command, capture_output=True, check=False,
+                            **kwargs)
+
+    if result.returncode:
+        message = (result.stdout + result.stderr).decode('utf-8', 'replace')
+        raise BuildError(message.strip())
+
+    return result.stdout
+
+def build(book, source, lex_dir, args, profiler=None):
+    """Build the book's outputs in its build directory. Return their
+    names. With a profiler, ppx is sampled too, and its samples added to
+    the profiler's.
+    """
+    build_dir = os.path.join(book, BUILD_DIR)
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.mkdir(build_dir)
+
+    path = os.path.join(book, source)
+    problems = run([os.path.join(lex_dir, 'syntax'), path])
+
+    for line in problems.decode('utf-8', 'replace').splitlines():
+        print(f'{path}: {line}', file=sys.stderr)
+
+    try:
+        converted = quotes.convert(read(path),
+                                   lex_quotes=os.path.join(lex_dir, 'quotes'))
+    except subprocess.CalledProcessError as error:
+        raise BuildError(error.stderr.decode('utf-8', 'replace')) from error
+
+    scanned = os.path.join(build_dir, SCANNED)
+
+    with open(scanned, 'wb') as file:
+        file.write(converted)
+
+    # The scan is cached by its path, so the next build of the book only
+    # rescans the chapters that changed
+    xml, status = scan.scan(os.path.abspath(scanned),
+                            os.path.join(lex_dir, 'xml'))
+
+    if status:
+        raise BuildError(f'lex/xml failed with status {status}')
+
+    with open(os.path.join(build_dir, XML), 'wb') as file:
+        file.write(xml)
+
+    if profiler:
+        args = [*args, '--profile', PROFILE,
+                '--profile-rate', str(profiler.rate)]
+
+    run([sys.executable, MAIN, XML, '--style', '../style.css',
+         '--images', '../images', *args], cwd=build_dir)
+
+    if profiler:
+        name = os.path.basename(book)
+        samples = sampler.read(os.path.join(build_dir, PROFILE))
+        profiler.counts.update({f'book:{name};{stack}': count
+                                for stack, count in samples.items()})
+
+    return sorted(set(os.listdir(build_dir)) - {SCANNED, XML, PROFILE})
+
+def install(book, names, old_outputs):
+    """Move the built outputs beside the source, in place of the last
+    ones
+    """
+    build_dir = os.path.join(book, BUILD_DIR)
+
+    for name in old_outputs:
+        if name not in names:
+            try:
+                os.remove(os.path.join(book, name))
+            except FileNotFoundError:
+                pass
+
+    for name in names:
+        os.replace(os.path.join(build_dir, name), os.path.join(book, name))
+
+    shutil.rmtree(build_dir)
+
+def find_books(corpus, source):
+    return sorted(entry.path for entry in os.scandir(corpus)
+                  if entry.is_dir() and
+                  os.path.isfile(os.path.join(entry.path, source)))
+
+def run_batch(corpus, source=SOURCE, lex_dir=LEX_DIR, args=(),
+              force=False, profiler=None):
+    """Build the books of the corpus that are not current. Return the
+    books that failed.
+    """
+    journal_path = os.path.join(corpus, JOURNAL)
+    entries = load_journal(journal_path)
+    tools = tool_version(lex_dir)
+    failed = []
+
+    with open(journal_path, 'a', encoding='utf-8') as journal:
+        for book in find_books(corpus, source):
+            name = os.path.basename(book)
+            entry = entries.get(name)
+            key = input_key(book, source, tools, args)
+
+            if not force and is_current(book, entry, key):
+                continue
+
+            try:
+                names = build(book, source, lex_dir, args, profiler)
+            except BuildError as error:
+                print(f'{book}: {error}', file=sys.stderr)
+                failed.append(book)
+                continue
+
+            old = entry['outputs'] if entry else {}
+            outputs = {output: file_hash(os.path.join(book, BUILD_DIR, output))
+                       for output in names}
+            install(book, names, old)
+            entries[name] = {'book': name, 'inputs': key, 'outputs': outputs}
+
+            # Each book is recorded as soon as it is built
+            journal.write(json.dumps(entries[name]) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+
+            for output, value in outputs.items():
+                if old.get(output) != value:
+                    print(f'{name}/{output}', flush=True)
+
+    # Only the books still in the corpus are kept, one entry each
+    books = {os.path.basename(book) for book in find_books(corpus, source)}
+    kept = [entries[name] for name in sorted(entries) if name in books]
+    replace(journal_path, [json.dumps(entry) + '\n' for entry in kept])
+    replace(os.path.join(corpus, MANIFEST),
+            [f'{value}  {entry["book"]}/{output}\n' for entry in kept
+             for output, value in sorted(entry['outputs'].items())])
+
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('corpus', help='the directory of book directories')
+    parser.add_argument('args', nargs=argparse.REMAINDER,
+                        help='arguments for ppx, after --')
+    parser.add_argument('--source', default=SOURCE,
+                        help=f'the source text of each book '
+                             f'(default: {SOURCE})')
+    parser.add_argument('--lex', default=LEX_DIR,
+                        help='the directory of the lex programs')
+    parser.add_argument('--force', action='store_true',
+                        help='build every book, current or not')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='sample where the time goes, and write the '
+                             'samples to FILE as collapsed stacks for a flame '
+                             'graph')
+    parser.add_argument('--profile-rate', metavar='HZ', type=float,
+                        default=sampler.RATE,
+                        help='samples a second of CPU time for --profile '
+                             f'(default: {sampler.RATE})')
+    args = parser.parse_args()
+
+    ppx_args = args.args[1:] if args.args[:1] == ['--'] else args.args
+    profiler = None
+
+    if args.profile:
+        profiler = sampler.Sampler(args.profile, args.profile_rate)
+        profiler.start()
+
+    try:
+        failed = run_batch(args.corpus, args.source, args.lex, ppx_args,
+                           args.force, profiler)
+    except OSError as error:
+        parser.exit(2, f'{parser.prog}: {error}\n')
+    finally:
+        if profiler:
+            profiler.stop()
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Cache of parsed and numbered books"""
+
+import hashlib
+import os
+
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                                        os.path.expanduser('~/.cache')), 'ppx')
+CACHE_SIZE = 256 * 1024 * 1024 # bytes kept before the oldest entries go
+
+MAGIC = b'ppx-cache 1\n'
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+def make_key(*parts):
+    """Hash the given byte strings into a cache key"""
+    digest = hashlib.sha256()
+
+    for part in parts:
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+
+    return digest.hexdigest()
+
+def code_version(module):
+    """Get the source or byte code of a module, for use in a cache key. This
+    works for plain files as well as zip archives.
+    """
+    return module.__loader__.get_data(module.__file__)
+
+def load(key):
+    """Get the cached data for the key. Return None if there is no entry or
+    the entry fails its integrity check.
+    """
+    path = os.path.join(CACHE_DIR, key)
+
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+    except OSError:
+        return None
+
+    header = len(MAGIC) + DIGEST_SIZE
+    digest = data[len(MAGIC):header]
+    payload = data[header:]
+
+    if not data.startswith(MAGIC) or hashlib.sha256(payload).digest() != digest:
+        remove(path)
+        return None
+
+    # Mark the entry as recently used, unless it was evicted meanwhile
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+    return payload
+
+def store(key, payload):
+    """Add an entry to the cache, then evict the least recently used entries
+    beyond CACHE_SIZE
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, key)
+    temp = f'{path}.{os.getpid()}.tmp'
+
+    with open(temp, 'wb') as file:
+        file.write(MAGIC)
+        file.write(hashlib.sha256(payload).digest())
+        file.write(payload)
+
+    # Readers never see a partial entry
+    os.replace(temp, path)
+    evict()
+
+def evict():
+    """Remove the least recently used entries until the cache fits"""
+    entries = []
+
+    with os.scandir(CACHE_DIR) as scan:
+        for entry in scan:
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            except FileNotFoundError:
+                pass # removed by another process
+
+    total = sum(entry[1] for entry in entries)
+    entries.sort()
+
+    for _, size, path in entries:
+        if total <= CACHE_SIZE:
+            break
+
+        remove(path)
+        total -= size
+
+def remove(path):
+    """Remove an entry, ignoring one that another process already removed"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
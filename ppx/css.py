@@ -0,0 +1,176 @@
+"""Remove unused rules from a stylesheet"""
+
+import re
+
+# A compound selector made only of a tag, classes, ids and pseudo-classes
+# without arguments, e.g. p.center:first-child
+COMPOUND = re.compile(r'(?:[a-zA-Z][\w-]*|\*)?(?:[.#][\w-]+|::?[\w-]+)*')
+COMBINATOR = re.compile(r'\s*[>+~]\s*|\s+')
+TAG = re.compile(r'[a-zA-Z][\w-]*')
+CLASS = re.compile(r'\.([\w-]+)')
+ID = re.compile(r'#([\w-]+)')
+
+def prune(style, tags, classes, ids):
+    """
+    Drop the selectors that cannot match anything in a document that uses
+    only the given tags, classes and ids, and the rules left without any
+    selector. At-rules, comments and selectors that are not simple enough to
+    judge are kept as they are.
+    """
+    result = []
+    i = 0
+
+    while i < len(style):
+        start = skip_space(style, i)
+        result.append(style[i:start])
+
+        if start == len(style):
+            break
+
+        brace = find_top(style, start)
+
+        if brace == len(style):
+            # Unterminated statement
+            result.append(style[start:])
+            break
+
+        if style[brace] == ';':
+            end = brace + 1
+            result.append(style[start:end])
+        else:
+            end = block_end(style, brace)
+            prelude = style[start:brace]
+
+            if prelude.startswith('@'):
+                result.append(style[start:end])
+            else:
+                selectors = prune_selectors(prelude, tags, classes, ids)
+
+                if selectors:
+                    result.append(selectors + style[brace:end])
+                else:
+                    # Drop the rule along with the rest of its line
+                    newline = style.find('\n', end)
+
+                    if newline >= 0 and not style[end:newline].strip():
+                        end = newline + 1
+
+        i = end
+
+    return ''.join(result)
+
+def skip_space(style, i):
+    """Skip whitespace and comments"""
+    while i < len(style):
+        if style[i].isspace():
+            i += 1
+        elif style.startswith('/*', i):
+            i = skip_comment(style, i)
+        else:
+            break
+
+    return i
+
+def skip_comment(style, i):
+    end = style.find('*/', i + 2)
+    return len(style) if end < 0 else end + 2
+
+def skip_string(style, i):
+    quote = style[i]
+    i += 1
+
+    while i < len(style) and style[i] != quote:
+        i += 2 if style[i] == '\\' else 1
+
+    return i + 1
+
+def find_top(style, i):
+    """Find the { or ; that ends the statement starting at i"""
+    depth = 0
+
+    while i < len(style):
+        c = style[i]
+
+        if c in '"\'':
+            i = skip_string(style, i)
+            continue
+
+        if style.startswith('/*', i):
+            i = skip_comment(style, i)
+            continue
+
+        if c in '([':
+            depth += 1
+        elif c in ')]':
+            depth -= 1
+        elif c in '{;' and depth == 0:
+            return i
+
+        i += 1
+
+    return len(style)
+
+def block_end(style, i):
+    """Find the end of the block whose { is at i, including nested blocks"""
+    depth = 0
+
+    while i < len(style):
+        c = style[i]
+
+        if c in '"\'':
+            i = skip_string(style, i)
+            continue
+
+        if style.startswith('/*', i):
+            i = skip_comment(style, i)
+            continue
+
+        if c == '{':
+            depth += 1
+        elif c == '}':
+            depth -= 1
+
+            if depth == 0:
+                return i + 1
+
+        i += 1
+
+    return len(style)
+
+def prune_selectors(prelude, tags, classes, ids):
+    """Return the selector list without the selectors that cannot match, or
+    None if none can"""
+    if any(c in prelude for c in '/"\'()[]\\'):
+        # Too complex to judge
+        return prelude
+
+    trailing = prelude[len(prelude.rstrip()):]
+    selectors = prelude.split(',')
+    kept = [s for s in selectors if can_match(s.strip(), tags, classes, ids)]
+
+    if not kept:
+        return None
+
+    if len(kept) == len(selectors):
+        return prelude
+
+    return ','.join(kept).strip() + trailing
+
+def can_match(selector, tags, classes, ids):
+    """Could every compound of the selector match what the document uses?"""
+    for compound in COMBINATOR.split(selector):
+        if not COMPOUND.fullmatch(compound):
+            return True
+
+        tag = TAG.match(compound)
+
+        if tag and tag.group().lower() not in tags:
+            return False
+
+        if any(c not in classes for c in CLASS.findall(compound)):
+            return False
+
+        if any(i not in ids for i in ID.findall(compound)):
+            return False
+
+    return True
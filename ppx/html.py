@@ -1,21 +1,48 @@
 """Write HTML format"""
 # pylint: disable=missing-function-docstring
 
+import re
 import sys
 import process
 
-from share import Mode, Processing
+from share import Capture, Fragments, Mode, Processing, has_caption
+
+# The modules for pruning the style, the search index and the offsets are
+# imported when those are wanted, to keep startup short.
+# pylint: disable=import-outside-toplevel
+
+STYLESHEET = 'out.css' # shared by the files of a split book
+
+ATTRIBUTE = re.compile(r'\b(class|id)="([^"]*)"')
 
 class Context:
     """Context manager"""
     def __init__(self):
+        self.capture = None
+        self.chapters = 0
         self.file = None
+        self.file_index = 0
+        self.file_name = None
+        self.hidden = False
+        self.id_files = {}
+        self.index = None
+        self.index_url = None
         self.mode = None
+        self.offsets = None
+        self.output = None
+        self.split = False
+        self.style = ''
         self.tag_stack = []
+        self.title = None
+        self.tn_fragments = Fragments()
 
-    def open(self):
-        # pylint: disable=consider-using-with
-        self.file = open('out.html', mode='w', encoding='utf-8')
+    def open(self, name):
+        self.file = self.output.open(name)
+        self.file_name = name
+
+        if self.offsets:
+            import sink
+            self.file = sink.Counted(self.file)
 
     def close(self):
         self.file.close()
@@ -23,7 +50,16 @@ class Context:
         assert len(self.tag_stack) == 0
 
     def print(self, string):
-        self.file.write(string)
+        if self.capture:
+            self.capture.write(string)
+
+        if not self.hidden:
+            self.file.write(string)
+
+def mark(kind, name):
+    # The place starts at the next thing written
+    if context.offsets:
+        context.offsets.add(kind, name, context.file_name, context.file.offset)
 
 def start(tag, attributes=None, newline=False):
     context.tag_stack.append(tag)
@@ -64,6 +100,18 @@ def data(text):
 
     context.print(text)
 
+def book_data(text):
+    # The text of the book, which also goes into the search index
+    if context.index and not context.hidden:
+        context.index.add(text)
+
+    data(text)
+
+def index_move(anchor, label):
+    if context.index:
+        file = context.file_name if context.split else ''
+        context.index.move(file, anchor, label)
+
 def blockquote_open(_elem):
     start('div', 'class="blockquot"', newline=True)
 
@@ -75,11 +123,14 @@ def book_open(elem):
 
     if title is None:
         print('Missing title element', file=sys.stderr)
-        sys.exit()
+        sys.exit(1)
 
-    full_title = f'{title.text} | Project Gutenberg'
+    context.title = f'{title.text} | Project Gutenberg'
     elem.remove(title)
 
+    write_head()
+
+def write_head():
     context.print('<!DOCTYPE html>')
     start('html', 'lang="en"', newline=True)
     start('head', newline=True)
@@ -87,47 +138,176 @@ def book_open(elem):
     empty('meta', 'charset="UTF-8"', True)
 
     start('title', newline=True)
-    data(full_title)
+    data(context.title)
     end('title')
 
     empty('link', 'rel="icon" href="images/cover.jpg" type="image/x-cover"', True)
-    start('style', newline=True)
 
-    with open('style.css', encoding='utf-8') as css:
-        style = css.read()
+    if context.split:
+        empty('link', f'rel="stylesheet" href="{STYLESHEET}"', True)
+    else:
+        start('style', newline=True)
         context.print('\n')
-        context.print(style)
+        context.print(context.style)
+        end('style')
+
+    if context.index:
+        import search
+        start('script', f'src="{search.SCRIPT}" data-index="{context.index_url}" '
+              'defer', newline=True)
+        end('script')
 
-    end('style')
     end('head', newline=True)
     start('body', newline=True)
 
+def used_names(book, fn_list, tn_list):
+    """The tags, classes and ids that the book is written with, found before
+    it is written, so that the pruned stylesheet can go in its head"""
+    tags = {'html', 'head', 'meta', 'title', 'link', 'body'}
+    classes = set()
+    ids = set()
+    chapters = 0
+
+    if not context.split:
+        tags.add('style')
+
+    if context.index:
+        tags.add('script')
+
+    for elem in book.iter():
+        written = WRITTEN.get(elem.tag)
+
+        if written is None:
+            continue
+
+        tags.update(written[0])
+        classes.update(written[1])
+        tag = elem.tag
+
+        if tag in ('anchor', 'footnote', 'tn'):
+            if elem.get('index'):
+                ids.add(ID_PREFIXES[tag] + elem.get('index'))
+        elif tag == 'pb' and elem.get('n'):
+            tags.add('a')
+            ids.add(f'Page_{elem.get("n")}')
+        elif tag == 'illustration' and has_caption(elem):
+            tags.add('figcaption')
+        elif tag == 'headgroup':
+            chapters += 1
+        elif tag == 'sc':
+            classes.add(sc_class(elem))
+        elif handlers[tag][0] is dflt_open and elem.attrib:
+            name, value = next(iter(elem.attrib.items()))
+
+            if name == 'class':
+                classes.update(value.split())
+            elif name == 'id':
+                ids.add(value)
+
+    if context.index:
+        ids.update(f'chapter_{n}' for n in range(1, chapters + 1))
+
+    if fn_list:
+        tags.update(('div', 'h2', 'a'))
+        classes.add('nobreak')
+        ids.add('footnotes')
+
+    if tn_list:
+        tags.update(('div', 'h2', 'p', 'ul', 'li', 'a'))
+        classes.add('nobreak')
+        ids.add('transnote')
+
+    return tags, classes, ids
+
+def chapter_file(index):
+    return f'out_{index:03}.html'
+
+def next_file():
+    """Finish the current file of a split book and start the next one"""
+    end('body', newline=True)
+    end('html', newline=True)
+    context.print('\n')
+    context.close()
+
+    context.file_index += 1
+    context.open(chapter_file(context.file_index))
+    write_head()
+
+def link(target):
+    """Get the link to an id, which may be in another file of a split book"""
+    name = context.id_files.get(target)
+
+    if name is None or name == context.file_name:
+        return f'#{target}'
+
+    return f'{name}#{target}'
+
 def br_open(_elem):
     empty('br')
 
+def g_open(_elem):
+    start('em', 'class="gesperrt"')
+
+def g_close(_elem):
+    end('em')
+
+def greek_open(_elem):
+    # Greek transliterated into the Latin alphabet
+    start('span', 'class="greek" lang="grc-Latn"')
+
+def greek_close(_elem):
+    end('span')
+
 def head_open(_elem):
     start('h2', 'class="nobreak"')
 
 def head_close(_elem):
     end('h2')
 
-def headgroup_open(_elem):
-    start('div', 'class="chapter"')
+def headgroup_open(elem):
+    # Each chapter of a split book starts a new file. Only headgroups at the
+    # top level, directly within <html> and <body>, count as chapters.
+    if context.split and len(context.tag_stack) == 2:
+        next_file()
+
+    context.chapters += 1
+    mark('chapter', context.chapters)
+
+    if context.index:
+        # Search results link to the chapter
+        anchor = f'chapter_{len(context.index.chapters) + 1}'
+        heads = ' '.join(''.join(head.itertext())
+                         for head in elem.iter('head'))
+        title = ' '.join(heads.split())
+        file = context.file_name if context.split else ''
+        context.index.chapter(file, anchor, title)
+        start('div', f'class="chapter" id="{anchor}"')
+    else:
+        start('div', 'class="chapter"')
 
 def headgroup_close(_elem):
     end('div')
 
 def ill_open(elem):
     src = elem.get('src')
+    width = elem.get('width')
 
     start('figure')
-    empty('img', f'src="{src}" alt=""')
 
-    if len(elem):
+    # With its dimensions known, the image keeps its place in the layout
+    # while it loads
+    if width:
+        size = f' width="{width}" height="{elem.get("height")}"'
+    else:
+        size = ''
+
+    empty('img', f'src="{src}"{size} alt="" loading="lazy"')
+
+    if has_caption(elem):
         start('figcaption')
 
 def ill_close(elem):
-    if len(elem):
+    if has_caption(elem):
         end('figcaption')
 
     end('figure')
@@ -138,14 +318,29 @@ def nowrap_open(_elem):
 def nowrap_close(_elem):
     end('div')
 
+def pageref_open(elem):
+    href = link(f'Page_{elem.get("page")}')
+    start('a', f'href="{href}"')
+
+def pageref_close(_elem):
+    end('a')
+
 def pb_open(elem):
     page_number = elem.get('n')
 
     if page_number:
+        mark('page', page_number)
         start('a', f'id="Page_{page_number}"')
         end('a')
+        index_move(f'Page_{page_number}', f'Page {page_number}')
 
-def sc_open(elem):
+def sidenote_open(_elem):
+    start('div', 'class="sidenote"', newline=True)
+
+def sidenote_close(_elem):
+    end('div')
+
+def sc_class(elem):
     # Is the child text all upper case?
     text = ''
     for child in elem.iter():
@@ -156,11 +351,12 @@ def sc_open(elem):
             text += child.tail
 
     if text.isupper():
-        span_class = 'allsmcap'
-    else:
-        span_class = 'smcap'
+        return 'allsmcap'
+
+    return 'smcap'
 
-    start('span', f'class="{span_class}"')
+def sc_open(elem):
+    start('span', f'class="{sc_class(elem)}"')
 
 def sc_close(_elem):
     end('span')
@@ -178,26 +374,23 @@ def dflt_close(elem):
     end(elem.tag)
 
 def tn_open(elem):
-    skip = None
-
-    if context.mode in (Mode.NORMAL, Mode.FOOTNOTES):
-        # Add an anchor for this correction
-        index = elem.get('index')
-        start('a', f'id="corr{index}"')
-    elif context.mode in (Mode.TN_DEL, Mode.TN_INS):
-        start('li', newline=True)
-        skip = Processing.SKIP_TAIL
-
-    return skip
+    # Add an anchor for this correction, then capture the text before and
+    # after the correction for the transcriber's notes
+    index = elem.get('index')
+    mark('tn', index)
+    start('a', f'id="corr{index}"')
+    context.capture = Capture()
 
-def tn_close(_elem):
-    if context.mode in (Mode.NORMAL, Mode.FOOTNOTES):
-        end('a')
-    elif context.mode in (Mode.TN_DEL, Mode.TN_INS):
-        end('li')
+def tn_close(elem):
+    context.tn_fragments.add(elem.get('index'), context.capture.result())
+    context.capture = None
+    end('a')
 
 def del_open(_elem):
-    if context.mode == Mode.TN_DEL:
+    # Deleted text only appears in the transcriber's notes
+    if context.capture:
+        context.capture.side = Mode.TN_DEL
+        context.hidden = True
         start('del')
         skip = None
     else:
@@ -206,29 +399,43 @@ def del_open(_elem):
     return skip
 
 def del_close(_elem):
-    if context.mode == Mode.TN_DEL:
+    if context.capture:
         end('del')
+        context.hidden = False
+        context.capture.side = None
 
 def ins_open(_elem):
-    skip = None
-
-    if context.mode == Mode.TN_INS:
+    # Inserted text appears in the book, and marked up in the notes
+    if context.capture:
+        context.capture.side = Mode.TN_INS
+        context.hidden = True
         start('ins')
-    elif context.mode == Mode.TN_DEL:
-        skip = Processing.SKIP_DATA
-
-    return skip
+        context.hidden = False
 
 def ins_close(_elem):
-    if context.mode == Mode.TN_INS:
+    if context.capture:
+        context.hidden = True
         end('ins')
+        context.hidden = False
+        context.capture.side = None
 
 def fn_open(elem):
     if context.mode == Mode.FOOTNOTES:
         index = elem.get('index')
-        start('div', newline=True)
-        start('a', f'id="Footnote_{index}" href="#FNanchor_{index}"')
-        data(f'[{index}]')
+
+        # A footnote without an anchor keeps its label, unlinked
+        if index is None:
+            start('div', newline=True)
+            start('a')
+            data(f'[{elem.get("n")}]')
+        else:
+            index_move(f'Footnote_{index}', f'Footnote {index}')
+            mark('footnote', index)
+            start('div', newline=True)
+            href = link(f'FNanchor_{index}')
+            start('a', f'id="Footnote_{index}" href="{href}"')
+            data(f'[{index}]')
+
         end('a')
         skip = Processing.SKIP_TAIL
     else:
@@ -242,7 +449,15 @@ def fn_close(_elem):
 
 def anchor_open(elem):
     index = elem.get('index')
-    start('a', f'id="FNanchor_{index}" href="#Footnote_{index}" class="fnanchor"')
+
+    # An anchor without a footnote keeps its label, unlinked
+    if index is None:
+        start('a', 'class="fnanchor"')
+        data(f'[{elem.get("n")}]')
+        return
+
+    href = link(f'Footnote_{index}')
+    start('a', f'id="FNanchor_{index}" href="{href}" class="fnanchor"')
     data(f'[{index}]')
 
 def anchor_close(_elem):
@@ -254,6 +469,12 @@ def sectionbreak_open(_elem):
 def sectionbreak_close(_elem):
     end('div')
 
+def toc_open(_elem):
+    start('div', 'class="toc"', newline=True)
+
+def toc_close(_elem):
+    end('div')
+
 def tb_open(_elem):
     empty('hr')
 
@@ -266,6 +487,8 @@ handlers = {
     'del':          (del_open,    del_close   ),
     'div':          (dflt_open,   dflt_close  ),
     'footnote':     (fn_open,     fn_close    ),
+    'g':            (g_open,      g_close     ),
+    'greek':        (greek_open,  greek_close ),
     'h1':           (dflt_open,   dflt_close  ),
     'head':         (head_open,   head_close  ),
     'headgroup':    (headgroup_open, headgroup_close ),
@@ -274,14 +497,54 @@ handlers = {
     'ins':          (ins_open,    ins_close   ),
     'nowrap':       (nowrap_open, nowrap_close ),
     'p':            (dflt_open,   dflt_close  ),
+    'pageref':      (pageref_open, pageref_close ),
     'pb':           (pb_open,     None        ),
     'sc':           (sc_open,     sc_close    ),
     'sectionbreak': (sectionbreak_open, sectionbreak_close ),
+    'sidenote':     (sidenote_open, sidenote_close ),
     'span':         (dflt_open,   dflt_close  ),
+    'sub':          (dflt_open,   dflt_close  ),
+    'sup':          (dflt_open,   dflt_close  ),
     'tb':           (tb_open,     None        ),
     'tn':           (tn_open,     tn_close    ),
+    'toc':          (toc_open,    toc_close   ),
+}
+
+# The tags and classes that each tag of the book is always written with.
+# Those that depend on the element, and the ids, are added by used_names.
+WRITTEN = {
+    'anchor':       ({'a'},      {'fnanchor'}),
+    'b':            ({'b'},      ()),
+    'blockquote':   ({'div'},    {'blockquot'}),
+    'br':           ({'br'},     ()),
+    'del':          ({'del'},    ()),
+    'div':          ({'div'},    ()),
+    'footnote':     ({'div', 'a'}, ()),
+    'g':            ({'em'},     {'gesperrt'}),
+    'greek':        ({'span'},   {'greek'}),
+    'h1':           ({'h1'},     ()),
+    'head':         ({'h2'},     {'nobreak'}),
+    'headgroup':    ({'div'},    {'chapter'}),
+    'i':            ({'i'},      ()),
+    'illustration': ({'figure', 'img'}, ()),
+    'ins':          ({'ins'},    ()),
+    'nowrap':       ({'div'},    {'nowrap'}),
+    'p':            ({'p'},      ()),
+    'pageref':      ({'a'},      ()),
+    'pb':           ((),         ()),
+    'sc':           ({'span'},   ()),
+    'sectionbreak': ({'div'},    {'section-break'}),
+    'sidenote':     ({'div'},    {'sidenote'}),
+    'span':         ({'span'},   ()),
+    'sub':          ({'sub'},    ()),
+    'sup':          ({'sup'},    ()),
+    'tb':           ({'hr'},     ()),
+    'tn':           ({'a'},      ()),
+    'toc':          ({'div'},    {'toc'}),
 }
 
+ID_PREFIXES = {'anchor': 'FNanchor_', 'footnote': 'Footnote_', 'tn': 'corr'}
+
 def write_footnotes(fn_list):
     start('div', 'id="footnotes"', newline=True)
     start('h2', 'class="nobreak"', newline=True)
@@ -289,11 +552,14 @@ def write_footnotes(fn_list):
     end('h2')
 
     for elem in fn_list:
-        process.process(elem, handlers, data)
+        process.process(elem, handlers, book_data)
 
     end('div')
 
 def write_transnote(tn_list):
+    if context.index:
+        context.index.stop()
+
     start('div', 'id="transnote"', newline=True)
     start('h2', 'class="nobreak"', newline=True)
     data('Transcriber’s Notes')
@@ -307,16 +573,18 @@ def write_transnote(tn_list):
         # Link to the correction anchor
         start('li', newline=True)
         index = elem.get('index')
-        start('a', f'href="#corr{index}"')
+        href = link(f'corr{index}')
+        start('a', f'href="{href}"')
         data(elem.get('loc'))
         end('a')
         start('ul')
 
-        context.mode = Mode.TN_DEL
-        process.process(elem, handlers, data)
-
-        context.mode = Mode.TN_INS
-        process.process(elem, handlers, data)
+        # The text before and after the correction, as captured when the
+        # note was rendered in the book
+        for fragment in context.tn_fragments.get(index):
+            start('li', newline=True)
+            context.print(fragment)
+            end('li')
 
         end('ul')
         end('li')
@@ -324,13 +592,85 @@ def write_transnote(tn_list):
     end('ul')
     end('div')
 
+def map_ids(book):
+    """Find the file that each linked id goes into when the book is split.
+    The front matter goes into the first file, each chapter into a file of
+    its own, and the footnotes and transcriber's notes into the last file.
+    """
+    id_files = {}
+    chapters = sum(1 for elem in book if elem.tag == 'headgroup')
+    notes = chapter_file(chapters + 1)
+    index = 0
+
+    def visit(parent, name):
+        for elem in parent:
+            if elem.tag == 'footnote':
+                if elem.get('index'):
+                    id_files[f'Footnote_{elem.get("index")}'] = notes
+
+                visit(elem, notes)
+                continue
+
+            if elem.tag == 'anchor' and elem.get('index'):
+                id_files[f'FNanchor_{elem.get("index")}'] = name
+            elif elem.tag == 'pb' and elem.get('n'):
+                id_files[f'Page_{elem.get("n")}'] = name
+            elif elem.tag == 'tn':
+                id_files[f'corr{elem.get("index")}'] = name
+
+            visit(elem, name)
+
+    for elem in book:
+        if elem.tag == 'headgroup':
+            index += 1
+
+        visit([elem], chapter_file(index))
+
+    return id_files
+
 context = Context()
 
-def write_book(book, fn_list, tn_list):
-    context.open()
+def write_book(book, fn_list, tn_list, output, style, split=False,
+               index=False, offsets=False):
+    """Write the book to out.html, or when split, to one file for the front
+    matter, one per chapter and one for the notes, sharing out.css. With
+    index, also write a search index and the script that searches it. With
+    offsets, also write the places in the files to out.html.idx.
+    """
+    # pylint: disable=global-statement
+    global context
+    context = Context()
+    context.output = output
+    context.split = split
+
+    if offsets:
+        import sink
+        context.offsets = sink.Offsets()
+
+    if index:
+        import search
+        context.index = search.Index()
+        # Gzipped unless the output is already compressed
+        compressed = output.compress is None
+        context.index_url = search.INDEX + ('.gz' if compressed else '')
+
+    if style:
+        import css
+        context.style = css.prune(style, *used_names(book, fn_list, tn_list))
+
+    if split:
+        context.id_files = map_ids(book)
+        context.file_index = 0
+        context.open(chapter_file(0))
+    else:
+        context.open('out.html')
 
     context.mode = Mode.NORMAL
-    process.process(book, handlers, data)
+    index_move('', '')
+    process.process(book, handlers, book_data)
+
+    if split and (fn_list or tn_list):
+        next_file()
 
     if fn_list:
         context.mode = Mode.FOOTNOTES
@@ -343,4 +683,24 @@ def write_book(book, fn_list, tn_list):
     end('html', newline=True)
 
     context.print('\n')
+
     context.close()
+
+    if split:
+        file = output.open(STYLESHEET)
+        file.write(context.style)
+        file.close()
+
+    if index:
+        file = output.open(search.INDEX, compressed)
+        context.index.write(file)
+        file.close()
+
+        file = output.open(search.SCRIPT)
+        file.write(search.script())
+        file.close()
+
+    if offsets:
+        file = output.open('out.html.idx')
+        context.offsets.write(file)
+        file.close()
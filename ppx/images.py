@@ -0,0 +1,148 @@
+"""Image files and their pixel dimensions"""
+
+import collections
+import glob
+import json
+import os
+
+Image = collections.namedtuple('Image', 'src width height')
+
+PNG = b'\x89PNG\r\n\x1a\n'
+GIF = (b'GIF87a', b'GIF89a')
+JPEG = b'\xff\xd8'
+
+# JPEG start of frame markers, which hold the dimensions. C4, C8 and CC
+# are other markers in the same range.
+SOF = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+
+def png_size(header, _file):
+    if header[12:16] == b'IHDR':
+        return (int.from_bytes(header[16:20], 'big'),
+                int.from_bytes(header[20:24], 'big'))
+
+    return None
+
+def gif_size(header, _file):
+    return (int.from_bytes(header[6:8], 'little'),
+            int.from_bytes(header[8:10], 'little'))
+
+def jpeg_size(_header, file):
+    """Walk the JPEG segments up to the start of frame, skipping the rest"""
+    file.seek(2)
+
+    while True:
+        marker = file.read(2)
+
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+
+        code = marker[1]
+
+        # Markers may be padded with fill bytes
+        while code == 0xff:
+            byte = file.read(1)
+
+            if not byte:
+                return None
+
+            code = byte[0]
+
+        # Markers without a segment
+        if code == 0x01 or 0xd0 <= code <= 0xd8:
+            continue
+
+        length = file.read(2)
+
+        # The length counts its own two bytes
+        if len(length) < 2 or int.from_bytes(length, 'big') < 2:
+            return None
+
+        if code in SOF:
+            frame = file.read(5)
+
+            if len(frame) < 5:
+                return None
+
+            return (int.from_bytes(frame[3:5], 'big'),
+                    int.from_bytes(frame[1:3], 'big'))
+
+        file.seek(int.from_bytes(length, 'big') - 2, os.SEEK_CUR)
+
+def read_size(path):
+    """Read the width and height of an image from its header, without
+    decoding it. Return None for other files, and for files that cannot be
+    read.
+    """
+    try:
+        with open(path, 'rb') as file:
+            header = file.read(32)
+
+            if header.startswith(PNG):
+                reader = png_size
+            elif header.startswith(GIF):
+                reader = gif_size
+            elif header.startswith(JPEG):
+                reader = jpeg_size
+            else:
+                return None
+
+            return reader(header, file)
+    except OSError:
+        return None
+
+def make(item):
+    """Make an Image from a link, or from a (link, width, height) triple"""
+    return Image(item, None, None) if isinstance(item, str) else Image(*item)
+
+def list_files(directory):
+    """List the image files in the directory, leaving out subdirectories"""
+    return sorted(path for path in glob.glob(os.path.join(directory, '*'))
+                  if os.path.isfile(path))
+
+def link(path):
+    """The link to an image, from the images directory beside the book"""
+    return f'images/{os.path.basename(path)}'
+
+def scan(directory, workers=None, use_cache=True):
+    """
+    List the images in the directory with their dimensions, as the book
+    links to them.
+
+    The dimensions are kept in a manifest in the cache, keyed by the
+    directory. An image whose size and modification time match its entry
+    is not read again. The others are read in parallel. Without the cache,
+    every image is read and no manifest is kept.
+    """
+    # pylint: disable=import-outside-toplevel
+    import concurrent.futures
+    import cache
+
+    paths = list_files(directory)
+    key = cache.make_key(b'images', os.path.abspath(directory).encode('utf-8'))
+    payload = cache.load(key) if use_cache else None
+    manifest = json.loads(payload) if payload else {}
+
+    stats = {}
+    changed = []
+
+    for path in paths:
+        stat = os.stat(path)
+        name = os.path.basename(path)
+        stats[name] = [stat.st_size, stat.st_mtime_ns]
+        entry = manifest.get(name)
+
+        if entry is None or entry[:2] != stats[name]:
+            changed.append(path)
+
+    if changed:
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            for path, size in zip(changed, executor.map(read_size, changed)):
+                name = os.path.basename(path)
+                manifest[name] = stats[name] + list(size or (None, None))
+
+    if use_cache and (changed or len(manifest) != len(paths)):
+        manifest = {name: manifest[name] for name in stats}
+        cache.store(key, json.dumps(manifest).encode('utf-8'))
+
+    return [Image(link(path), *manifest[os.path.basename(path)][2:])
+            for path in paths]
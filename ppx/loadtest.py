@@ -0,0 +1,107 @@
+#!/usr/bin/python
+
+"""Load test a running render server with one book.
+
+Each client connects once and sends its share of the requests in turn.
+The report gives the latencies seen by the clients and the overall
+throughput, followed by the server's own metrics.
+"""
+
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+def client(path, request, count, latencies, failures):
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.connect(path)
+        file = sock.makefile('rwb')
+
+        for _ in range(count):
+            start = time.monotonic()
+            file.write(request)
+            file.flush()
+            response = json.loads(file.readline())
+            latencies.append(time.monotonic() - start)
+
+            if 'error' in response:
+                failures.append(response['error'])
+
+def command(path, name):
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.connect(path)
+        file = sock.makefile('rwb')
+        file.write(json.dumps({'command': name}).encode('utf-8') + b'\n')
+        file.flush()
+        return json.loads(file.readline())
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('book', help='the XML book, or with --source, the '
+                                     'text for lex/xml')
+    parser.add_argument('--source', action='store_true',
+                        help='send the book as source text')
+    parser.add_argument('--style', help='the stylesheet to send')
+    parser.add_argument('--images', help='the directory of images to list')
+    parser.add_argument('--socket', default='ppx.sock',
+                        help='the server socket (default: ppx.sock)')
+    parser.add_argument('--clients', type=int, default=4,
+                        help='concurrent clients (default: 4)')
+    parser.add_argument('--requests', type=int, default=100,
+                        help='requests in all (default: 100)')
+    args = parser.parse_args()
+
+    with open(args.book, encoding='utf-8') as file:
+        request = {'source' if args.source else 'xml': file.read()}
+
+    if args.style:
+        with open(args.style, encoding='utf-8') as file:
+            request['style'] = file.read()
+
+    if args.images:
+        request['images'] = [f'images/{name}'
+                             for name in sorted(os.listdir(args.images))]
+
+    data = json.dumps(request).encode('utf-8') + b'\n'
+    latencies = []
+    failures = []
+    threads = []
+
+    for i in range(args.clients):
+        count = args.requests // args.clients
+        count += i < args.requests % args.clients
+        threads.append(threading.Thread(target=client, args=(
+            args.socket, data, count, latencies, failures)))
+
+    start = time.monotonic()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - start
+
+    if not latencies:
+        sys.exit('No requests completed')
+
+    latencies.sort()
+    print(f'{len(latencies)} requests from {args.clients} clients '
+          f'in {elapsed:.2f} s: {len(latencies) / elapsed:.1f} requests/s')
+    print(f'latency ms: mean {statistics.mean(latencies) * 1000:.1f}, '
+          f'p50 {latencies[len(latencies) // 2] * 1000:.1f}, '
+          f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}, '
+          f'max {latencies[-1] * 1000:.1f}')
+
+    if failures:
+        print(f'{len(failures)} failed, e.g. {failures[0]}')
+
+    print('server:', json.dumps(command(args.socket, 'metrics')))
+
+if __name__ == '__main__':
+    main()
@@ -2,77 +2,759 @@
 
 """Generate HTML and Text books from an XML book."""
 
-import glob
+import argparse
+import collections
+import gc
+import io
+import os
+import re
+import sys
 import xml.etree.ElementTree as ET
 
-import html
-import text
+import images
+from share import has_caption
 
-def number_pages(book):
-    """Set page numbers relative to the explicitly defined page breaks"""
-    page = None
+# The modules that only some commands need are imported where they are
+# used, to keep startup short.
+# pylint: disable=import-outside-toplevel
 
-    for elem in book.iter():
-        if elem.tag == 'pb':
-            n = elem.get('n')
+FORMATS = ('html', 'text')
 
-            if n:
-                page = int(n)
-            elif page:
-                page += 1
-                elem.set('n', page)
+# Flavors of the text book besides out.txt, as text.FLAVORS makes them
+FLAVORS = ('latin1', 'narrow')
 
-        elif elem.tag == 'tn':
-            elem.set('loc', f'Page {page}')
+# Tags that flow within a line of text. A page break followed by one of
+# these is not bare.
+INLINE = {'anchor', 'b', 'br', 'del', 'i', 'ins', 'sc', 'span', 'tn'}
 
-def number_fns(fn_list, anchor_list):
-    """Set footnote numbers from 1 to n"""
-    assert(len(fn_list) == len(anchor_list))
+# The page number at the end of a line of a table of contents
+PAGE_REF = re.compile(r'(\d+)(\s*)\Z')
 
-    for i, fn in enumerate(fn_list):
-        fn.set('index', i + 1)
+# The sampler of a run with --profile, for the forked writers to save
+# their samples to
+profiler = None # pylint: disable=invalid-name
 
-    for i, anchor in enumerate(anchor_list):
-        anchor.set('index', i + 1)
+class Normalizer:
+    """
+    Number and rearrange the book in a single walk.
 
-def number_tns(tn_list):
-    """Set transcriber's note numbers from 1 to n"""
-    index = 1
+    The walk calls the open and close rules for each tag, as listed in
+    RULES. Rules that change the structure of the tree only queue the
+    change; the changes are applied after the walk so it never runs over
+    a tree that is changing under it. A new rule goes into RULES and
+    rides along with the same walk.
+    """
+    def __init__(self, files):
+        self.files = [images.make(item) for item in files]
+        self.following = None
+        self.page = None
 
-    for elem in tn_list:
-        elem.set('index', index)
-        index += 1
+        self.anchor_list = []
+        self.ill_list = []
+        self.tn_list = []
 
-def source_images(book):
-    """Assign file names to the illustration XML tags"""
-    illustrations = book.findall('.//illustration')
-    files = glob.glob('images/*')
-    files.sort()
+        self.pages = {} # page number -> n of its page break
+        self.tocs = []
 
-    for i, ill in enumerate(illustrations):
-        ill.set('src', files[i])
+        # Anchors waiting for their footnotes, by label, and the anchors of
+        # this page and the one before, as (index, page, elem)
+        self.waiting = {}
+        self.page_anchors = []
+        self.previous_anchors = []
+        self.last_anchor = -1
 
-def parse_book():
-    """Parse the XML book into Python data structures"""
-    #tree = ET.parse(sys.stdin)
-    tree = ET.parse('x.xml')
-    book = tree.getroot()
-    number_pages(book)
+        # Footnotes matched to their anchors, as (index, anchor, footnote)
+        self.pairs = []
 
-    fn_list = book.findall('.//footnote')
-    anchor_list = book.findall('.//anchor')
-    number_fns(fn_list, anchor_list)
+        # Footnotes of this page waiting for their anchors further down it,
+        # by label
+        self.early = {}
+        self.page_notes = []
 
-    tn_list = book.findall('.//tn')
-    number_tns(tn_list)
+        self.warnings = []
 
-    source_images(book)
-    return book, fn_list, tn_list
+        self.last_p = {}
+        self.pending = []
+        self.held = []
 
-def main():
+        self.moves = []
+        self.merges = []
+        self.removals = {}
+
+    def walk(self, parent):
+        children = list(parent)
+        following = children[1:] + [None]
+
+        for elem, self.following in zip(children, following):
+            rules = RULES.get(elem.tag)
+
+            if rules is None:
+                # Other blocks keep the page breaks before them, and those
+                # at their end
+                if elem.tag not in INLINE:
+                    self.keep_breaks(parent, elem)
+
+                if len(elem):
+                    self.walk(elem)
+
+                if elem.tag not in INLINE:
+                    self.keep_breaks(parent, elem)
+                continue
+
+            open_rule, close_rule = rules
+
+            if open_rule:
+                open_rule(self, parent, elem)
+
+            if len(elem):
+                self.walk(elem)
+
+            if close_rule:
+                close_rule(self, parent, elem)
+
+    def anchor(self, _parent, elem):
+        anchor = (len(self.anchor_list), self.page, elem)
+        self.anchor_list.append(elem)
+        notes = self.early.get(elem.get('n'))
+
+        # A footnote that came first on the page takes the anchor
+        if notes:
+            _, note = notes.popleft()
+            self.pairs.append((anchor[0], elem, note))
+            self.last_anchor = anchor[0]
+            return
+
+        self.page_anchors.append(anchor)
+        self.waiting.setdefault(elem.get('n'), collections.deque()).append(
+            anchor)
+
+    def block(self, _parent, elem):
+        """Move the bare page breaks seen since the last block to the start
+        of this block
+        """
+        if self.pending:
+            self.moves.append((self.pending, elem))
+            self.pending = []
+
+    def keep_breaks(self, _parent, _elem):
+        """Leave the bare page breaks seen since the last block where they
+        are. Only headings, paragraphs, tables of contents and captions
+        take the page breaks before them.
+        """
+        self.pending = []
+
+    def boundary(self, parent, _elem):
+        """Paragraphs are never merged across headings or breaks"""
+        self.last_p.pop(parent, None)
+
+    def section_break(self, parent, elem):
+        self.boundary(parent, elem)
+        self.keep_breaks(parent, elem)
+
+    def fn_open(self, _parent, elem):
+        # Footnotes are rendered away from the text; keep page breaks out
+        self.match_note(elem)
+        self.held = self.pending
+        self.pending = []
+
+    def fn_close(self, _parent, _elem):
+        self.pending = self.held
+        self.held = []
+
+    def illustration(self, parent, elem):
+        # The page of an illustration without a caption starts before it
+        if has_caption(elem):
+            self.block(parent, elem)
+        else:
+            self.keep_breaks(parent, elem)
+
+        image = self.files[len(self.ill_list)]
+        elem.set('src', image.src)
+
+        if image.width:
+            elem.set('width', str(image.width))
+            elem.set('height', str(image.height))
+
+        self.ill_list.append(elem)
+
+    def paragraph(self, parent, elem):
+        """Merge a paragraph continued across a page break into the previous
+        paragraph
+        """
+        self.block(parent, elem)
+
+        if elem.get('type') == 'merge':
+            del elem.attrib['type']
+            previous = self.last_p.get(parent)
+
+            if previous is not None:
+                self.merges.append((previous, elem))
+                self.remove(parent, elem)
+                return
+
+        self.last_p[parent] = elem
+
+    def page_break(self, parent, elem):
+        """Number the page, and queue a move if the page break is bare, with
+        no text after it before the next block
+        """
+        self.expire_anchors()
+        n = elem.get('n')
+
+        if n:
+            self.page = int(n)
+        elif self.page:
+            self.page += 1
+            elem.set('n', str(self.page))
+
+        if elem.get('n'):
+            self.pages[self.page] = elem.get('n')
+
+        if (elem.tail or '').strip():
+            return
+
+        if self.following is None or self.following.tag not in INLINE:
+            self.pending.append((parent, elem))
+
+    def toc(self, _parent, elem):
+        """Find the page numbers that end the lines of a table of contents.
+        They are linked once every page is known, after the walk.
+        """
+        refs = {}
+        lines = [(-1, elem.text)] + [(i, child.tail)
+                                     for i, child in enumerate(elem)]
+        following = list(elem) + [None]
+
+        for (position, text), after in zip(lines, following):
+            if after is None or after.tag == 'br':
+                match = PAGE_REF.search(text or '')
+
+                if match:
+                    refs[position] = match
+
+        self.tocs.append((elem, refs))
+
+    def match_note(self, elem):
+        """Match a footnote to the first anchor with its label that is still
+        waiting for one. Without one, the footnote waits for an anchor
+        further down its page. Footnotes out of the order of their anchors
+        are reported.
+        """
+        label = elem.get('n')
+        anchors = self.waiting.get(label)
+
+        if not anchors:
+            note = (self.page, elem)
+            self.page_notes.append(note)
+            self.early.setdefault(label, collections.deque()).append(note)
+            return
+
+        index, _, anchor = anchors.popleft()
+        self.pairs.append((index, anchor, elem))
+
+        if index < self.last_anchor:
+            self.report(self.warnings, elem, self.page,
+                        f'footnote [{label}] is out of order')
+
+        self.last_anchor = max(self.last_anchor, index)
+
+    def expire_anchors(self):
+        """At a page break, stop waiting for the footnotes of the page before
+        last, and for the anchors of the footnotes of this page. A footnote
+        may follow its anchor onto the next page, where a paragraph runs
+        over the page break, but no further.
+        """
+        for anchor in self.previous_anchors:
+            _, page, elem = anchor
+            anchors = self.waiting[elem.get('n')]
+
+            # Anchors are matched first to last, so an unmatched anchor of
+            # the page before last is the first that waits
+            if anchors and anchors[0] is anchor:
+                anchors.popleft()
+                self.report(self.warnings, elem, page,
+                            f'anchor [{elem.get("n")}] has no footnote')
+
+        for note in self.page_notes:
+            page, elem = note
+            notes = self.early[elem.get('n')]
+
+            if notes and notes[0] is note:
+                notes.popleft()
+                self.report(self.warnings, elem, page,
+                            f'footnote [{elem.get("n")}] has no anchor')
+
+        self.previous_anchors = self.page_anchors
+        self.page_anchors = []
+        self.page_notes = []
+
+    def finish_notes(self):
+        """Report the anchors of the last two pages that have no footnote,
+        and the footnotes of the last page that have no anchor
+        """
+        self.expire_anchors()
+        self.expire_anchors()
+
+    @staticmethod
+    def report(messages, elem, page, message):
+        where = locate(elem, page)
+        messages.append(f'{where}: {message}' if where else message)
+
+    def tn(self, _parent, elem):
+        elem.set('loc', f'Page {self.page}')
+        elem.set('index', str(len(self.tn_list) + 1))
+        self.tn_list.append(elem)
+
+    def remove(self, parent, elem):
+        self.removals.setdefault(parent, set()).add(elem)
+
+    def link_pages(self, toc, refs):
+        """Wrap each page number in a reference to its page, or report it
+        if there is no such page
+        """
+        children = list(toc)
+        linked = []
+
+        # The children are rebuilt in one pass; inserting each reference
+        # would shift the rest of a long table every time
+        for position in range(-1, len(children)):
+            if position >= 0:
+                linked.append(children[position])
+
+            match = refs.get(position)
+
+            if match is None:
+                continue
+
+            number = match.group(1)
+            n = self.pages.get(int(number))
+            text = match.string
+
+            if n is None:
+                entry = ' '.join(text[:match.start()].split())
+                self.warnings.append(f'Contents: no page {number} for '
+                                     f'"{entry}"')
+                continue
+
+            if position < 0:
+                toc.text = text[:match.start()]
+            else:
+                children[position].tail = text[:match.start()]
+
+            ref = ET.Element('pageref', page=n)
+            ref.text = number
+            ref.tail = match.group(2)
+            linked.append(ref)
+
+        toc[:] = linked
+
+    def apply(self):
+        """Apply the queued changes to the tree"""
+        for toc, refs in self.tocs:
+            self.link_pages(toc, refs)
+
+        ended = []
+
+        for group, _block in self.moves:
+            for parent, pb in group:
+                self.remove(parent, pb)
+
+                if parent[-1] is pb:
+                    ended.append(parent)
+
+        for parent, doomed in self.removals.items():
+            remove_children(parent, doomed)
+
+        # The line end before a page break at the end of a block goes with
+        # the page break
+        for parent in ended:
+            strip_line_end(parent)
+
+        for group, block in self.moves:
+            block[0:0] = [pb for _, pb in group]
+            group[-1][1].tail = block.text
+            block.text = None
+
+        for previous, elem in self.merges:
+            append_text(previous, '\n')
+            append_text(previous, elem.text)
+            previous.extend(list(elem))
+
+RULES = {
+    'anchor':       (Normalizer.anchor,      None ),
+    'footnote':     (Normalizer.fn_open,     Normalizer.fn_close ),
+    'head':         (Normalizer.block,       None ),
+    'headgroup':    (Normalizer.boundary,    None ),
+    'illustration': (Normalizer.illustration, None ),
+    'p':            (Normalizer.paragraph,   None ),
+    'pb':           (Normalizer.page_break,  None ),
+    'sectionbreak': (Normalizer.section_break, None ),
+    'tb':           (Normalizer.section_break, None ),
+    'tn':           (Normalizer.tn,          None ),
+    'toc':          (Normalizer.block,       Normalizer.toc ),
+}
+
+def locate(elem, page):
+    """The line and page of an element, as far as they are known"""
+    line = elem.get('line')
+    where = [f'line {line}'] if line else []
+
+    if page:
+        where.append(f'page {page}')
+
+    return ', '.join(where)
+
+def append_text(elem, string):
+    """Append text to the end of the element's content"""
+    if not string:
+        return
+
+    if len(elem):
+        last = elem[-1]
+        last.tail = (last.tail or '') + string
+    else:
+        elem.text = (elem.text or '') + string
+
+def strip_line_end(elem):
+    """Remove a newline from the end of the element's content"""
+    if len(elem):
+        last = elem[-1]
+
+        if last.tail and last.tail.endswith('\n'):
+            last.tail = last.tail[:-1]
+    elif elem.text and elem.text.endswith('\n'):
+        elem.text = elem.text[:-1]
+
+def remove_children(parent, doomed):
+    """Remove the doomed children in one pass, keeping their tails in place"""
+    kept = []
+
+    for child in parent:
+        if child in doomed:
+            if child.tail and kept:
+                kept[-1].tail = (kept[-1].tail or '') + child.tail
+            elif child.tail:
+                parent.text = (parent.text or '') + child.tail
+
+            child.tail = None
+        else:
+            kept.append(child)
+
+    parent[:] = kept
+
+def number_fns(pairs):
+    """Number the matched footnotes and their anchors from 1, in the order
+    of the anchors. Anchors and footnotes that did not match, as the
+    warnings say, get no number, and are rendered without links.
+    """
+    pairs = sorted(pairs, key=lambda pair: pair[0])
+
+    for i, (_, anchor, fn) in enumerate(pairs):
+        anchor.set('index', str(i + 1))
+        fn.set('index', str(i + 1))
+
+def parse_xml(source):
+    """Parse XML with the cyclic garbage collector paused. The tree has no
+    reference cycles, and the collections triggered by creating its many
+    elements would only rescan it.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+
+    try:
+        return ET.fromstring(source)
+    finally:
+        if enabled:
+            gc.enable()
+
+def number_book(source, files):
+    """Parse the XML book, then number and normalize it. Problems, such as
+    footnotes that do not match their anchors, are reported on stderr.
+    Return the book and its warnings.
+    """
+    book = parse_xml(source)
+
+    normalizer = Normalizer(files)
+    normalizer.walk(book)
+    normalizer.finish_notes()
+    normalizer.apply()
+
+    for message in normalizer.warnings:
+        print(message, file=sys.stderr)
+
+    number_fns(normalizer.pairs)
+
+    return book, normalizer.warnings
+
+def parse_book(source, files, use_cache=True):
+    """Parse the XML book, given as bytes, into Python data structures.
+
+    The numbered book is cached with its warnings, keyed by the source, the
+    images and this module's code. A cached book skips the normalization
+    pass, and its warnings are reported again.
+
+    The book is cached as XML, read back by the C parser. That is the
+    fastest way back to a tree: rebuilding the elements from marshal data
+    in Python costs as much as numbering the book again, and unpickling
+    them costs several times more.
+    """
+    if not use_cache:
+        return book_lists(number_book(source, files)[0])
+
+    import cache
+
+    manifest = '\n'.join(' '.join(map(str, images.make(item)))
+                         for item in files)
+    key = cache.make_key(source, manifest.encode('utf-8'),
+                         cache.code_version(sys.modules[__name__]))
+    payload = cache.load(key)
+
+    if payload:
+        size = int.from_bytes(payload[:8], 'little')
+        warnings = payload[8:8 + size].decode('utf-8')
+
+        for message in warnings.splitlines():
+            print(message, file=sys.stderr)
+
+        book = parse_xml(payload[8 + size:])
+    else:
+        book, warnings = number_book(source, files)
+        warnings = ''.join(f'{message}\n' for message in warnings)
+        warnings = warnings.encode('utf-8')
+        cache.store(key, len(warnings).to_bytes(8, 'little') + warnings +
+                    ET.tostring(book, encoding='utf-8'))
+
+    return book_lists(book)
+
+def book_lists(book):
+    """The book with its lists of footnotes and corrections"""
+    return book, list(book.iter('footnote')), list(book.iter('tn'))
+
+def render(source, style='', files=(), use_cache=True):
+    """Render an XML book held in memory, as bytes or a binary file, with
+    the stylesheet text and the images: the paths that the book links to,
+    or (path, width, height) triples. Return the HTML and text books as
+    strings.
+    """
+    import sink
+
+    if hasattr(source, 'read'):
+        source = source.read()
+
+    html_file = io.StringIO()
+    text_file = io.StringIO()
+    output = sink.Output(targets={'out.html': html_file, 'out.txt': text_file})
+
+    book, fn_list, tn_list = parse_book(source, list(files), use_cache)
+    write_books(book, fn_list, tn_list, output, style)
+
+    return html_file.getvalue(), text_file.getvalue()
+
+def write_books(book, fn_list, tn_list, output, style, split=False,
+                formats=FORMATS, index=False, fork=False, flavors=(),
+                offsets=False):
+    """Write the book in the given formats. Each writer is imported only
+    when its format is wanted. With fork, the formats are written at the
+    same time by processes of their own, if the output allows it. The
+    text book is written in the given flavors too, from one layout. With
+    offsets, each writer also indexes the places in its files.
+    """
+    def write_html():
+        import html
+        html.write_book(book, fn_list, tn_list, output, style, split, index,
+                        offsets)
+
+    def write_text():
+        import text
+        text.write_book(book, fn_list, tn_list, output, flavors, offsets)
+
+    jobs = [job for name, job in (('html', write_html), ('text', write_text))
+            if name in formats]
+
+    if fork and len(jobs) > 1 and hasattr(os, 'fork') and output.forkable():
+        run_forked(jobs)
+    else:
+        for job in jobs:
+            job()
+
+def run_forked(jobs):
+    """Run each job in a forked process. The processes share the parsed
+    book with this one, copy-on-write. Wait for them all, then exit with
+    the status of the first that failed.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    # Keep the collector in the children away from the shared objects,
+    # which would copy the pages it touches
+    gc.freeze()
+    pids = []
+
+    for job in jobs:
+        pid = os.fork()
+
+        if pid == 0:
+            os._exit(run_child(job))
+
+        pids.append(pid)
+
+    failed = 0
+
+    for pid in pids:
+        _, status = os.waitpid(pid, 0)
+        code = os.waitstatus_to_exitcode(status)
+
+        if code and not failed:
+            # A process killed by a signal has a negative code
+            failed = code if code > 0 else 1
+
+    gc.unfreeze()
+
+    if failed:
+        sys.exit(failed)
+
+def run_child(job):
+    """Run a job in a forked process. Return its exit status."""
+    import traceback
+
+    try:
+        job()
+        return 0
+    except SystemExit as error:
+        if error.code is None or isinstance(error.code, int):
+            return error.code or 0
+
+        print(error.code, file=sys.stderr)
+        return 1
+    except BaseException: # pylint: disable=broad-except
+        traceback.print_exc()
+        return 1
+    finally:
+        if profiler:
+            profiler.save_child()
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+def read_file(path, mode):
+    """Read a file, or standard input for -"""
+    if path == '-':
+        return sys.stdin.buffer.read() if 'b' in mode else sys.stdin.read()
+
+    encoding = None if 'b' in mode else 'utf-8'
+
+    with open(path, mode, encoding=encoding) as file:
+        return file.read()
+
+def main(argv=None, prog=None):
     """Generate the two book formats"""
-    book, fn_list, tn_list = parse_book()
-    html.write_book(book, fn_list, tn_list)
-    text.write_book(book, fn_list, tn_list)
+    global profiler # pylint: disable=global-statement,invalid-name
+
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__)
+    parser.add_argument('input', nargs='?', default='x.xml',
+                        help='the XML book, or - for standard input '
+                             '(default: x.xml)')
+    parser.add_argument('--html', default='out.html',
+                        help='the HTML book, or - for standard output '
+                             '(default: out.html)')
+    parser.add_argument('--text', default='out.txt',
+                        help='the text book, or - for standard output '
+                             '(default: out.txt)')
+    parser.add_argument('--style', default='style.css',
+                        help='the stylesheet (default: style.css)')
+    parser.add_argument('--images', default='images',
+                        help='the directory of images, which the HTML book '
+                             'links to as images/NAME (default: images)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse the book even if a cached copy exists')
+    parser.add_argument('--only', choices=FORMATS,
+                        help='write only the one format')
+    parser.add_argument('--split', action='store_true',
+                        help='write the HTML book as one file per chapter')
+    parser.add_argument('--search', action='store_true',
+                        help='write a search index and script for the HTML '
+                             'book')
+    parser.add_argument('--flavor', action='append', choices=FLAVORS,
+                        default=[], help='also write the text book as '
+                        'out-FLAVOR.txt: latin1 spells out the characters '
+                        'that Latin-1 lacks, narrow wraps at 40 columns')
+    parser.add_argument('--offsets', action='store_true',
+                        help='index the byte offsets of the pages, chapters, '
+                             'footnotes and corrections in out.html.idx and '
+                             'out.txt.idx')
+    parser.add_argument('--fork', action='store_true',
+                        help='write the formats at the same time, in '
+                             'processes of their own')
+    parser.add_argument('--profile', metavar='FILE',
+                        help='sample where the time goes, and write the '
+                             'samples to FILE as collapsed stacks for a flame '
+                             'graph')
+    parser.add_argument('--profile-rate', metavar='HZ', type=float,
+                        help='samples a second of CPU time for --profile '
+                             '(default: 100)')
+    compress = parser.add_mutually_exclusive_group()
+    compress.add_argument('--gzip', dest='compress', action='store_const',
+                          const='gzip', help='write each file gzipped')
+    compress.add_argument('--zip', dest='compress', action='store_const',
+                          const='zip', help='write the files into out.zip')
+    args = parser.parse_args(argv)
+
+    if args.split and args.html != 'out.html':
+        parser.error('--html cannot be used with --split')
+
+    if args.html == '-' and args.text == '-':
+        parser.error('only one book can go to standard output')
+
+    if args.compress and '-' in (args.html, args.text):
+        parser.error('standard output cannot be compressed')
+
+    targets = {
+        'out.html': sys.stdout if args.html == '-' else args.html,
+        'out.txt':  sys.stdout if args.text == '-' else args.text,
+    }
+
+    if args.profile:
+        import sampler
+        profiler = sampler.Sampler(args.profile,
+                                   args.profile_rate or sampler.RATE)
+        profiler.start()
+
+    try:
+        source = read_file(args.input, 'rb')
+        style = read_file(args.style, 'r')
+        files = images.scan(args.images, use_cache=not args.no_cache)
+
+        book, fn_list, tn_list = parse_book(source, files, not args.no_cache)
+
+        import sink
+        output = sink.Output(args.compress, targets)
+        write_books(book, fn_list, tn_list, output, style, args.split,
+                    [args.only] if args.only else FORMATS, args.search,
+                    args.fork, args.flavor, args.offsets)
+        output.close()
+    finally:
+        if profiler:
+            profiler.stop()
+            profiler = None
+
+def check(argv=None, prog=None):
+    """Check that the XML book parses and numbers, without writing it"""
+    parser = argparse.ArgumentParser(prog=prog, description=check.__doc__)
+    parser.add_argument('input', nargs='?', default='x.xml',
+                        help='the XML book, or - for standard input '
+                             '(default: x.xml)')
+    parser.add_argument('--images', default='images',
+                        help='the directory of images (default: images)')
+    args = parser.parse_args(argv)
+
+    source = read_file(args.input, 'rb')
+    files = [images.link(path) for path in images.list_files(args.images)]
+    book, _ = number_book(source, files)
+
+    counts = [(sum(1 for _ in book.iter(tag)), name) for tag, name in (
+        ('pb', 'pages'), ('footnote', 'footnotes'),
+        ('illustration', 'illustrations'), ('tn', 'corrections'))]
+    print(f'{args.input}: ' + ', '.join(f'{n} {name}' for n, name in counts))
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+"""Convert straight quotes to curly quotes with lex/quotes, in parallel.
+
+The text is split into segments at blank lines, and the segments are
+converted at once. The quote of --"-- opens or closes by the side of the
+quote before it, which may be in an earlier segment. lex/quotes -s marks
+such quotes, and ends each segment with the sides it leaves. Joining the
+segments in order decides the marks, so the output is the same as
+lex/quotes gives for the whole text.
+"""
+
+import argparse
+import concurrent.futures
+import os
+import subprocess
+import sys
+
+LEX_QUOTES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'lex', 'quotes')
+SEGMENT_SIZE = 1 << 20 # bytes, the least worth a process of its own
+
+# The sides that lex/quotes -s leaves, for single and double quotes.
+# SAME is the side left before the segment, and FLIPPED the other one.
+CLOSE, OPEN, SAME, FLIPPED = b'0123'
+
+# Opening and closing quotes, for single and double quotes
+QUOTES = (('‘'.encode('utf-8'), '’'.encode('utf-8')),
+          ('“'.encode('utf-8'), '”'.encode('utf-8')))
+
+# The marks lex/quotes -s writes for the quotes it can't decide, and the
+# quote and side before each one
+MARKS = {
+    b'\x01': (0, SAME),
+    b'\x02': (0, FLIPPED),
+    b'\x03': (1, SAME),
+    b'\x04': (1, FLIPPED),
+}
+
+def split(data, count, size=SEGMENT_SIZE):
+    """Split the text after blank lines into about count segments of at
+    least size bytes. No quote conversion looks past a line end, and each
+    segment starts at the start of a line, so it converts as it would in
+    the whole text.
+    """
+    target = max(len(data) // count, size)
+    segments = []
+    start = 0
+
+    while start < len(data):
+        end = data.find(b'\n\n', start + target)
+        end = len(data) if end < 0 else end + 2
+        segments.append(data[start:end])
+        start = end
+
+    return segments
+
+def side(left, before):
+    """The side of a segment's last quote, from the side it left and the
+    side before the segment
+    """
+    if left == SAME:
+        return before
+    if left == FLIPPED:
+        return OPEN + CLOSE - before
+    return left
+
+def resolve(output, sides):
+    """Decide the marked quotes of a segment's output from the sides
+    before it. Return the text and the sides after it.
+    """
+    text, left = output[:-2], output[-2:]
+
+    for mark, (quote, before) in MARKS.items():
+        if mark in text:
+            prev = side(before, sides[quote])
+            text = text.replace(mark, QUOTES[quote][prev == OPEN])
+
+    return text, [side(left[i], sides[i]) for i in range(2)]
+
+def run(command, data):
+    return subprocess.run(command, input=data, capture_output=True,
+                          check=True).stdout
+
+def convert(data, jobs=None, lex_quotes=LEX_QUOTES, size=SEGMENT_SIZE,
+            lexicon=None):
+    """Convert the text, using up to jobs processes at once. The lexicon
+    of contractions is the one beside lex/quotes unless given.
+    """
+    jobs = jobs or os.cpu_count()
+    segments = split(data, jobs, size)
+    command = [lex_quotes] + (['-l', lexicon] if lexicon else [])
+
+    # Text with marks of its own can only be converted whole
+    if len(segments) < 2 or any(mark in data for mark in MARKS):
+        return run(command, data)
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        outputs = executor.map(lambda segment: run(command + ['-s'], segment),
+                               segments)
+        sides = [CLOSE, CLOSE]
+        texts = []
+
+        for output in outputs:
+            text, sides = resolve(output, sides)
+            texts.append(text)
+
+    return b''.join(texts)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('file', nargs='?',
+                        help='the text to convert (default: standard input)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='processes at once (default: one per CPU)')
+    parser.add_argument('--lex-quotes', default=LEX_QUOTES,
+                        help='the lex/quotes program')
+    parser.add_argument('--lexicon',
+                        help='the contractions, one word a line (default: '
+                             'contractions.txt beside lex/quotes, or the '
+                             'words it ships with)')
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+
+    if args.file:
+        with open(args.file, 'rb') as file:
+            data = file.read()
+    else:
+        data = sys.stdin.buffer.read()
+
+    try:
+        sys.stdout.buffer.write(convert(data, args.jobs, args.lex_quotes,
+                                         lexicon=args.lexicon))
+    except subprocess.CalledProcessError as error:
+        sys.stderr.buffer.write(error.stderr)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Sampling profiler, cheap enough to leave on for real runs.
+
+A timer signal interrupts the process at a fixed rate of CPU time, and
+each sample records the Python stack of the main thread where it was
+interrupted. Each sample is labelled with the stage of the pipeline, the
+writer's mode and the tag being written, found on the stack. The samples
+are written as collapsed stacks, one per line with its count, ready for
+flame graph tools:
+
+    stage:html;mode:NORMAL;tag:p;main.py:main;...;html.py:data 12
+
+Time spent in other threads is counted where the main thread was.
+"""
+
+import collections
+import glob
+import os
+import signal
+
+RATE = 100 # samples a second of CPU time
+
+# The functions that start a stage of the pipeline, by file and name. A
+# sample is in the stage of the innermost one on its stack.
+STAGES = {
+    ('main.py', 'parse_book'): 'parse',
+    ('main.py', 'number_book'): 'parse',
+    ('images.py', 'scan'): 'images',
+    ('html.py', 'write_book'): 'html',
+    ('text.py', 'write_book'): 'text',
+    ('batch.py', 'input_key'): 'key',
+    ('batch.py', 'is_current'): 'current',
+    ('quotes.py', 'convert'): 'quotes',
+    ('scan.py', 'scan'): 'scan',
+    ('batch.py', 'install'): 'install',
+}
+
+def read(path):
+    """The collapsed stacks of a profile, with their counts"""
+    counts = collections.Counter()
+
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            counts[stack] += int(count)
+
+    return counts
+
+def write(path, counts):
+    with open(path, 'w', encoding='utf-8') as file:
+        file.writelines(f'{stack} {count}\n'
+                        for stack, count in sorted(counts.items()))
+
+class Sampler:
+    """
+    Sample the stack until stopped, then write the profile. A process
+    forked meanwhile goes on sampling, and saves its samples for this one
+    to add when it stops.
+    """
+    def __init__(self, path, rate=RATE):
+        self.path = path
+        self.rate = rate
+        self.interval = 1 / rate
+        self.counts = collections.Counter()
+        self.labels = {} # code object -> its frame in the collapsed stack
+        self.running = False
+        self.process_code = None
+
+    def start(self):
+        # pylint: disable=import-outside-toplevel
+        import process
+        self.process_code = process.process.__code__
+
+        for old in glob.glob(f'{glob.escape(self.path)}.*.child'):
+            os.remove(old)
+
+        os.register_at_fork(after_in_child=self._after_fork)
+        self.running = True
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        """Stop sampling, and write the profile with the samples of the
+        processes forked meanwhile"""
+        self._stop_timer()
+
+        for child in glob.glob(f'{glob.escape(self.path)}.*.child'):
+            self.counts.update(read(child))
+            os.remove(child)
+
+        write(self.path, self.counts)
+
+    def save_child(self):
+        """Stop sampling in a forked process, and save its samples"""
+        if self.running:
+            self._stop_timer()
+            write(f'{self.path}.{os.getpid()}.child', self.counts)
+
+    def _stop_timer(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        self.running = False
+
+    def _after_fork(self):
+        # Timers are not inherited, and the parent keeps its own samples
+        if self.running:
+            self.counts = collections.Counter()
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def _sample(self, _signum, frame):
+        stage = mode = tag = None
+        frames = []
+
+        while frame:
+            code = frame.f_code
+            label = self.labels.get(code)
+
+            if label is None:
+                name = os.path.basename(code.co_filename)
+                label = self.labels[code] = (f'{name}:{code.co_name}',
+                                             STAGES.get((name, code.co_name)))
+
+            frames.append(label[0])
+            stage = stage or label[1]
+
+            if tag is None and code is self.process_code:
+                tag = frame.f_locals['elem'].tag
+
+            if mode is None:
+                mode = getattr(frame.f_globals.get('context'), 'mode', None)
+
+            frame = frame.f_back
+
+        for name, value in (('tag', tag), ('mode', mode and mode.name),
+                            ('stage', stage)):
+            if value:
+                frames.append(f'{name}:{value}')
+
+        self.counts[';'.join(reversed(frames))] += 1
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+
+"""Scan a text formatted for lex/xml into the XML book, rescanning only the
+chapters that changed since the last scan.
+
+lex/xml -m writes a record of each chapter break into its output: the
+offset and line of the break, and the scanner's state there. The last
+scan of each source file is cached with these records. The next scan
+resumes lex/xml at the last chapter break before the first change, and
+stops it at the first chapter break after the last change where the
+state is the same as before. The rest of the cached XML follows, with
+its offsets and lines moved by the lengths of the change.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+import cache
+
+LEX_XML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'lex', 'xml')
+
+# A scan resumes this far before the first change at least: a chapter
+# break is five line ends, and the scanner looks at one byte past them
+MARGIN = 6
+CHUNK = 1 << 16 # bytes compared at once
+
+SEPARATOR = b'\x1e'
+RECORD = re.compile(rb'\x1e(\d+) (\d+) (\d+) (\d+)\x1e')
+LINE = re.compile(rb"(<(?:anchor|footnote) n='.' line=')(\d+)")
+
+class Break:
+    """A chapter break, from its record in the scanner's output"""
+
+    def __init__(self, match):
+        self.start = match.start()
+        self.offset = int(match[1])
+        self.line = int(match[2])
+        self.state = int(match[3]), int(match[4])
+
+    def resume(self):
+        """The scanner's -r argument, to resume at the break"""
+        return '{},{},{},{}'.format(self.offset, self.line, *self.state)
+
+def common_prefix(old, new):
+    """The length of the bytes at the start of both"""
+    size = min(len(old), len(new))
+    start = 0
+
+    while start < size and old[start:start + CHUNK] == new[start:start + CHUNK]:
+        start += CHUNK
+
+    end = min(start + CHUNK, size)
+
+    while start < end and old[start] == new[start]:
+        start += 1
+
+    return start
+
+def common_suffix(old, new, limit):
+    """The length of the bytes at the end of both, up to limit"""
+    return common_prefix(old[::-1][:limit], new[::-1][:limit])
+
+def run(command):
+    """Run lex/xml. Its messages go straight to stderr."""
+    result = subprocess.run(command, stdout=subprocess.PIPE, check=False)
+    return result.stdout, result.returncode
+
+def shift(mapped, offsets, lines):
+    """Move the offsets and lines in a stretch of mapped XML"""
+    if lines:
+        mapped = LINE.sub(lambda m: m[1] + b'%d' % (int(m[2]) + lines), mapped)
+
+    return RECORD.sub(lambda m: b'\x1e%d %d %s %s\x1e' % (
+        int(m[1]) + offsets, int(m[2]) + lines, m[3], m[4]), mapped)
+
+def rescan(path, lex_xml, old_source, old_mapped, source):
+    """Scan the source from its first change until the scan meets the old
+    scan again. Return the mapped XML and the scanner's exit status, or
+    None if the source must be scanned from the start.
+    """
+    start = common_prefix(old_source, source)
+    size = min(len(old_source), len(source)) - start
+    end = len(source) - common_suffix(old_source, source, size)
+    moved = len(source) - len(old_source)
+
+    breaks = [Break(match) for match in RECORD.finditer(old_mapped)]
+    by_offset = {item.offset: item for item in breaks}
+    resume = None
+
+    for item in breaks:
+        if item.offset + MARGIN > start:
+            break
+        resume = item
+
+    if not resume:
+        return None
+
+    head = old_mapped[:resume.start]
+    parts = [head]
+    failed = 0
+
+    while True:
+        output, status = run([lex_xml, '-r', resume.resume(), '-e', str(end),
+                              path])
+        failed = failed or status
+
+        # The scan ran to the end of the book
+        if not output.endswith(SEPARATOR):
+            parts.append(output)
+            return b''.join(parts), failed
+
+        # The scan stopped at a chapter break. The rest is the same as
+        # before if the old scan had a break there in the same state.
+        stop = Break(RECORD.match(output, output.rindex(SEPARATOR, 0, -1)))
+        parts.append(output[:stop.start])
+        old = by_offset.get(stop.offset - moved)
+
+        if old and old.state == stop.state:
+            parts.append(shift(old_mapped[old.start:], moved,
+                               stop.line - old.line))
+            return b''.join(parts), failed
+
+        resume = stop
+        end = stop.offset + 1
+
+def scan(path, lex_xml=LEX_XML, use_cache=True):
+    """Scan the file into the XML book. Return the XML, and the scanner's
+    exit status.
+    """
+    with open(path, 'rb') as file:
+        source = file.read()
+
+    # The records can't be told apart from a source that has separators
+    if SEPARATOR in source:
+        return run([lex_xml, path])
+
+    with open(lex_xml, 'rb') as file:
+        key = cache.make_key(b'scan', os.path.abspath(path).encode('utf-8'),
+                             file.read())
+
+    previous = cache.load(key) if use_cache else None
+    result = None
+
+    if previous:
+        size = int.from_bytes(previous[:8], 'little')
+        old_source = previous[8:8 + size]
+        old_mapped = previous[8 + size:]
+
+        if old_source == source:
+            result = old_mapped, 0
+        else:
+            result = rescan(path, lex_xml, old_source, old_mapped, source)
+
+    mapped, status = result or run([lex_xml, '-m', path])
+
+    # Only a clean scan is kept, so a rescan reports all the problems
+    if use_cache and not status:
+        cache.store(key, len(source).to_bytes(8, 'little') + source + mapped)
+
+    return b''.join(mapped.split(SEPARATOR)[::2]), status
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help='the text formatted for lex/xml')
+    parser.add_argument('-o', '--output', default='x.xml',
+                        help='the XML book (default: x.xml)')
+    parser.add_argument('--lex-xml', default=LEX_XML,
+                        help='the lex/xml program')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='scan the whole source, and keep no copy')
+    args = parser.parse_args()
+
+    xml, status = scan(args.source, args.lex_xml, not args.no_cache)
+
+    with open(args.output, 'wb') as file:
+        file.write(xml)
+
+    sys.exit(status)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+/*
+Search the book with the index that ppx writes beside it, named by the
+data-index attribute of the script tag.
+
+Adds a search box to the top of the page. Each result links to a page,
+chapter or footnote where all the words of the query occur; the last word
+may be the start of a word.
+*/
+
+'use strict';
+
+(function () {
+    const INDEX = document.currentScript.dataset.index;
+    const MAX_RESULTS = 100;
+    const WORD = /[\p{L}\p{N}_]{2,}/gu;
+
+    let index = null;
+
+    function normalize(text) {
+        return text.toLowerCase().normalize('NFKD').replace(/\p{M}/gu, '');
+    }
+
+    async function load() {
+        const response = await fetch(INDEX);
+        let data = await response.arrayBuffer();
+        const bytes = new Uint8Array(data);
+
+        // Servers may already have undone the gzip encoding
+        if (bytes[0] === 0x1f && bytes[1] === 0x8b) {
+            const stream = new Blob([data]).stream()
+                .pipeThrough(new DecompressionStream('gzip'));
+            data = await new Response(stream).arrayBuffer();
+        }
+
+        index = JSON.parse(new TextDecoder().decode(data));
+        index.words = Object.keys(index.terms); // sorted by ppx
+    }
+
+    function places(word) {
+        // Undo the differences between places
+        let place = 0;
+        return index.terms[word].map((gap) => (place += gap));
+    }
+
+    function prefixed(prefix) {
+        // Binary search for the first word with the prefix
+        const words = index.words;
+        let low = 0;
+        let high = words.length;
+
+        while (low < high) {
+            const middle = (low + high) >> 1;
+
+            if (words[middle] < prefix) {
+                low = middle + 1;
+            } else {
+                high = middle;
+            }
+        }
+
+        const found = new Set();
+
+        for (let i = low; i < words.length && words[i].startsWith(prefix); i++) {
+            places(words[i]).forEach((place) => found.add(place));
+        }
+
+        return found;
+    }
+
+    function search(query) {
+        const words = normalize(query).match(WORD) || [];
+
+        if (!words.length) {
+            return [];
+        }
+
+        const last = prefixed(words.pop());
+        let result = [...last];
+
+        for (const word of words) {
+            const found = new Set(index.terms[word] ? places(word) : []);
+            result = result.filter((place) => found.has(place));
+        }
+
+        return result.sort((a, b) => a - b);
+    }
+
+    function show(list, results) {
+        list.replaceChildren();
+
+        for (const place of results.slice(0, MAX_RESULTS)) {
+            const [file, anchor, label, chapter] = index.places[place];
+            const item = document.createElement('li');
+            const link = document.createElement('a');
+            const title = chapter >= 0 ? index.chapters[chapter][2] : '';
+            let text = title || document.title;
+
+            if (label && label !== title) {
+                text = title ? `${title}, ${label}` : label;
+            }
+
+            link.href = `${file}#${anchor}`;
+            link.textContent = text;
+            item.append(link);
+            list.append(item);
+        }
+    }
+
+    function init() {
+        const form = document.createElement('form');
+        const input = document.createElement('input');
+        const list = document.createElement('ol');
+
+        form.id = 'search';
+        form.role = 'search';
+        input.type = 'search';
+        input.placeholder = 'Search the book';
+        form.append(input, list);
+        form.addEventListener('submit', (event) => event.preventDefault());
+
+        input.addEventListener('input', async () => {
+            if (!index) {
+                await load();
+            }
+
+            show(list, search(input.value));
+        });
+
+        document.body.prepend(form);
+    }
+
+    document.addEventListener('DOMContentLoaded', init);
+})();
@@ -0,0 +1,106 @@
+"""Full-text search index of the HTML book"""
+
+import json
+import os
+import re
+import unicodedata
+
+INDEX = 'search.json' # written gzipped, as search.json.gz
+SCRIPT = 'search.js'
+
+WORD = re.compile(r'\w\w+')
+TRAILING = re.compile(r'\w+\Z')
+
+def normalize(text):
+    """Fold case and strip accents, as search.js does with queries"""
+    text = text.lower()
+
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text)
+                       if not unicodedata.combining(c))
+
+    return text
+
+class Index:
+    """
+    Inverted index from the words of the book to the places where they
+    occur: the page anchors, chapters and footnotes. It is built from the
+    text as the HTML writer walks the book, so it needs no walk of its own.
+    Each word lists a place once, however often it occurs there.
+    """
+    def __init__(self):
+        self.carry = ''
+        self.chapters = [] # [file, id, title]
+        self.places = []   # [file, anchor, label, chapter]
+        self.place = None
+        self.terms = {}
+
+    def chapter(self, file, anchor, title):
+        self.chapters.append([file, anchor, title])
+        self.move(file, anchor, title)
+
+    def move(self, file, anchor, label):
+        """Index the text that follows at this place"""
+        self.flush()
+        self.places.append([file, anchor, label, len(self.chapters) - 1])
+        self.place = len(self.places) - 1
+
+    def stop(self):
+        """Index no more text until the next move"""
+        self.flush()
+        self.place = None
+
+    def add(self, text):
+        if self.place is None:
+            return
+
+        # A word may be split between calls by inline markup, so the end
+        # of the text waits for the next call
+        text = self.carry + text
+        match = TRAILING.search(text)
+
+        if match:
+            self.carry = match.group()
+            text = text[:match.start()]
+        else:
+            self.carry = ''
+
+        self._add_words(text)
+
+    def flush(self):
+        if self.carry:
+            self._add_words(self.carry)
+            self.carry = ''
+
+    def _add_words(self, text):
+        place = self.place
+        terms = self.terms
+
+        for word in WORD.findall(normalize(text)):
+            posting = terms.get(word)
+
+            if posting is None:
+                terms[word] = [place]
+            elif posting[-1] != place:
+                posting.append(place)
+
+    def write(self, file):
+        """Write the index as JSON. Each word's places are given as the
+        differences between them, which compress better.
+        """
+        self.flush()
+        terms = {}
+
+        for word in sorted(self.terms):
+            places = self.terms[word]
+            terms[word] = [places[0]] + [b - a for a, b in zip(places,
+                                                               places[1:])]
+
+        json.dump({'chapters': self.chapters, 'places': self.places,
+                   'terms': terms}, file, ensure_ascii=False,
+                  separators=(',', ':'))
+
+def script():
+    """The search script, from beside this module or the zipapp"""
+    path = os.path.join(os.path.dirname(__file__), SCRIPT)
+    return __loader__.get_data(path).decode('utf-8')
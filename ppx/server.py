@@ -0,0 +1,305 @@
+#!/usr/bin/python
+
+"""Render books on request, with a pool of warm worker processes.
+
+Clients connect to a Unix socket and send requests as JSON, one per line.
+Each gets one line of JSON back.
+
+    {"xml": "<book>...</book>", "style": "...", "images": ["images/a.png"]}
+    {"source": "...", "style": "..."}  text formatted for lex/xml
+    {"command": "metrics"}
+
+Source text has its quotes made curly by lex/quotes, then goes through
+lex/xml, as in a build. A rendered book comes back as {"html": "...",
+"text": "...", "ms": 12.3}, with any warnings as "warnings", and a
+failure as {"error": "..."}. Numbered books are cached in --cache-dir.
+"""
+
+import argparse
+import collections
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import signal
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import main
+import quotes
+
+LEX_XML = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       'lex', 'xml')
+LATENCIES = 1000 # latencies kept for the percentiles
+MARGIN = 1 # seconds the server waits past a deadline for the worker's alarm
+
+class RenderTimeout(Exception):
+    """A worker ran out of time for a request"""
+
+def on_alarm(_signum, _frame):
+    raise RenderTimeout()
+
+def on_terminate(_signum, _frame):
+    raise KeyboardInterrupt()
+
+def init_worker(cache_dir):
+    # The server handles interrupts; workers just stop with it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGALRM, on_alarm)
+
+    # Import what main imports only when rendering, so that the first
+    # request a worker takes is as quick as the rest
+    # pylint: disable=import-outside-toplevel,unused-import
+    import cache
+    import css
+    import html
+    import sink
+    import text
+
+    cache.CACHE_DIR = cache_dir
+
+def render(request, deadline, lex, use_cache):
+    """Render one request in a worker, by the deadline on the monotonic
+    clock. The alarm stops a render that runs beyond it, leaving the worker
+    free for the next request.
+    """
+    timeout = deadline - time.monotonic()
+
+    if timeout <= 0:
+        return {'error': 'timed out'}
+
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    # The alarm may go off as the render finishes, before it is cleared
+    try:
+        try:
+            return render_request(request, lex, use_cache)
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    except RenderTimeout:
+        return {'error': 'timed out'}
+
+def render_request(request, lex, use_cache):
+    """Render one request. The messages the renderer writes to stderr come
+    back as warnings, or as the error if it gives up.
+    """
+    messages = io.StringIO()
+
+    try:
+        if 'source' in request:
+            source = quotes.convert(request['source'].encode('utf-8'), 1,
+                                    lex['quotes'])
+            result = subprocess.run(lex['xml'], input=source,
+                                    capture_output=True, check=False)
+
+            if result.returncode:
+                return {'error': (result.stdout + result.stderr).decode(
+                    'utf-8', 'replace')}
+
+            xml = result.stdout
+            messages.write(result.stderr.decode('utf-8', 'replace'))
+        else:
+            xml = request['xml'].encode('utf-8')
+
+        with contextlib.redirect_stderr(messages):
+            html, text = main.render(xml, request.get('style', ''),
+                                     request.get('images', ()), use_cache)
+
+        response = {'html': html, 'text': text}
+
+        if messages.getvalue():
+            response['warnings'] = messages.getvalue()
+
+        return response
+    except RenderTimeout:
+        return {'error': 'timed out'}
+    except subprocess.CalledProcessError as error:
+        return {'error': error.stderr.decode('utf-8', 'replace')}
+    except SystemExit as error:
+        # The renderer exits on some malformed books, having said why
+        if isinstance(error.code, str):
+            messages.write(f'{error.code}\n')
+
+        return {'error': messages.getvalue() or 'malformed book'}
+    except Exception as error: # pylint: disable=broad-except
+        return {'error': f'{type(error).__name__}: {error}'}
+
+class Metrics:
+    """Request counts, latencies and throughput since the server started"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.counts = collections.Counter()
+        self.latencies = collections.deque(maxlen=LATENCIES)
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def record(self, outcome, elapsed, bytes_in, bytes_out):
+        with self.lock:
+            self.counts[outcome] += 1
+            self.latencies.append(elapsed)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def report(self):
+        with self.lock:
+            uptime = time.monotonic() - self.start
+            latencies = sorted(self.latencies)
+            total = sum(self.counts.values())
+            report = {
+                'uptime': round(uptime, 3),
+                'requests': total,
+                'per_second': round(total / uptime, 3),
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                **self.counts,
+            }
+
+        for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+            if latencies:
+                index = min(int(len(latencies) * fraction), len(latencies) - 1)
+                report[f'{name}_ms'] = round(latencies[index] * 1000, 3)
+
+        return report
+
+class Handler(socketserver.StreamRequestHandler):
+    """Serve the requests on one connection, in order"""
+    def handle(self):
+        for line in self.rfile:
+            start = time.monotonic()
+            response, outcome = self.server.respond(line)
+            data = json.dumps(response).encode('utf-8') + b'\n'
+            elapsed = time.monotonic() - start
+
+            if outcome:
+                self.server.metrics.record(outcome, elapsed, len(line),
+                                           len(data))
+
+            self.wfile.write(data)
+            self.wfile.flush()
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    """
+    Accept requests on any number of connections, and render at most
+    concurrency of them at once in the worker pool. The timeout covers
+    both the wait for a turn and the render.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, args):
+        self.args = args
+        self.metrics = Metrics()
+        self.slots = threading.BoundedSemaphore(args.concurrency)
+        self.lex = {'quotes': args.lex_quotes, 'xml': args.lex_xml}
+        self.pool = multiprocessing.Pool(args.workers, init_worker,
+                                         (os.path.abspath(args.cache_dir),))
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        super().__init__(path, Handler)
+
+    def respond(self, line):
+        """Get the response to a request line, and its outcome for the
+        metrics, or None for requests that are not renders
+        """
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {'error': 'bad request'}, 'bad'
+
+        if not isinstance(request, dict):
+            return {'error': 'bad request'}, 'bad'
+
+        command = request.get('command')
+
+        if command == 'metrics':
+            return self.metrics.report(), None
+
+        if command or not ('xml' in request or 'source' in request):
+            return {'error': 'bad request'}, 'bad'
+
+        start = time.monotonic()
+        deadline = start + self.args.timeout
+
+        if not self.slots.acquire(timeout=self.args.timeout):
+            return {'error': 'busy'}, 'busy'
+
+        try:
+            job = self.pool.apply_async(render, (request, deadline,
+                                                 self.lex,
+                                                 not self.args.no_cache))
+            # The worker's own alarm should fire first
+            response = job.get(deadline - time.monotonic() + MARGIN)
+        except (multiprocessing.TimeoutError, RenderTimeout):
+            response = {'error': 'timed out'}
+        except Exception as error: # pylint: disable=broad-except
+            response = {'error': f'{type(error).__name__}: {error}'}
+        finally:
+            self.slots.release()
+
+        response['ms'] = round((time.monotonic() - start) * 1000, 3)
+
+        if 'error' not in response:
+            outcome = 'ok'
+        elif response['error'] == 'timed out':
+            outcome = 'timeout'
+        else:
+            outcome = 'error'
+
+        return response, outcome
+
+    def server_close(self):
+        super().server_close()
+        self.pool.terminate()
+        self.pool.join()
+
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+def parse_args(argv=None, prog=None):
+    parser = argparse.ArgumentParser(prog=prog, description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', default='ppx.sock',
+                        help='the Unix socket to listen on (default: ppx.sock)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='requests rendered at once (default: workers)')
+    parser.add_argument('--timeout', type=float, default=30,
+                        help='seconds allowed for each request (default: 30)')
+    parser.add_argument('--lex-quotes', default=quotes.LEX_QUOTES,
+                        help='the lex/quotes program for source requests')
+    parser.add_argument('--lex-xml', default=LEX_XML,
+                        help='the lex/xml program for source requests')
+    parser.add_argument('--cache-dir', default='ppx-cache',
+                        help='the cache of numbered books (default: ppx-cache)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='do not use the cache of numbered books')
+    args = parser.parse_args(argv)
+
+    if args.concurrency is None:
+        args.concurrency = args.workers
+
+    return args
+
+def serve(args):
+    """Serve until interrupted or terminated"""
+    signal.signal(signal.SIGTERM, on_terminate)
+
+    with Server(args.socket, args) as server:
+        print(f'Serving on {args.socket} with {args.workers} workers',
+              file=sys.stderr)
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    serve(parse_args())
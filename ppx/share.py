@@ -13,3 +13,41 @@ class Processing(Enum):
     """Instruct the processor to skip parts of an element"""
     SKIP_DATA = 0 # Skip this tag's text and children
     SKIP_TAIL = 1 # Skip this tag's tail
+
+class Capture:
+    """
+    Record a transcriber's note as it reads before and after the correction,
+    while the main pass renders it. Inside <del> the output only belongs to
+    the before side, and inside <ins> only to the after side.
+    """
+    def __init__(self):
+        self.before = []
+        self.after = []
+        self.side = None # Mode.TN_DEL or Mode.TN_INS inside <del> or <ins>
+
+    def write(self, string):
+        if self.side != Mode.TN_INS:
+            self.before.append(string)
+
+        if self.side != Mode.TN_DEL:
+            self.after.append(string)
+
+    def result(self):
+        return ''.join(self.before), ''.join(self.after)
+
+def has_caption(elem):
+    """Whether an illustration has a caption: text, or paragraphs of it.
+    A page break moved into it is not one."""
+    return bool((elem.text or '').strip()) or elem.find('p') is not None
+
+class Fragments:
+    """Rendered transcriber's notes by index. Identical notes share a copy."""
+    def __init__(self):
+        self.by_index = {}
+        self.unique = {}
+
+    def add(self, index, fragment):
+        self.by_index[index] = self.unique.setdefault(fragment, fragment)
+
+    def get(self, index):
+        return self.by_index[index]
@@ -0,0 +1,232 @@
+"""Output files, plain or compressed as they are written"""
+
+# The modules for compressing are imported when used, so that plain files
+# cost nothing to set up.
+# pylint: disable=import-outside-toplevel
+
+ARCHIVE = 'out.zip'
+CHUNK_SIZE = 256 * 1024 # characters gathered before compressing
+QUEUE_SIZE = 8          # chunks waiting for the compressor
+
+# Fixed member timestamps keep archives of the same book identical
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+class Chunked:
+    """Text gathered into large encoded chunks, which are passed on more
+    cheaply than many small strings"""
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.parts = []
+        self.size = 0
+
+    def write(self, string):
+        self.parts.append(string)
+        self.size += len(string)
+
+        if self.size >= CHUNK_SIZE:
+            self._send()
+
+    def _send(self):
+        if self.parts:
+            self._put(''.join(self.parts).encode(self.encoding, 'replace'))
+            self.parts = []
+            self.size = 0
+
+    def _put(self, chunk):
+        raise NotImplementedError
+
+class Sink(Chunked):
+    """
+    Text file that compresses on a background thread. The writer gathers
+    text into chunks and queues them. The thread compresses them, which
+    zlib does without holding the GIL, so rendering carries on meanwhile.
+    """
+    def __init__(self, raw, encoding='utf-8'):
+        import queue
+        import threading
+
+        super().__init__(encoding)
+        self.error = None
+        self.closed = False
+        self.queue = queue.Queue(QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._compress, args=(raw,),
+                                       daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self._send()
+        self.queue.put(None)
+        self.thread.join()
+        self.closed = True
+
+        if self.error:
+            raise self.error
+
+    def _put(self, chunk):
+        self.queue.put(chunk)
+
+    def _compress(self, raw):
+        # Keep taking chunks after an error, so the writer never blocks on
+        # a full queue; the error is raised when the sink is closed
+        with raw:
+            while (chunk := self.queue.get()) is not None:
+                if self.error is None:
+                    try:
+                        raw.write(chunk)
+                    except Exception as error: # pylint: disable=broad-except
+                        self.error = error
+
+class Borrowed:
+    """A file owned by the caller, such as standard output or a memory
+    buffer. It is flushed when done with, but left open."""
+    def __init__(self, file):
+        self.file = file
+        self.write = file.write
+
+    def close(self):
+        self.file.flush()
+
+def byte_size(string, encoding='utf-8'):
+    """The size of the text once encoded"""
+    if string.isascii():
+        return len(string)
+
+    return len(string.encode(encoding, 'replace'))
+
+class Counted:
+    """
+    A file that counts the bytes written to it, as encoded. The text is
+    gathered until the offset is wanted, then counted and written at once.
+    """
+    def __init__(self, file, encoding='utf-8'):
+        self.file = file
+        self.encoding = encoding
+        self.parts = []
+        self.size = 0
+        self.write = self.parts.append
+
+    @property
+    def offset(self):
+        self._send()
+        return self.size
+
+    def close(self):
+        self._send()
+        self.file.close()
+
+    def _send(self):
+        if self.parts:
+            text = ''.join(self.parts)
+            self.parts.clear()
+            self.size += byte_size(text, self.encoding)
+            self.file.write(text)
+
+class Offsets:
+    """
+    Sidecar index of places in the files of a book: pages, chapters,
+    footnotes and corrections. Each line gives the kind of place, its
+    name, the file and the byte offset of the place in the file, separated
+    by tabs. A place runs to the next one in the same file, so that a
+    reader can serve it with a seek and a bounded read. The offsets are
+    into the uncompressed files.
+    """
+    def __init__(self):
+        self.entries = []
+
+    def add(self, kind, name, file, offset):
+        self.entries.append([kind, name, file, offset])
+
+    def write(self, file):
+        # The places of each file together, in the order of the files
+        files = {entry[2]: index for index, entry in
+                 reversed(list(enumerate(self.entries)))}
+        entries = sorted(self.entries, key=lambda entry: files[entry[2]])
+        file.write(''.join(f'{kind}\t{name}\t{path}\t{offset}\n'
+                           for kind, name, path, offset in entries))
+
+class Held(Chunked):
+    """A member of the archive opened while another is being written, such
+    as a flavor of the text book. The archive takes one member at a time,
+    so the encoded text is spooled to a temporary file, then compressed
+    into the archive when the output closes."""
+    def __init__(self, info, encoding):
+        import tempfile
+        super().__init__(encoding)
+        self.info = info
+        self.file = tempfile.TemporaryFile() # pylint: disable=consider-using-with
+
+    def _put(self, chunk):
+        self.file.write(chunk)
+
+    def close(self):
+        self._send()
+
+    def copy(self, archive):
+        """Compress the spooled text into its member of the archive"""
+        import shutil
+
+        with self.file:
+            self.file.seek(0)
+
+            with archive.open(self.info, 'w') as member:
+                shutil.copyfileobj(self.file, member, CHUNK_SIZE)
+
+class Output:
+    """
+    Where the writers put their files: plain files, name.gz files, or
+    members of out.zip. Targets map a file name to another path, or to a
+    file object that takes the text as it is written. The compression
+    modules are only imported when used.
+    """
+    def __init__(self, compress=None, targets=None):
+        self.compress = compress
+        self.targets = targets or {}
+        self.archive = None
+        self.member = None
+        self.held = []
+
+        if compress == 'zip':
+            import zipfile
+            self.archive = zipfile.ZipFile(ARCHIVE, 'w')
+
+    def open(self, name, compressed=False, encoding='utf-8'):
+        """Open a file for writing. A compressed file is gzipped even when
+        the output is not, unless it goes into the archive. Characters
+        that the encoding lacks are written as question marks."""
+        name = self.targets.get(name, name)
+
+        if not isinstance(name, str):
+            return Borrowed(name)
+
+        if self.compress == 'gzip' or (compressed and not self.archive):
+            import gzip
+            return Sink(gzip.GzipFile(f'{name}.gz', 'wb', mtime=0), encoding)
+
+        if self.archive:
+            import zipfile
+            info = zipfile.ZipInfo(name, ZIP_DATE)
+            info.compress_type = zipfile.ZIP_DEFLATED
+
+            if self.member and not self.member.closed:
+                self.held.append(Held(info, encoding))
+                return self.held[-1]
+
+            self.member = Sink(self.archive.open(info, 'w'), encoding)
+            return self.member
+
+        # pylint: disable=consider-using-with
+        return open(name, mode='w', encoding=encoding, errors='replace')
+
+    def forkable(self):
+        """Whether forked processes could each write their own files: only
+        files at paths, not members of one archive or file objects of this
+        process"""
+        return not self.archive and all(isinstance(target, str)
+                                        for target in self.targets.values())
+
+    def close(self):
+        if self.archive:
+            for held in self.held:
+                held.copy(self.archive)
+
+            self.archive.close()
@@ -1,61 +1,90 @@
 """Write Plain Text format"""
 # pylint: disable=missing-function-docstring
 
+import sys
 import textwrap
 import process
-from share import Mode, Processing
+from share import Capture, Fragments, Mode, Processing, has_caption
+
+# The module for the offsets is imported when they are wanted, to keep
+# startup short.
+# pylint: disable=import-outside-toplevel
 
 INDENT_SIZE = 2
+WIDTH = 71
+
+# Characters that Latin-1 lacks, spelled out. Any others are written as
+# question marks, and reported.
+LATIN1 = str.maketrans({
+    '‘': "'", '’': "'", '‚': "'", '“': '"', '”': '"', '„': '"',
+    '‹': '<', '›': '>', '′': "'", '″': '"',
+    '‐': '-', '‑': '-', '−': '-', '–': '-', '—': '--', '―': '--',
+    '…': '...', '•': '*', '†': '+', '⁄': '/', '€': 'EUR',
+    'Œ': 'OE', 'œ': 'oe', 'Ÿ': 'Y', 'ſ': 's', 'ﬀ': 'ff', 'ﬁ': 'fi', 'ﬂ': 'fl',
+    '\u2009': ' ', '\u200a': ' ', '\u202f': ' ', # thin spaces
+    '\u200b': None, '\u2060': None, # zero width spaces and joiners
+    '\u0304': None, # the combining macron of [=x]
+})
+
+# Flavors of the text book besides out.txt: the file, the width that
+# paragraphs wrap to, the encoding, and the characters spelled out
+FLAVORS = {
+    'latin1': ('out-latin1.txt', WIDTH, 'latin-1', LATIN1),
+    'narrow': ('out-narrow.txt', 40, 'utf-8', None),
+}
 
-class BufferedFile:
+class Flavor:
     """
-    Buffered file writer. Wraps text as it flushes unless the
-    nowrap flag is on.
+    One flavor of the text book. Writes the units of the layout to its
+    file, wrapped to its width, with its characters.
     """
-    def __init__(self, file):
-        self.buffer = ''
-        # pylint: disable=consider-using-with
-        self.file = open(file, mode='w', encoding='utf-8')
-        self.indent = 0
-        self.next_indent = 0
-        self.nowrap = False
-        self.wrapper = textwrap.TextWrapper(width=71, break_on_hyphens=False)
+    def __init__(self, file, width=WIDTH, table=None, name='out.txt',
+                 encoding='utf-8'):
+        self.file = file
+        self.name = name
+        self.encoding = encoding
+        self.checked = set()
+        self.indent = None
+        self.table = table
+        self.wrapper = textwrap.TextWrapper(width=width, break_on_hyphens=False)
 
     def close(self):
-        self._flush()
         self.file.close()
 
-    def print(self, string):
-        if self.buffer.endswith('\n\n'):
-            self._flush()
-
-        self.buffer += string
-
-    def set_indent(self, indent):
-        self.next_indent = indent
+    def write(self, s, indent, nowrap):
+        if self.table:
+            s = s.translate(self.table)
 
-    def set_nowrap(self, enabled):
-        self._flush()
-        self.nowrap = enabled
+        if self.encoding != 'utf-8' and not s.isascii():
+            self._check(s)
 
-    def _flush(self):
-        if self.nowrap:
-            self._write_nowrap(self.buffer)
+        if nowrap:
+            self._write_nowrap(s, indent)
         else:
-            self._write_wrap(self.buffer)
+            self._write_wrap(s, indent)
 
-        self.buffer = ''
+    def _check(self, s):
+        """Report each character that the encoding lacks, the first time"""
+        try:
+            s.encode(self.encoding)
+            return
+        except UnicodeEncodeError:
+            pass
 
-    def _update_indent(self, indent):
-        if self.indent != indent:
-            self.indent = indent
+        for char in s:
+            if char in self.checked:
+                continue
 
-            chars = ' ' * indent
-            self.wrapper.initial_indent = chars
-            self.wrapper.subsequent_indent = chars
+            self.checked.add(char)
 
-    def _write_nowrap(self, s):
-        indent_chars = ' ' * (self.indent + INDENT_SIZE)
+            try:
+                char.encode(self.encoding)
+            except UnicodeEncodeError:
+                print(f'{self.name}: no "{char}" (U+{ord(char):04X}) in '
+                      f'{self.encoding}, written as ?', file=sys.stderr)
+
+    def _write_nowrap(self, s, indent):
+        indent_chars = ' ' * (indent + INDENT_SIZE)
 
         # Indent each line, but not empty lines (which consist of
         # a single newline character)
@@ -65,7 +94,14 @@ class BufferedFile:
 
             self.file.write(line)
 
-    def _write_wrap(self, s):
+    def _write_wrap(self, s, indent):
+        if self.indent != indent:
+            self.indent = indent
+
+            chars = ' ' * indent
+            self.wrapper.initial_indent = chars
+            self.wrapper.subsequent_indent = chars
+
         len0 = len(s)
         s = s.lstrip('\n')
         len1 = len(s)
@@ -77,24 +113,109 @@ class BufferedFile:
 
         wrapped = self.wrapper.fill(s)
         self.file.write(f'{prefix}{wrapped}{suffix}')
-        self._update_indent(self.next_indent)
+
+class BufferedFile:
+    """
+    Buffered layout of the text book. Gathers the text into units, up to
+    a blank line or a change of wrapping. Each unit goes with its indent
+    and nowrap flag to every flavor, which wraps it as it writes it.
+    """
+    def __init__(self, flavors, offsets=None):
+        self.buffer = ''
+        self.flavors = flavors
+        self.indent = 0
+        self.marks = []
+        self.next_indent = 0
+        self.nowrap = False
+        self.offsets = offsets
+
+    def close(self):
+        self._flush()
+
+        for flavor in self.flavors:
+            self._place(flavor, self.marks, 0)
+            flavor.close()
+
+    def mark(self, kind, name):
+        """Mark a place in the text, at the start of the unit it falls in.
+        Wrapping moves the places within a unit."""
+        if self.buffer.endswith('\n\n'):
+            self._flush()
+
+        self.marks.append((kind, name, len(self.buffer)))
+
+    def print(self, string):
+        if self.buffer.endswith('\n\n'):
+            self._flush()
+
+        self.buffer += string
+
+    def set_indent(self, indent):
+        self.next_indent = indent
+
+    def set_nowrap(self, enabled):
+        self._flush()
+        self.nowrap = enabled
+
+    def _flush(self):
+        marks = ()
+
+        if self.marks:
+            text = self.buffer.lstrip('\n')
+            lead = len(self.buffer) - len(text)
+            end = lead + len(text.rstrip('\n'))
+
+            # Places in the line ends after the text start the next unit
+            marks = [mark for mark in self.marks if mark[2] < end]
+            self.marks = [mark for mark in self.marks if mark[2] >= end]
+
+        for flavor in self.flavors:
+            if marks:
+                self._place(flavor, marks, lead)
+
+            flavor.write(self.buffer, self.indent, self.nowrap)
+
+        # A wrapped unit takes up the indent set while it was gathered
+        if not self.nowrap:
+            self.indent = self.next_indent
+
+        self.buffer = ''
+
+    def _place(self, flavor, marks, lead):
+        for kind, name, _position in marks:
+            self.offsets.add(kind, name, flavor.name,
+                             flavor.file.offset + lead)
 
 class Context:
     """Context manager"""
     def __init__(self):
-        self.buffer = BufferedFile('out.txt')
+        self.buffer = None
+        self.capture = None
         self.caps = False
+        self.chapters = 0
+        self.spaced = False
+        self.hidden = False
         self.indent_level = 0
         self.inside_paragraph = False
         self.mode = None
+        self.offsets = None
         self.suppress_newline = False
         self.suppress_paragraph = False
+        self.tn_caps = False
+        self.tn_fragments = Fragments()
+
+    def open(self, flavors):
+        self.buffer = BufferedFile(flavors, self.offsets)
 
     def close(self):
         self.buffer.close()
 
     def print(self, string):
-        self.buffer.print(string)
+        if self.capture:
+            self.capture.write(string)
+
+        if not self.hidden:
+            self.buffer.print(string)
 
     def indent(self):
         self.indent_level += INDENT_SIZE
@@ -109,7 +230,24 @@ class Context:
     def set_nowrap(self, enabled):
         self.buffer.set_nowrap(enabled)
 
+    def mark(self, kind, name):
+        if self.offsets:
+            self.buffer.mark(kind, name)
+
 def data(text):
+    if context.capture:
+        # As the text reads in the transcriber's notes, outside of any
+        # paragraph and only in capitals set within the note
+        note = text.strip('\n')
+
+        if context.tn_caps:
+            note = note.upper()
+
+        context.capture.write(note)
+
+    if context.hidden:
+        return
+
     if context.inside_paragraph:
         if context.suppress_newline and text.startswith('\n'):
             text = text[1:]
@@ -120,7 +258,15 @@ def data(text):
     if context.caps:
         text = text.upper()
 
-    context.print(text)
+    if context.spaced:
+        text = letter_space(text)
+
+    context.buffer.print(text)
+
+def letter_space(text):
+    # Space out the letters of each word with no-break spaces, so that a
+    # word is never wrapped apart, and the words further
+    return '   '.join('\u00a0'.join(word) for word in text.split(' '))
 
 def bold(_elem):
     context.print('=')
@@ -134,6 +280,18 @@ def blockquote_close(_elem):
 def br(_elem):
     print_newline()
 
+def g_open(_elem):
+    context.spaced = True
+
+def g_close(_elem):
+    context.spaced = False
+
+def greek_open(_elem):
+    context.print('[Greek: ')
+
+def greek_close(_elem):
+    context.print(']')
+
 def h1_open(_elem):
     print_newlines(4)
 
@@ -145,6 +303,8 @@ def head_close(_elem):
 
 def headgroup_open(_elem):
     print_newlines(4)
+    context.chapters += 1
+    context.mark('chapter', context.chapters)
 
 def headgroup_close(_elem):
     print_newline()
@@ -153,7 +313,7 @@ def ill_open(elem):
     print_newline()
     context.print('[Illustration')
 
-    if len(elem):
+    if has_caption(elem):
         context.print(': ')
 
     context.suppress_paragraph = True
@@ -186,13 +346,20 @@ def p_close(_elem):
     if not context.suppress_paragraph:
         print_newline()
 
-def pb_open(_elem):
+def pb_open(elem):
     # Page breaks are represented in the XML as:
     #   <p>line 1
     #   <pb />
     #   line 2</p>
-    # Avoid duplicating the newline character around page breaks
-    if context.inside_paragraph:
+    # Avoid duplicating the newline character around page breaks. A page
+    # break moved to the start of a block has no newline after it.
+    tail = elem.tail or ''
+    page_number = elem.get('n')
+
+    if page_number:
+        context.mark('page', page_number)
+
+    if context.inside_paragraph and tail.startswith('\n'):
         context.suppress_newline = True
     else:
         context.suppress_newline = False
@@ -207,35 +374,76 @@ def print_newlines(count):
 
     context.print('\n' * count)
 
+def sidenote_open(_elem):
+    print_newline()
+    context.print('[Sidenote: ')
+    context.suppress_paragraph = True
+
+def sidenote_close(_elem):
+    context.print(']')
+    print_newline()
+    context.suppress_paragraph = False
+
 def sc_open(_elem):
     context.caps = True
 
+    if context.capture:
+        context.tn_caps = True
+
 def sc_close(_elem):
     context.caps = False
+    context.tn_caps = False
 
-def tn_open(_elem):
-    if context.mode in (Mode.TN_DEL, Mode.TN_INS):
-        skip = Processing.SKIP_TAIL
+def sub_open(_elem):
+    context.print('_{')
+
+def sub_close(_elem):
+    context.print('}')
+
+def sup_open(elem):
+    # A single character needs no braces
+    if len(''.join(elem.itertext())) > 1:
+        context.print('^{')
     else:
-        skip = None
+        context.print('^')
 
-    return skip
+def sup_close(elem):
+    if len(''.join(elem.itertext())) > 1:
+        context.print('}')
+
+def tn_open(elem):
+    # Capture the text before and after the correction for the
+    # transcriber's notes
+    context.mark('tn', elem.get('index'))
+    context.capture = Capture()
+
+def tn_close(elem):
+    context.tn_fragments.add(elem.get('index'), context.capture.result())
+    context.capture = None
 
 def del_open(_elem):
-    if context.mode == Mode.TN_DEL:
+    # Deleted text only appears in the transcriber's notes
+    if context.capture:
+        context.capture.side = Mode.TN_DEL
+        context.hidden = True
         skip = None
     else:
         skip = Processing.SKIP_DATA
 
     return skip
 
+def del_close(_elem):
+    if context.capture:
+        context.hidden = False
+        context.capture.side = None
+
 def ins_open(_elem):
-    if context.mode == Mode.TN_DEL:
-        skip = Processing.SKIP_DATA
-    else:
-        skip = None
+    if context.capture:
+        context.capture.side = Mode.TN_INS
 
-    return skip
+def ins_close(_elem):
+    if context.capture:
+        context.capture.side = None
 
 def fn_open(elem):
     if context.mode == Mode.FOOTNOTES:
@@ -243,7 +451,13 @@ def fn_open(elem):
         print_newline()
 
         index = elem.get('index')
-        data(f'[{index}] ')
+
+        # A footnote without an anchor keeps its label
+        if index is None:
+            data(f'[{elem.get("n")}] ')
+        else:
+            context.mark('footnote', index)
+            data(f'[{index}] ')
         skip = Processing.SKIP_TAIL
     else:
         skip = Processing.SKIP_DATA
@@ -256,12 +470,16 @@ def fn_close(_elem):
         print_newline()
 
 def anchor(elem):
-    index = elem.get('index')
-    context.print(f'[{index}]')
+    # An anchor without a footnote keeps its label
+    context.print(f'[{elem.get("index", elem.get("n"))}]')
 
 def sectionbreak_open(_elem):
     print_newline()
 
+def title(_elem):
+    # The title is only for the HTML head
+    return Processing.SKIP_DATA
+
 def tb(_elem):
     print_newline()
     context.print('       *' * 5)
@@ -272,21 +490,28 @@ handlers = {
     'b':            (bold,   bold  ),
     'blockquote':   (blockquote_open, blockquote_close  ),
     'br':           (br,     None        ),
-    'del':          (del_open,    None        ),
+    'del':          (del_open,    del_close   ),
     'footnote':     (fn_open,     fn_close    ),
+    'g':            (g_open,      g_close     ),
+    'greek':        (greek_open,  greek_close ),
     'h1':           (h1_open,   h1_close  ),
     'head':         (None,      head_close  ),
     'headgroup':    (headgroup_open, headgroup_close ),
     'i':            (italic,   italic  ),
     'illustration': (ill_open,    ill_close   ),
-    'ins':          (ins_open,    None   ),
+    'ins':          (ins_open,    ins_close   ),
     'nowrap':       (nowrap_open, nowrap_close ),
     'p':            (p_open,   p_close  ),
     'pb':           (pb_open,  None  ),
     'sc':           (sc_open,     sc_close    ),
     'sectionbreak': (sectionbreak_open, None ),
+    'sidenote':     (sidenote_open, sidenote_close ),
+    'sub':          (sub_open,    sub_close   ),
+    'sup':          (sup_open,    sup_close   ),
     'tb':           (tb,     None        ),
-    'tn':           (tn_open,     None    ),
+    'title':        (title,  None        ),
+    'tn':           (tn_open,     tn_close    ),
+    'toc':          (nowrap_open, nowrap_close ), # a line per entry
 }
 
 def write_footnotes(fn_list):
@@ -310,19 +535,49 @@ def write_transnote(tn_list):
         data(elem.get('loc'))
         print_newline()
 
+        # The text before and after the correction, as captured when the
+        # note was rendered in the book
+        before, after = context.tn_fragments.get(elem.get('index'))
+
         data('  -')
-        context.mode = Mode.TN_DEL
-        process.process(elem, handlers, data)
+        context.print(before)
         print_newline()
 
         data('  +')
-        context.mode = Mode.TN_INS
-        process.process(elem, handlers, data)
+        context.print(after)
         print_newline()
 
 context = Context()
 
-def write_book(book, fn_list, tn_list):
+def open_flavors(output, names, offsets):
+    flavors = [('out.txt', WIDTH, 'utf-8', None)]
+    flavors += [FLAVORS[name] for name in names]
+    opened = []
+
+    for path, width, encoding, table in flavors:
+        file = output.open(path, encoding=encoding)
+
+        if offsets:
+            import sink
+            file = sink.Counted(file, encoding=encoding)
+
+        opened.append(Flavor(file, width, table, path, encoding))
+
+    return opened
+
+def write_book(book, fn_list, tn_list, output, flavors=(), offsets=False):
+    """Write the book to out.txt, and to a file for each of the flavors.
+    With offsets, also write the places in the files to out.txt.idx.
+    """
+    # pylint: disable=global-statement
+    global context
+    context = Context()
+
+    if offsets:
+        import sink
+        context.offsets = sink.Offsets()
+
+    context.open(open_flavors(output, flavors, offsets))
     context.mode = Mode.NORMAL
     process.process(book, handlers, data)
 
@@ -334,3 +589,8 @@ def write_book(book, fn_list, tn_list):
         write_transnote(tn_list)
 
     context.close()
+
+    if offsets:
+        file = output.open('out.txt.idx')
+        context.offsets.write(file)
+        file.close()
@@ -0,0 +1,134 @@
+"""
+Test building a corpus of books, and rebuilding only what changed.
+"""
+import hashlib
+import os
+import subprocess
+import sys
+
+BATCH = os.path.abspath('ppx/batch.py')
+LEX = os.path.abspath('lex')
+
+CHAPTER = """
+
+
+
+CHAPTER {0}
+
+
+Text of chapter {0}[A], with a note.
+
+[Footnote A: The note.]
+
+More text.
+"""
+
+SOURCE = '<title>A Corpus Book</title>\n' + ''.join(
+    CHAPTER.format(n) for n in range(1, 4))
+
+def batch(corpus, *args, options=()):
+    """Build the corpus, with the cache beside it. The args are for ppx."""
+    env = dict(os.environ, XDG_CACHE_HOME=str(corpus.parent / 'cache'))
+    return subprocess.run([sys.executable, BATCH, '--lex', LEX, *options,
+                           str(corpus), *args], capture_output=True,
+                          encoding='utf-8', env=env, check=False)
+
+def run_batch(corpus, *args, options=()):
+    """Build the corpus. Return the outputs printed as changed."""
+    result = batch(corpus, *args, options=options)
+    assert result.returncode == 0, result.stderr
+    return result.stdout.splitlines()
+
+def make_corpus(corpus, names):
+    for name in names:
+        (corpus / name / 'images').mkdir(parents=True)
+        (corpus / name / 'x.txt').write_text(SOURCE, encoding='utf-8')
+        (corpus / name / 'style.css').write_text('', encoding='utf-8')
+
+def manifest(corpus):
+    """The manifest, checked against the files it lists"""
+    entries = {}
+
+    for line in (corpus / 'manifest.sha256').read_text('utf-8').splitlines():
+        value, path = line.split('  ')
+        assert hashlib.sha256((corpus / path).read_bytes()).hexdigest() == value
+        entries[path] = value
+
+    return entries
+
+def test_rebuild(tmp_path):
+    """Only the books whose inputs changed should be built again."""
+    corpus = tmp_path / 'corpus'
+    make_corpus(corpus, ['alpha', 'beta'])
+
+    assert run_batch(corpus) == ['alpha/out.html', 'alpha/out.txt',
+                                 'beta/out.html', 'beta/out.txt']
+    built = manifest(corpus)
+    assert sorted(built) == ['alpha/out.html', 'alpha/out.txt',
+                             'beta/out.html', 'beta/out.txt']
+
+    assert run_batch(corpus) == []
+    assert manifest(corpus) == built
+
+    source = corpus / 'beta' / 'x.txt'
+    source.write_text(SOURCE.replace('More text', 'Other text'), 'utf-8')
+    assert run_batch(corpus) == ['beta/out.html', 'beta/out.txt']
+
+    # New arguments for ppx build every book, and the old outputs go. The
+    # text books are the same, so they are not listed as changed.
+    changed = run_batch(corpus, '--', '--split')
+    assert 'alpha/out_001.html' in changed
+    assert not (corpus / 'alpha' / 'out.html').exists()
+    assert sorted(manifest(corpus)) == sorted(
+        changed + ['alpha/out.txt', 'beta/out.txt'])
+
+def test_resume(tmp_path):
+    """A stopped run should be resumed at the book it was building."""
+    corpus = tmp_path / 'corpus'
+    make_corpus(corpus, ['alpha', 'beta'])
+    run_batch(corpus)
+    built = manifest(corpus)
+
+    # The run was stopped while building beta, partway through its entry
+    source = corpus / 'beta' / 'x.txt'
+    source.write_text(SOURCE.replace('More text', 'Other text'), 'utf-8')
+    (corpus / 'beta' / '.ppx-build').mkdir()
+    (corpus / 'beta' / '.ppx-build' / 'out.html').write_text('<!DOC')
+
+    with open(corpus / '.ppx-journal', 'a', encoding='utf-8') as journal:
+        journal.write('{"book": "beta", "inp')
+
+    assert run_batch(corpus) == ['beta/out.html', 'beta/out.txt']
+    assert not (corpus / 'beta' / '.ppx-build').exists()
+    assert manifest(corpus)['alpha/out.html'] == built['alpha/out.html']
+    assert len((corpus / '.ppx-journal').read_text('utf-8').splitlines()) == 2
+
+def test_failure(tmp_path):
+    """A book that fails to build should not stop the others."""
+    corpus = tmp_path / 'corpus'
+    make_corpus(corpus, ['alpha', 'beta'])
+    (corpus / 'alpha' / 'x.txt').write_text(SOURCE.replace(
+        '<title>A Corpus Book</title>\n', ''), 'utf-8')
+
+    result = batch(corpus)
+
+    assert result.returncode == 1
+    assert 'Missing title element' in result.stderr
+    assert sorted(manifest(corpus)) == ['beta/out.html', 'beta/out.txt']
+
+def test_profile(tmp_path):
+    """A profiled build should list the samples of each book's ppx under
+    its name, and not install the profile as an output.
+    """
+    corpus = tmp_path / 'corpus'
+    make_corpus(corpus, ['alpha', 'beta'])
+    profile = tmp_path / 'profile.txt'
+
+    run_batch(corpus, options=['--profile', str(profile),
+                               '--profile-rate', '10000'])
+
+    books = {stack.split(';')[0] for stack in
+             profile.read_text('utf-8').splitlines()}
+    assert {'book:alpha', 'book:beta'} <= books
+    assert sorted(manifest(corpus)) == ['alpha/out.html', 'alpha/out.txt',
+                                        'beta/out.html', 'beta/out.txt']
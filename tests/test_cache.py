@@ -0,0 +1,117 @@
+"""
+Test the cache of numbered books.
+"""
+import os
+import sys
+import xml.etree.ElementTree as ET
+import pytest
+
+sys.path.insert(0, 'ppx')
+
+# pylint: disable=wrong-import-position
+import cache
+import main
+
+BOOK = b"""<book>
+<title>A Test Book</title>
+<pb n='1' />
+<toc>CONTENTS<br />
+APPENDIX  99</toc>
+<p>Some text<anchor n='A' />.</p>
+<footnote n='A'><p>A footnote.</p></footnote>
+<illustration><p>A caption</p></illustration>
+</book>
+"""
+
+IMAGES = ['images/i001.png']
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    return tmp_path / 'cache'
+
+@pytest.fixture
+def numbered(monkeypatch):
+    """Count the books numbered rather than read from the cache"""
+    calls = []
+    number_book = main.number_book
+
+    def counted(source, files):
+        calls.append(source)
+        return number_book(source, files)
+
+    monkeypatch.setattr(main, 'number_book', counted)
+    return calls
+
+def parse(source=BOOK, files=IMAGES, use_cache=True):
+    book, fn_list, tn_list = main.parse_book(source, files, use_cache)
+    return ET.tostring(book), len(fn_list), len(tn_list)
+
+def test_hit(capsys, numbered):
+    """The second parse reads the same book from the cache, and reports
+    the same warnings
+    """
+    first = parse()
+    warnings = capsys.readouterr().err
+
+    assert parse() == first
+    assert capsys.readouterr().err == warnings
+    assert 'Contents: no page 99 for "APPENDIX"' in warnings
+    assert len(numbered) == 1
+
+def test_miss(numbered, monkeypatch):
+    """A change to the source, the images or the code numbers the book
+    again
+    """
+    parse()
+    parse(BOOK.replace(b'Some', b'Other'))
+    parse(files=[('images/i001.png', 10, 20)])
+
+    monkeypatch.setattr(cache, 'code_version', lambda module: b'changed')
+    parse()
+
+    assert len(numbered) == 4
+
+def test_no_cache(cache_dir, numbered):
+    """Without the cache, nothing is read or written"""
+    first = parse(use_cache=False)
+
+    assert parse(use_cache=False) == first
+    assert len(numbered) == 2
+    assert not cache_dir.exists()
+
+def test_corrupt(cache_dir, numbered):
+    """A damaged entry is dropped, and the book numbered again"""
+    first = parse()
+    entry, = cache_dir.iterdir()
+    data = bytearray(entry.read_bytes())
+    data[-2] ^= 1
+    entry.write_bytes(data)
+
+    assert parse() == first
+    assert len(numbered) == 2
+    assert entry.read_bytes() != data
+
+def test_evicted(cache_dir, monkeypatch):
+    """An entry removed while it is read is still used"""
+    cache.store('key', b'payload')
+
+    def utime(path):
+        os.remove(path)
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, 'utime', utime)
+    assert cache.load('key') == b'payload'
+    assert not (cache_dir / 'key').exists()
+
+def test_evict(cache_dir, monkeypatch):
+    """The least recently used entries go when the cache is full"""
+    for n, key in enumerate(['a', 'b', 'c']):
+        cache.store(key, b'x' * 100)
+        os.utime(cache_dir / key, (n, n))
+
+    cache.load('a')
+    monkeypatch.setattr(cache, 'CACHE_SIZE', 250)
+    cache.store('d', b'x' * 10)
+
+    assert sorted(os.listdir(cache_dir)) == ['a', 'd']
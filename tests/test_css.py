@@ -0,0 +1,118 @@
+"""
+Test pruning of unused stylesheet rules.
+"""
+import re
+import sys
+import pytest
+
+sys.path.insert(0, 'ppx')
+
+import css # pylint: disable=wrong-import-position
+
+TAGS = {'html', 'body', 'div', 'p', 'h2', 'a', 'span'}
+CLASSES = {'chapter', 'smcap', 'nobreak'}
+IDS = {'footnotes'}
+
+def prune(style):
+    """Prune the style for a book using the tags, classes and ids above."""
+    return css.prune(style, TAGS, CLASSES, IDS)
+
+@pytest.mark.parametrize('style', [
+    '.smcap { font-variant: small-caps; }\n',
+    'body { margin: 0; }\n',
+    'div.chapter > h2.nobreak + p { margin: 0; }\n',
+    '#footnotes a:hover, p::first-line { color: red; }\n',
+    '* { box-sizing: border-box; }\n',
+    ])
+def test_used(style):
+    """Rules that can match are kept unchanged"""
+    assert prune(style) == style
+
+@pytest.mark.parametrize('style', [
+    '.unused { color: red; }\n',
+    'table td { padding: 0; }\n',
+    '#missing { color: red; }\n',
+    'p.smcap.unused { color: red; }\n',
+    '.chapter .unused, td { color: red; }\n',
+    ])
+def test_unused(style):
+    """Rules that cannot match are dropped with their line"""
+    assert prune(style) == ''
+
+@pytest.mark.parametrize('style', [
+    '@media print {\n  .unused { display: none; }\n}\n',
+    '@import url("x.css");\n',
+    '@font-face { font-family: x; src: url(x.woff); }\n',
+    'a[href^="#"] { color: red; }\n',
+    '.unused:not(.x) { color: red; }\n',
+    '.un\\:used { color: red; }\n',
+    '.unused /* a comment */ { color: red; }\n',
+    ])
+def test_kept(style):
+    """At-rules and selectors too complex to judge are kept"""
+    assert prune(style) == style
+
+def test_selector_list():
+    """Only the selectors that cannot match are dropped from a list"""
+    style = 'h2.nobreak, h3.gone,\n.chapter > p { text-align: center; }\n'
+    assert prune(style) == 'h2.nobreak,\n.chapter > p { text-align: center; }\n'
+
+def test_strings():
+    """Braces within strings do not end a rule"""
+    style = ('.unused::after { content: "}"; }\n'
+             '.smcap::after { content: "{"; }\n')
+    assert prune(style) == '.smcap::after { content: "{"; }\n'
+
+# A book with every tag the HTML writer handles
+BOOK = """<book>
+<title>A Test Book</title>
+<pb n='1' />
+<toc>CONTENTS<br />
+CHAPTER I  2</toc>
+<pb />
+<headgroup><head>CHAPTER I</head></headgroup>
+<h1>Heading</h1>
+<p>Text<anchor n='A' /> with <b>bold</b>, <i>italic</i>, <sc>Caps</sc>,
+<sc>CAPS</sc>, <g>spaced</g>, <greek>logos</greek>, H<sub>2</sub>O,
+2<sup>nd</sup> and a <tn>rec<del>ie</del><ins>ei</ins>ved</tn> word.</p>
+<footnote n='A'><p>A footnote.</p></footnote>
+<blockquote><p class='center'>Quoted.</p></blockquote>
+<div id='box'><span class='right'>Boxed.</span></div>
+<nowrap>Not wrapped.</nowrap>
+<sidenote>Aside.</sidenote>
+<sectionbreak />
+<tb />
+<illustration><p>A caption</p></illustration>
+<illustration />
+</book>
+"""
+
+def test_book():
+    """The rules kept for a book are the ones for the tags, classes and ids
+    it is written with
+    """
+    import main # pylint: disable=import-outside-toplevel
+
+    tags = {'a', 'b', 'body', 'br', 'del', 'div', 'em', 'figcaption',
+            'figure', 'h1', 'h2', 'head', 'hr', 'html', 'i', 'img', 'ins',
+            'li', 'p', 'span', 'sub', 'sup', 'table', 'ul'}
+    classes = {'allsmcap', 'blockquot', 'center', 'chapter', 'fnanchor',
+               'gesperrt', 'greek', 'nobreak', 'nowrap', 'right',
+               'section-break', 'sidenote', 'smcap', 'toc', 'unused'}
+    ids = {'Page_1', 'Page_2', 'FNanchor_1', 'Footnote_1', 'corr1', 'box',
+           'footnotes', 'transnote', 'missing'}
+    rules = ([f'{tag} {{ margin: 0; }}\n' for tag in sorted(tags)] +
+             [f'.{name} {{ margin: 0; }}\n' for name in sorted(classes)] +
+             [f'#{name} {{ margin: 0; }}\n' for name in sorted(ids)])
+
+    book, _ = main.render(BOOK.encode('utf-8'), ''.join(rules),
+                          ['images/i001.png', 'images/i002.png'],
+                          use_cache=False)
+    style = book[book.index('<style>') + 7:book.index('</style>')]
+    written = (set(re.findall(r'<(\w+)', book)) |
+               {f'.{name}' for value in re.findall(r' class="([^"]*)"', book)
+                for name in value.split()} |
+               {f'#{name}' for name in re.findall(r' id="([^"]*)"', book)})
+
+    assert style.strip() == ''.join(
+        rule for rule in rules if rule.split()[0] in written).strip()
@@ -0,0 +1,292 @@
+"""
+Test that every way of writing the books gives the same books.
+
+Each book is written the plain way, then through each other path at once:
+compressed, archived, forked, uncached, with offsets or flavors, or one
+format only. The files are compared by a hash of their text, read as a
+stream out of gzip files and the archive. When a path gives other books,
+the book is cut into its chapters to find the smallest chapter that still
+differs, which is kept for the failure message.
+"""
+import concurrent.futures
+import fnmatch
+import gzip
+import hashlib
+import os
+import random
+import re
+import subprocess
+import sys
+import zipfile
+from pathlib import Path
+import pytest
+
+MAIN = os.path.abspath('ppx/main.py')
+SAMPLE = Path('ppx/test/in.xml').absolute()
+
+INPUTS = ('x.xml', 'style.css')
+EXTRAS = ('*.idx', 'out-*.txt') # files a path adds to the books
+CHUNK_SIZE = 1 << 16
+
+STYLE = """.smcap { font-variant: small-caps; }
+.center { text-align: center; }
+"""
+
+# The paths compared with each mode, with their arguments and the files of
+# the mode that they leave out
+PATHS = {
+    'gzip': (['--gzip'], ()),
+    'zip': (['--zip'], ()),
+    'fork': (['--fork'], ()),
+    'no-cache': (['--no-cache'], ()),
+    'offsets': (['--offsets'], ()),
+    'flavors': (['--flavor', 'latin1', '--flavor', 'narrow'], ()),
+    'html': (['--only', 'html'], ('out.txt',)),
+    'text': (['--only', 'text'], ('out*.html', 'out.css', 'search.*')),
+}
+
+# The modes, with their arguments and the paths they skip. The HTML links
+# to the search index by the name it is written under, which is only
+# search.json.gz when the output is not compressed.
+MODES = {
+    'single': ([], ()),
+    'split': (['--split'], ()),
+    'search': (['--split', '--search'], ('gzip', 'zip')),
+}
+
+WORDS = ('the', 'of', 'and', 'a', 'to', 'in', 'was', 'he', 'that', 'it',
+         'his', 'her', 'with', 'as', 'had', 'for', 'at', 'which', 'by',
+         'café', 'naïve', 'Æsop', 'rôle', 'don’t', '“well”', '--', 'Σοφία',
+         'governess', 'invariably', 'permanently', 'resident')
+
+def words(rng, count):
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+def inline(rng, notes):
+    """A line of a paragraph, with some inline markup"""
+    parts = [words(rng, rng.randint(3, 9))]
+
+    for _ in range(rng.randint(0, 2)):
+        kind = rng.randrange(6)
+
+        if kind == 0:
+            parts.append(f'<i>{words(rng, 2)}</i>')
+        elif kind == 1:
+            parts.append(f'<b>{words(rng, 1)}</b>')
+        elif kind == 2:
+            parts.append(f'<sc>{words(rng, 2)}</sc>')
+        elif kind == 3:
+            parts.append('<tn>rec<del>ie</del><ins>ei</ins>ved</tn>')
+        elif kind == 4:
+            label = 'ABCDEFGH'[len(notes)]
+            parts.append(f"{words(rng, 1)}<anchor n='{label}' />")
+            notes.append(label)
+        else:
+            parts.append(words(rng, 3))
+
+    return ' '.join(parts)
+
+def paragraph(rng):
+    notes = []
+    lines = [inline(rng, notes) for _ in range(rng.randint(1, 6))]
+
+    if rng.random() < 0.2:
+        lines.insert(rng.randrange(len(lines)), '<pb />')
+
+    blocks = ['<p>' + '\n'.join(lines) + '</p>']
+    blocks.extend(f"<footnote n='{label}'><p>{words(rng, 6)}</p></footnote>"
+                  for label in notes)
+    return blocks
+
+def block(rng, images):
+    kind = rng.randrange(12)
+
+    if kind == 0:
+        return [f'<blockquote><p>{words(rng, 20)}</p></blockquote>']
+    if kind == 1:
+        return ['<nowrap>' + '<br />\n'.join(
+            words(rng, 4) for _ in range(3)) + '</nowrap>']
+    if kind == 2:
+        images.append(f'i{len(images) + 1:03}.png')
+        return [f'<illustration><p>{words(rng, 3)}</p></illustration>']
+    if kind == 3:
+        return [rng.choice(('<tb />', '<sectionbreak />'))]
+    if kind == 4:
+        return [f"<p class='center'>{words(rng, 4)}</p>"]
+    return paragraph(rng)
+
+def generate(seed, chapters):
+    """A book of chapters of random text and markup. Return its XML and
+    the images its illustrations use.
+    """
+    rng = random.Random(seed)
+    images = []
+    blocks = [f'<title>Book {seed}</title>']
+    page = 1
+
+    for number in range(1, chapters + 1):
+        chapter = [f"<pb n='{page}' />\n<headgroup><head>CHAPTER {number}"
+                   f'</head>\n<head>{words(rng, 3)}</head></headgroup>']
+
+        for _ in range(rng.randint(3, 12)):
+            chapter.extend(block(rng, images))
+
+        # Unnumbered page breaks take the numbers after the chapter's
+        page += 1 + sum(item.count('<pb />') for item in chapter)
+        blocks.extend(chapter)
+
+    return '<book>\n' + '\n\n'.join(blocks) + '\n</book>\n', images
+
+def chapters(xml):
+    """Books of one chapter each, with the front matter of the book"""
+    parts = re.split(r"(?=^<pb n='\d+' />\n<headgroup>)", xml, flags=re.M)
+    head = parts[0]
+    return [head + part.replace('</book>\n', '') + '\n</book>\n'
+            for part in parts[1:]] or [xml]
+
+def make_book(directory, xml, images):
+    directory.mkdir(parents=True)
+    (directory / 'x.xml').write_text(xml, encoding='utf-8')
+    (directory / 'style.css').write_text(STYLE, encoding='utf-8')
+    (directory / 'images').mkdir()
+
+    for name in images:
+        (directory / 'images' / name).write_bytes(b'')
+
+def stream_hash(file):
+    digest = hashlib.sha256()
+
+    while chunk := file.read(CHUNK_SIZE):
+        digest.update(chunk)
+
+    return digest.hexdigest()
+
+def digest(directory):
+    """The hashes of the books in the directory, by file name, with the
+    files read out of gzip files and the archive
+    """
+    hashes = {}
+
+    for name in sorted(os.listdir(directory)):
+        path = directory / name
+
+        if name in INPUTS or path.is_dir():
+            continue
+
+        if name == 'out.zip':
+            with zipfile.ZipFile(path) as archive:
+                for member in archive.namelist():
+                    with archive.open(member) as file:
+                        hashes[member] = stream_hash(file)
+        elif name.endswith('.gz'):
+            with gzip.open(path) as file:
+                hashes[name[:-3]] = stream_hash(file)
+        else:
+            with open(path, 'rb') as file:
+                hashes[name] = stream_hash(file)
+
+    return hashes
+
+def leave_out(hashes, patterns):
+    return {name: value for name, value in hashes.items()
+            if not any(fnmatch.fnmatch(name, pattern) for pattern in patterns)}
+
+def write(directory, args, cache):
+    """Write the books in the directory. Return their hashes, or the
+    error if ppx failed.
+    """
+    env = dict(os.environ, XDG_CACHE_HOME=str(cache))
+    result = subprocess.run([sys.executable, MAIN, *args], cwd=directory,
+                            capture_output=True, env=env, check=False)
+
+    if result.returncode:
+        return result.stderr.decode('utf-8', 'replace')
+
+    return digest(directory)
+
+def compare(tmp_path, xml, images, mode, names=PATHS):
+    """Write the book the plain way for the mode, then through the paths
+    at once. Return the paths that give other books.
+    """
+    base = tmp_path / 'base'
+    make_book(base, xml, images)
+
+    # The plain way fills the cache that the other paths read
+    cache = tmp_path / 'cache'
+    mode_args, skipped = MODES[mode]
+    expected = write(base, mode_args, cache)
+    assert isinstance(expected, dict), expected
+
+    def check(name):
+        args, left_out = PATHS[name]
+        directory = tmp_path / name
+        make_book(directory, xml, images)
+        hashes = write(directory, mode_args + args, cache)
+
+        if isinstance(hashes, dict):
+            hashes = leave_out(hashes, EXTRAS)
+
+        return hashes == leave_out(expected, left_out)
+
+    names = [name for name in names if name not in skipped]
+
+    with concurrent.futures.ThreadPoolExecutor(os.cpu_count()) as executor:
+        return [name for name, same in zip(names, executor.map(check, names))
+                if not same]
+
+def minimize(tmp_path, xml, images, mode, name):
+    """The smallest chapter of the book that the path writes differently,
+    or the whole book if no one chapter does
+    """
+    parts = sorted(chapters(xml), key=len)
+
+    for index, part in enumerate(parts):
+        if compare(tmp_path / str(index), part, images, mode, [name]):
+            return part
+
+    return xml
+
+BOOKS = {
+    'sample': lambda: (SAMPLE.read_text('utf-8'), []),
+    'small': lambda: generate(1, 3),
+    'large': lambda: generate(2, 12),
+}
+
+@pytest.mark.parametrize('mode', MODES)
+@pytest.mark.parametrize('book', BOOKS)
+def test_equivalence(tmp_path, book, mode):
+    """Every path should write the same books as the plain way."""
+    xml, images = BOOKS[book]()
+    failed = compare(tmp_path, xml, images, mode)
+    messages = []
+
+    for name in failed:
+        smallest = minimize(tmp_path / f'minimize-{name}', xml, images,
+                            mode, name)
+        path = tmp_path / f'{name}.xml'
+        path.write_text(smallest, encoding='utf-8')
+        messages.append(f'{name} differs, smallest differing book: {path}')
+
+    assert not failed, '\n'.join(messages)
+
+def test_chapters():
+    """Each chapter should become a book of its own, with the front matter."""
+    xml, _ = generate(3, 4)
+    parts = chapters(xml)
+
+    assert len(parts) == 4
+    assert all(part.startswith('<book>\n<title>Book 3</title>') and
+               part.endswith('</book>\n') and part.count('<headgroup>') == 1
+               for part in parts)
+
+def test_minimize(tmp_path, monkeypatch):
+    """A difference should be narrowed to the one chapter that has it."""
+    xml, images = generate(4, 5)
+    bad = chapters(xml)[2]
+
+    def compare_chapter(_directory, part, _images, _mode, names):
+        assert names == ['zip']
+        return ['zip'] if part == bad else []
+
+    monkeypatch.setattr(sys.modules[__name__], 'compare', compare_chapter)
+    assert minimize(tmp_path, xml, images, 'single', 'zip') == bad
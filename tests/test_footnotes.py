@@ -0,0 +1,98 @@
+"""
+Test matching footnotes to their anchors page by page.
+"""
+import subprocess
+import sys
+import pytest
+
+sys.path.insert(0, 'ppx')
+
+# pylint: disable=wrong-import-position
+import main
+
+def anchor(label, line):
+    """An anchor as the scanner writes it"""
+    return f"<anchor n='{label}' line='{line}' />"
+
+def footnote(label, line):
+    """A footnote as the scanner writes it"""
+    return f"<footnote n='{label}' line='{line}'><p>Note.</p></footnote>"
+
+def make_book(*pages):
+    """A book of the given pages"""
+    body = ''.join(f"<pb n='{n}' />{page}" for n, page in enumerate(pages, 1))
+    return f'<book><title>Notes</title>{body}</book>'.encode('utf-8')
+
+def number(capsys, *pages):
+    """Number a book of the given pages. Return the messages."""
+    _, warnings = main.number_book(make_book(*pages), [])
+    messages = capsys.readouterr().err.splitlines()
+
+    assert messages == warnings
+    return messages
+
+def test_scanner():
+    """Anchors and footnotes carry their line in the source"""
+    result = subprocess.run('lex/xml', input='\nText[A]\n\n[Footnote A: x]\n',
+                            encoding='utf-8', capture_output=True, check=True)
+    assert "<anchor n='A' line='2' />" in result.stdout
+    assert "<footnote n='A' line='4'>" in result.stdout
+
+@pytest.mark.parametrize('pages', [
+    # The same labels on every page
+    [anchor('A', 1) + anchor('B', 1) + footnote('A', 3) + footnote('B', 4),
+     anchor('A', 6) + anchor('B', 6) + footnote('A', 8) + footnote('B', 9)],
+    # A label used twice on a page
+    [anchor('1', 1) + anchor('1', 2) + footnote('1', 3) + footnote('1', 4)],
+    # A paragraph running over the page break before its footnote
+    [anchor('A', 1), footnote('A', 3) + anchor('A', 4) + footnote('A', 5)],
+    # A footnote before its anchor on the page
+    [footnote('A', 1) + anchor('A', 2)],
+    ])
+def test_matched(capsys, pages):
+    """Footnotes that match their anchors pass quietly"""
+    assert number(capsys, *pages) == []
+
+@pytest.mark.parametrize('pages, messages', [
+    # A footnote two pages after its anchor
+    ([anchor('A', 1), '', footnote('A', 3)],
+     ['line 1, page 1: anchor [A] has no footnote',
+      'line 3, page 3: footnote [A] has no anchor']),
+    # A footnote on the page before its anchor
+    ([footnote('A', 1), anchor('A', 3)],
+     ['line 1, page 1: footnote [A] has no anchor',
+      'line 3, page 2: anchor [A] has no footnote']),
+    ])
+def test_unmatched(capsys, pages, messages):
+    """A footnote only matches an anchor on its page or the page before"""
+    assert number(capsys, *pages) == messages
+
+def test_problems(capsys):
+    """Every problem is reported, in one run"""
+    assert number(
+        capsys,
+        anchor('A', 1) + anchor('B', 1) + footnote('B', 3) + footnote('A', 4),
+        anchor('C', 6) + footnote('D', 7)) == [
+            'line 4, page 1: footnote [A] is out of order',
+            'line 7, page 2: footnote [D] has no anchor',
+            'line 6, page 2: anchor [C] has no footnote']
+
+def test_render(capsys):
+    """A book whose notes do not all match still renders. The matched pairs
+    are numbered and linked; the rest keep their labels, unlinked.
+    """
+    html, text = main.render(make_book(
+        anchor('A', 1) + footnote('A', 2) + anchor('B', 3),
+        footnote('C', 5) + anchor('D', 6) + footnote('D', 7)), use_cache=False)
+
+    assert capsys.readouterr().err.splitlines() == [
+        'line 3, page 1: anchor [B] has no footnote',
+        'line 5, page 2: footnote [C] has no anchor']
+    assert [html.count(f'id="FNanchor_{n}"') for n in (1, 2, 3)] == [1, 1, 0]
+    assert [html.count(f'id="Footnote_{n}"') for n in (1, 2, 3)] == [1, 1, 0]
+    assert '<a class="fnanchor">[B]</a>' in html
+    assert '<a>[C]</a>' in html
+
+    # Anchor D and its footnote share the second number
+    assert [text.count(f'[{label}]') for label in ('1', '2', 'B', 'C')] == [
+        2, 2, 1, 1]
@@ -0,0 +1,96 @@
+"""
+Test reading image dimensions and the image manifest.
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, 'ppx')
+
+# pylint: disable=wrong-import-position
+import cache
+import images
+
+def png(width, height):
+    """A PNG header"""
+    return (b'\x89PNG\r\n\x1a\n' + b'\0\0\0\x0dIHDR' +
+            width.to_bytes(4, 'big') + height.to_bytes(4, 'big') +
+            b'\x08\x02\0\0\0' + b'\0' * 4)
+
+def gif(width, height):
+    """A GIF header"""
+    return (b'GIF89a' + width.to_bytes(2, 'little') +
+            height.to_bytes(2, 'little') + b'\0' * 16)
+
+def jpeg(width, height, frame=0xc2):
+    """A JPEG header: an APP0 segment, fill bytes, a quantization table and
+    the start of frame
+    """
+    app0 = b'\xff\xe0\0\x10JFIF\0\x01\x01\0\0\x01\0\x01\0\0'
+    dqt = b'\xff\xff\xdb\0\x05' + b'\0' * 3
+    sof = (bytes([0xff, frame]) + b'\0\x11\x08' + height.to_bytes(2, 'big') +
+           width.to_bytes(2, 'big') + b'\x03' + b'\0' * 9)
+    return b'\xff\xd8' + app0 + dqt + sof + b'\xff\xd9'
+
+@pytest.mark.parametrize('data, size', [
+    (png(640, 480), (640, 480)),
+    (gif(17, 3), (17, 3)),
+    (jpeg(1200, 800), (1200, 800)),
+    (jpeg(65535, 5, 0xc0), (65535, 5)),
+    (b'<svg></svg>', None),
+    (b'\xff\xd8\xff\xe0\0\x10JF', None),
+    (b'\xff\xd8\xff\xe0', None),
+    (b'\xff\xd8\xff\xe0\0', None),
+    (b'\xff\xd8\xff\xe0\0\x01\xff\xe0', None),
+    ])
+def test_read_size(tmp_path, data, size):
+    """Dimensions come from the header; other or truncated files give None"""
+    path = tmp_path / 'image'
+    path.write_bytes(data)
+    assert images.read_size(path) == size
+
+def test_manifest(tmp_path, monkeypatch):
+    """Unchanged images are not read again"""
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    directory = tmp_path / 'images'
+    directory.mkdir()
+    (directory / 'a.png').write_bytes(png(10, 20))
+    (directory / 'b.jpg').write_bytes(jpeg(30, 40))
+
+    expected = [images.Image('images/a.png', 10, 20),
+                images.Image('images/b.jpg', 30, 40)]
+    assert images.scan(directory) == expected
+
+    read = []
+    read_size = images.read_size
+    monkeypatch.setattr(images, 'read_size',
+                        lambda path: read.append(path) or read_size(path))
+    assert images.scan(directory) == expected
+    assert not read
+
+    # A changed image is read again
+    (directory / 'b.jpg').write_bytes(jpeg(50, 60))
+    os.utime(directory / 'b.jpg', ns=(0, 0))
+    assert images.scan(directory)[1] == images.Image('images/b.jpg', 50, 60)
+    assert [os.path.basename(path) for path in read] == ['b.jpg']
+
+def test_subdirectory(tmp_path, monkeypatch):
+    """A subdirectory among the images is not listed or read"""
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    directory = tmp_path / 'images'
+    (directory / 'originals').mkdir(parents=True)
+    (directory / 'a.png').write_bytes(png(10, 20))
+
+    assert images.scan(directory) == [images.Image('images/a.png', 10, 20)]
+    assert images.read_size(directory / 'originals') is None
+
+def test_no_cache(tmp_path, monkeypatch):
+    """Without the cache, the images are read and no manifest is stored"""
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    directory = tmp_path / 'images'
+    directory.mkdir()
+    (directory / 'a.png').write_bytes(png(10, 20))
+
+    assert images.scan(directory, use_cache=False) == [
+        images.Image('images/a.png', 10, 20)]
+    assert not os.path.exists(tmp_path / 'cache')
@@ -0,0 +1,56 @@
+"""
+Test the inline markup of format.txt, from the scanner to both books.
+"""
+import subprocess
+import sys
+import pytest
+
+sys.path.insert(0, 'ppx')
+
+# pylint: disable=wrong-import-position
+import main
+
+def scan(line):
+    """Get the XML scanner's output for the given input line."""
+    result = subprocess.run('lex/xml', input=line + '\n', encoding='utf-8',
+                            capture_output=True, check=True)
+    return result.stdout
+
+@pytest.mark.parametrize('line, xml', [
+    ('2^{nd} ed.', '2<sup>nd</sup> ed.'),
+    ('1^s & 2^{&c}', '1<sup>s</sup> &amp; 2<sup>&amp;c</sup>'),
+    ('H_{2}O', 'H<sub>2</sub>O'),
+    ('^{a} start', '<p><sup>a</sup> start'),
+    # Each letter is followed by a combining macron
+    ('[=a]ra [=AE]', 'a\u0304ra A\u0304E\u0304'),
+    ('the [Greek: logos].', 'the <greek>logos</greek>.'),
+    ('[Greek: logos] [sic]', '<p><greek>logos</greek> [sic]'),
+    ('<g>spaced</g>', '<g>spaced</g>'),
+    ('a ^ b _ c [= d]', 'a ^ b _ c [= d]'),
+    ])
+def test_scanner(line, xml):
+    """Markup becomes XML; lone markup characters stay text"""
+    assert xml in scan(line)
+
+BOOK = """<book>
+<title>T</title>
+<p>The 2<sup>nd</sup> ed., 1<sup>s</sup>, H<sub>2</sub>O, \
+<greek>logos</greek> and <g>spaced out</g>.</p>
+<sidenote><p>A note.</p></sidenote>
+</book>
+"""
+
+def test_render():
+    """Each book renders the markup in its own way"""
+    html, text = main.render(BOOK.encode('utf-8'), use_cache=False)
+
+    assert ('<p>The 2<sup>nd</sup> ed., 1<sup>s</sup>, H<sub>2</sub>O, '
+            '<span class="greek" lang="grc-Latn">logos</span> and '
+            '<em class="gesperrt">spaced out</em>.</p>\n\n'
+            '<div class="sidenote"><p>A note.</p></div>') in html
+
+    # Spaced out letters are held together by no-break spaces
+    assert text == ('\nThe 2^{nd} ed., 1^s, H_{2}O, [Greek: logos] and '
+                    + '\u00a0'.join('spaced') + '   '
+                    + '\u00a0'.join('out') + '.'
+                    + '\n\n[Sidenote: A note.]\n')
@@ -0,0 +1,373 @@
+"""
+Test the ppx renderer's input and output options.
+"""
+import os
+import gzip
+import json
+import re
+import subprocess
+import sys
+import zipfile
+import pytest
+
+MAIN = os.path.abspath('ppx/main.py')
+SAMPLE = os.path.abspath('ppx/test')
+
+BOOK = """<book>
+<title>A Test Book</title>
+<pb n='1' />
+<headgroup><head>CHAPTER I</head></headgroup>
+
+<p>Some text<anchor n='A' /> with a <tn>rec<del>ie</del><ins>ei</ins>ved</tn>
+<pb />
+correction and <sc>small caps</sc>.</p>
+
+<footnote n='A'><p>A footnote.</p></footnote>
+
+<illustration><p>A caption</p></illustration>
+</book>
+"""
+
+SPLIT_BOOK = """<book>
+<title>A Split Book</title>
+<pb n='1' />
+<p>Front matter.</p>
+<pb />
+<headgroup><head>CHAPTER I</head></headgroup>
+
+<p>First text<anchor n='A' /> with a <tn>rec<del>ie</del><ins>ei</ins>ved</tn>
+word.</p>
+
+<footnote n='A'><p>First note.</p></footnote>
+<pb />
+<headgroup><head>CHAPTER II</head></headgroup>
+
+<p>Second text<anchor n='B' />.</p>
+
+<footnote n='B'><p>Second note.</p></footnote>
+</book>
+"""
+
+STYLE = """.smcap { font-variant: small-caps; }
+.unused { color: red; }
+"""
+
+def run_ppx(directory, *args, stdin=None):
+    """Run ppx in the directory. Return its standard output."""
+    env = dict(os.environ, XDG_CACHE_HOME=str(directory / 'cache'))
+    result = subprocess.run([sys.executable, MAIN, *args], cwd=directory,
+                            input=stdin, capture_output=True, env=env,
+                            check=True)
+    return result.stdout
+
+def make_book(directory):
+    """Write the book, stylesheet and images in the usual layout."""
+    (directory / 'x.xml').write_text(BOOK, encoding='utf-8')
+    (directory / 'style.css').write_text(STYLE, encoding='utf-8')
+    (directory / 'images').mkdir()
+    (directory / 'images' / 'i001.png').write_bytes(b'')
+
+def test_sample(tmp_path):
+    """The sample book should give the text book kept beside it."""
+    (tmp_path / 'style.css').write_text('', encoding='utf-8')
+    (tmp_path / 'images').mkdir()
+    run_ppx(tmp_path, os.path.join(SAMPLE, 'in.xml'), '--no-cache')
+
+    with open(os.path.join(SAMPLE, 'out.txt'), 'rb') as file:
+        assert (tmp_path / 'out.txt').read_bytes() == file.read()
+
+def test_pipe(tmp_path):
+    """Reading standard input and writing standard output, with explicit
+    paths, should give the same books as the usual layout.
+    """
+    files = tmp_path / 'files'
+    files.mkdir()
+    make_book(files)
+    run_ppx(files)
+
+    pipe = tmp_path / 'pipe'
+    pipe.mkdir()
+    html = run_ppx(pipe, '-', '--html', '-', '--text', 'book.txt',
+                   '--style', str(files / 'style.css'),
+                   '--images', str(files / 'images'),
+                   stdin=BOOK.encode('utf-8'))
+
+    assert html == (files / 'out.html').read_bytes()
+    assert (pipe / 'book.txt').read_bytes() == (files / 'out.txt').read_bytes()
+    assert sorted(os.listdir(pipe)) == ['book.txt', 'cache']
+
+def test_render(tmp_path):
+    """The in-memory API should give the same books as the command line."""
+    make_book(tmp_path)
+    run_ppx(tmp_path)
+
+    script = ('import sys, main; '
+              'html, text = main.render(sys.stdin.buffer, sys.argv[1], '
+              '["images/i001.png"], use_cache=False); '
+              'sys.stdout.write(html + "\\0" + text)')
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(MAIN))
+    result = subprocess.run([sys.executable, '-c', script, STYLE],
+                            input=BOOK.encode('utf-8'), capture_output=True,
+                            env=env, check=True)
+    html, text = result.stdout.split(b'\0')
+
+    assert html == (tmp_path / 'out.html').read_bytes()
+    assert text == (tmp_path / 'out.txt').read_bytes()
+
+def test_fork(tmp_path):
+    """Writing the formats in forked processes should give the same books."""
+    make_book(tmp_path)
+    run_ppx(tmp_path)
+    books = [(tmp_path / name).read_bytes() for name in ('out.html', 'out.txt')]
+
+    run_ppx(tmp_path, '--fork')
+    assert books == [(tmp_path / name).read_bytes()
+                     for name in ('out.html', 'out.txt')]
+
+def test_fork_failure():
+    """A failure in a forked process should fail the run."""
+    script = 'import main; main.run_forked([lambda: None, lambda: 1 / 0])'
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(MAIN))
+    result = subprocess.run([sys.executable, '-c', script], env=env,
+                            capture_output=True, encoding='utf-8', check=False)
+
+    assert result.returncode == 1
+    assert 'ZeroDivisionError' in result.stderr
+
+def test_flavors(tmp_path):
+    """The flavors of the text book should share its layout, written with
+    their own width and characters, in plain files or the archive.
+    """
+    make_book(tmp_path)
+    run_ppx(tmp_path)
+    text = (tmp_path / 'out.txt').read_text('utf-8')
+
+    run_ppx(tmp_path, '--flavor', 'latin1', '--flavor', 'narrow')
+    latin1 = (tmp_path / 'out-latin1.txt').read_bytes()
+    narrow = (tmp_path / 'out-narrow.txt').read_text('utf-8')
+
+    assert (tmp_path / 'out.txt').read_text('utf-8') == text
+    assert latin1 == text.replace('’', "'").encode('latin-1')
+    assert max(len(line) for line in narrow.splitlines()) <= 40
+    assert narrow.split() == text.split()
+
+    run_ppx(tmp_path, '--flavor', 'latin1', '--flavor', 'narrow', '--zip')
+
+    with zipfile.ZipFile(tmp_path / 'out.zip') as archive:
+        assert archive.read('out-latin1.txt') == latin1
+        assert archive.read('out-narrow.txt').decode('utf-8') == narrow
+        assert archive.read('out.txt').decode('utf-8') == text
+
+def test_latin1(tmp_path):
+    """Characters that Latin-1 lacks are spelled out if they can be, or
+    else written as question marks and reported once each.
+    """
+    make_book(tmp_path)
+    (tmp_path / 'x.xml').write_text(
+        BOOK.replace('correction and', 'correction ☞ ſo ☞ and'),
+        encoding='utf-8')
+    env = dict(os.environ, XDG_CACHE_HOME=str(tmp_path / 'cache'))
+    result = subprocess.run([sys.executable, MAIN, '--flavor', 'latin1'],
+                            cwd=tmp_path, capture_output=True, env=env,
+                            encoding='utf-8', check=True)
+
+    assert result.stderr == ('out-latin1.txt: no "☞" (U+261E) in latin-1, '
+                             'written as ?\n')
+    assert 'correction ? so ? and' in ' '.join(
+        (tmp_path / 'out-latin1.txt').read_text('latin-1').split())
+
+def test_compress(tmp_path):
+    """Books written with --gzip or --zip should be the plain books, whole
+    and unchanged, even when they take many chunks to compress. Writing
+    them again should give the same compressed files.
+    """
+    make_book(tmp_path)
+    paragraph = '<p>Some more text for the compressor to work through.</p>\n'
+    (tmp_path / 'x.xml').write_text(
+        BOOK.replace('</book>', paragraph * 10000 + '</book>'),
+        encoding='utf-8')
+
+    names = ['out.html', 'out.txt', 'out-latin1.txt']
+    run_ppx(tmp_path, '--flavor', 'latin1')
+    books = {}
+
+    for name in names:
+        books[name] = (tmp_path / name).read_bytes()
+        (tmp_path / name).unlink()
+
+    assert len(books['out.txt']) > 256 * 1024
+
+    run_ppx(tmp_path, '--flavor', 'latin1', '--gzip')
+    first = [(tmp_path / f'{name}.gz').read_bytes() for name in names]
+
+    for name in names:
+        with gzip.open(tmp_path / f'{name}.gz') as file:
+            assert file.read() == books[name]
+
+        assert not (tmp_path / name).exists()
+
+    run_ppx(tmp_path, '--flavor', 'latin1', '--gzip')
+    assert first == [(tmp_path / f'{name}.gz').read_bytes() for name in names]
+
+    run_ppx(tmp_path, '--flavor', 'latin1', '--zip')
+    first = (tmp_path / 'out.zip').read_bytes()
+
+    with zipfile.ZipFile(tmp_path / 'out.zip') as archive:
+        assert sorted(archive.namelist()) == sorted(names)
+
+        for name in names:
+            assert archive.read(name) == books[name]
+
+    run_ppx(tmp_path, '--flavor', 'latin1', '--zip')
+    assert (tmp_path / 'out.zip').read_bytes() == first
+
+# Page breaks before and at the end of blocks: the book's body, the HTML
+# it renders to, and the text book. A bare page break moves into the
+# heading, paragraph or caption after it; other blocks start their page
+# where it was. The text is as it was before page breaks moved, but for
+# the merged paragraph.
+PAGE_BREAKS = [
+    ("<p>Para one</p><pb n='2' /><p type='merge'>continued.</p>",
+     '<p>Para one\n<a id="Page_2"></a>continued.</p>',
+     '\nPara one continued.\n'),
+    ("<p>Para one.</p><pb n='2' /><headgroup><head>CHAPTER I</head>"
+     "</headgroup><p>After.</p>",
+     '<h2 class="nobreak"><a id="Page_2"></a>CHAPTER I</h2>',
+     '\nPara one.\n\n\n\n\nCHAPTER I\n\n\nAfter.\n'),
+    ("<p>Para one.</p><pb n='2' /><nowrap>Line a<br />Line b</nowrap>"
+     "<p>After.</p>",
+     '<a id="Page_2"></a><div class="nowrap">Line a<br>Line b</div>'
+     '<p>After.</p>',
+     '\nPara one.\n\n  Line a\n  Line b\n\nAfter.\n'),
+    ("<p>Para one.\n<pb n='2' />\n</p><nowrap>Line a<br />Line b</nowrap>"
+     "<p>After.</p>",
+     '<p>Para one.\n<a id="Page_2"></a>\n</p><div class="nowrap">',
+     '\nPara one.\n\n\n  Line a\n  Line b\n\nAfter.\n'),
+    ("<p>Para one.</p><pb n='2' /><blockquote><p>Quoted.</p></blockquote>",
+     '<a id="Page_2"></a>\n<div class="blockquot"><p>Quoted.</p></div>',
+     '\nPara one.\n\n  Quoted.\n'),
+    ("<p>Para one.</p><pb n='2' /><illustration /><p>After.</p>",
+     '<a id="Page_2"></a><figure><img src="images/i001.png" alt="" '
+     'loading="lazy"></figure><p>After.</p>',
+     '\nPara one.\n\n[Illustration]\n\nAfter.\n'),
+    ("<p>Para one.</p><pb n='2' /><illustration><p>A caption</p>"
+     "</illustration>",
+     '<figcaption><a id="Page_2"></a><p>A caption</p></figcaption>',
+     '\nPara one.\n\n[Illustration: A caption]\n'),
+    ]
+
+@pytest.mark.parametrize('body, html, text', PAGE_BREAKS)
+def test_page_breaks(tmp_path, body, html, text):
+    """Page breaks should start their page at the block they come before"""
+    make_book(tmp_path)
+    (tmp_path / 'x.xml').write_text(f'<book><title>T</title>{body}</book>',
+                                    encoding='utf-8')
+    run_ppx(tmp_path, '--no-cache')
+
+    assert html in (tmp_path / 'out.html').read_text('utf-8')
+    assert (tmp_path / 'out.txt').read_text('utf-8') == text
+
+def test_offsets(tmp_path):
+    """Each place in the index should be at its tag in the HTML book, and
+    at the text around it in the text book, without changing either book.
+    """
+    make_book(tmp_path)
+    run_ppx(tmp_path)
+    books = [(tmp_path / name).read_bytes() for name in ('out.html', 'out.txt')]
+
+    run_ppx(tmp_path, '--offsets')
+    assert books == [(tmp_path / name).read_bytes()
+                     for name in ('out.html', 'out.txt')]
+
+    tags = {
+        'chapter': b'<div class="chapter"',
+        'page': b'<a id="Page_%s"',
+        'tn': b'<a id="corr%s"',
+        'footnote': b'<div><a id="Footnote_%s"',
+    }
+    html, text = books
+
+    for line in (tmp_path / 'out.html.idx').read_text('utf-8').splitlines():
+        kind, name, path, offset = line.split('\t')
+        assert path == 'out.html'
+        tag = tags[kind].replace(b'%s', name.encode('utf-8'))
+        assert html[int(offset):].lstrip().startswith(tag)
+
+    places = [line.split('\t') for line in
+              (tmp_path / 'out.txt.idx').read_text('utf-8').splitlines()]
+    assert [(kind, name) for kind, name, _, _ in places] == [
+        ('chapter', '1'), ('page', '1'), ('tn', '1'), ('page', '2'),
+        ('footnote', '1')]
+    assert text[int(places[0][3]):].startswith(b'CHAPTER I')
+    assert b'received' in text[int(places[2][3]):int(places[4][3])]
+    assert text[int(places[4][3]):].startswith(b'[1] A footnote.')
+
+def test_profile(tmp_path):
+    """A profiled run should write the same books, and collapsed stacks
+    labelled with the stage and tag they were sampled in, forked or not.
+    """
+    book = BOOK.replace('</book>', '<p>Some <i>more</i> text.</p>\n' * 5000
+                        + '</book>')
+    make_book(tmp_path)
+    (tmp_path / 'x.xml').write_text(book, encoding='utf-8')
+    run_ppx(tmp_path)
+    books = [(tmp_path / name).read_bytes() for name in ('out.html', 'out.txt')]
+
+    for args in ((), ('--fork',)):
+        run_ppx(tmp_path, '--profile', 'profile.txt', '--profile-rate', '2000',
+                *args)
+        assert books == [(tmp_path / name).read_bytes()
+                         for name in ('out.html', 'out.txt')]
+
+        stacks = (tmp_path / 'profile.txt').read_text('utf-8').splitlines()
+        assert all(re.fullmatch(r'.+ [1-9]\d*', stack) for stack in stacks)
+        assert {'stage:html', 'stage:text'} <= {
+            stack.split(';')[0] for stack in stacks}
+        assert any(';tag:p;' in stack for stack in stacks)
+        assert sorted(os.listdir(tmp_path)) == [
+            'cache', 'images', 'out.html', 'out.txt', 'profile.txt', 'style.css',
+            'x.xml']
+
+def test_split(tmp_path):
+    """A split book should have a file for the front matter, one per
+    chapter and one for the notes, with every link and every place in the
+    search index leading to an id in one of them.
+    """
+    make_book(tmp_path)
+    (tmp_path / 'x.xml').write_text(SPLIT_BOOK, encoding='utf-8')
+    run_ppx(tmp_path, '--split', '--search')
+
+    names = ['out_000.html', 'out_001.html', 'out_002.html', 'out_003.html']
+    assert sorted(name for name in os.listdir(tmp_path)
+                  if name.startswith('out')) == ['out.css', 'out.txt', *names]
+
+    files = {name: (tmp_path / name).read_text('utf-8') for name in names}
+    ids = {(name, id_) for name, text in files.items()
+           for id_ in re.findall(r' id="([^"]*)"', text)}
+
+    for name, text in files.items():
+        assert '<link rel="stylesheet" href="out.css">' in text
+
+        for href in re.findall(r'<a [^>]*href="([^"]*)"', text):
+            target, _, id_ = href.rpartition('#')
+            assert (target or name, id_) in ids, f'{name}: {href}'
+
+    assert 'Front matter.' in files['out_000.html']
+    assert 'CHAPTER I<' in files['out_001.html']
+    assert 'First text' in files['out_001.html']
+    assert 'CHAPTER II' in files['out_002.html']
+    assert 'Second text' in files['out_002.html']
+    assert 'First note.' in files['out_003.html']
+    assert 'Second note.' in files['out_003.html']
+    assert 'Transcriber’s Notes' in files['out_003.html']
+    assert 'CHAPTER' not in files['out_000.html'] + files['out_003.html']
+
+    with gzip.open(tmp_path / 'search.json.gz') as file:
+        index = json.load(file)
+
+    assert [chapter[:2] for chapter in index['chapters']] == [
+        ['out_001.html', 'chapter_1'], ['out_002.html', 'chapter_2']]
+
+    for name, anchor, _, _ in index['places']:
+        assert name in files
+        assert not anchor or (name, anchor) in ids
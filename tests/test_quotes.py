@@ -1,9 +1,17 @@
 """
 Test curly quote conversion.
 """
+import re
+import shutil
 import subprocess
+import sys
 import pytest
 
+sys.path.insert(0, 'ppx')
+
+# pylint: disable=wrong-import-position
+import quotes
+
 def check_syntax(line):
     """Get the syntax checker's output for the given input line.
     Verify that the checker reports no error.
@@ -187,6 +195,49 @@ def test_contractions(line, curly):
     """Contractions should yield apostrophes."""
     verify(line, curly)
 
+def test_lexicon(tmp_path):
+    """The words of another lexicon should yield apostrophes, whatever
+    their case, and the words left out of it opening quotes.
+    """
+    lexicon = tmp_path / 'dialect.txt'
+    lexicon.write_text('# Dialect\nbout\nCause\nnuff*\n', encoding='utf-8')
+    result = subprocess.run(['lex/quotes', '-l', str(lexicon)],
+                            input="'Bout 'cause 'nuffin' 'em\n",
+                            encoding='utf-8', capture_output=True, check=True)
+
+    assert result.stdout == '’Bout ’cause ’nuffin’ ‘em\n'
+
+def test_builtin_lexicon(tmp_path):
+    """Without contractions.txt beside it, quotes should use the words it
+    ships with. A lexicon given with -l must exist.
+    """
+    program = shutil.copy('lex/quotes', tmp_path)
+    result = subprocess.run([program], input="'Tis 'em 'undreds 'bout\n",
+                            encoding='utf-8', capture_output=True, check=True)
+
+    assert result.stdout == '’Tis ’em ’undreds ‘bout\n'
+
+    result = subprocess.run([program, '-l', str(tmp_path / 'missing.txt')],
+                            input='', encoding='utf-8', capture_output=True,
+                            check=False)
+
+    assert result.returncode == 1
+    assert 'missing.txt' in result.stderr
+
+def test_builtin_words():
+    """The words built into quotes should be those of contractions.txt"""
+    with open('lex/quotes.l', encoding='utf-8') as file:
+        match = re.search(r's_builtin_lexicon\[\] =((?:\s*"[^"]*")+);',
+                          file.read())
+
+    builtin = ''.join(re.findall(r'"([^"]*)"', match[1])).split('\\n')
+
+    with open('lex/contractions.txt', encoding='utf-8') as file:
+        words = [line.strip() for line in file
+                 if line.strip() and not line.startswith('#')]
+
+    assert builtin == words + ['']
+
 @pytest.mark.parametrize('line, curly', [
     ("“'abc'” or “'xyz'”", '“‘abc’” or “‘xyz’”'),
     ('"‘abc’" or "‘xyz’"', '“‘abc’” or “‘xyz’”'),
@@ -210,3 +261,29 @@ def test_partials(line, curly):
 def test_tags(line, curly):
     """HTML-like tags."""
     verify(line, curly)
+
+# Paragraphs whose --"-- quotes depend on the quotes of earlier paragraphs
+PARAGRAPHS = [
+    'doors--"The Holy Doors"--that',
+    '"So--"--she paused--"tired.',
+    "--'--",
+    '"Yes--"',
+    '--"-- and --"-- and --\'--',
+    "'Quote.'--Source.",
+    'plain',
+    ]
+
+@pytest.mark.parametrize('text', [
+    '\n\n'.join(PARAGRAPHS * 3),
+    '\n\n'.join(PARAGRAPHS[::-1] * 3) + '\n\n\n',
+    '\n\n'.join(PARAGRAPHS) + '\n\nmarked\x01 text',
+    ], ids=['paragraphs', 'reversed', 'marks in the text'])
+def test_segments(text):
+    """Converting the paragraphs apart should give the output of the
+    whole text
+    """
+    data = text.encode('utf-8')
+    whole = subprocess.run('lex/quotes', input=data, capture_output=True,
+                           check=True).stdout
+
+    assert quotes.convert(data, jobs=4, size=1) == whole
@@ -0,0 +1,79 @@
+"""
+Test rescanning only the changed chapters of a source text.
+"""
+import subprocess
+import sys
+import pytest
+
+sys.path.insert(0, 'ppx')
+
+# pylint: disable=wrong-import-position
+import cache
+import scan
+
+CHAPTER = """
+
+
+
+CHAPTER {0}
+
+
+-----File: {0}.png-----
+Text of chapter {0}[A], with a note.
+
+[Footnote A: The note.]
+
+More text.
+"""
+
+SOURCE = ''.join(CHAPTER.format(n) for n in range(1, 6))
+
+@pytest.fixture(name='commands')
+def fixture_commands(monkeypatch, tmp_path):
+    """The scanner commands run, with the cache in a directory of its own"""
+    commands = []
+    run = scan.run
+
+    def record(command):
+        commands.append(command)
+        return run(command)
+
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(scan, 'run', record)
+    return commands
+
+def full_scan(path):
+    return subprocess.run(['lex/xml', str(path)], capture_output=True,
+                          check=False).stdout
+
+@pytest.mark.parametrize('old, new, resumed', [
+    # A longer paragraph in the third chapter
+    ('Text of chapter 3', 'Text\nof chapter 3', True),
+    # A note left open until the next chapter
+    ('[Footnote A: The note.]\n\nMore text.\n\n\n\n\nCHAPTER 4',
+     '[Footnote A: The note.\n\nMore text.\n\n\n\n\nCHAPTER 4]', True),
+    # The first chapter has no break before it to resume from
+    ('CHAPTER 1', 'CHAPTER ONE', False),
+    # The last chapter runs to the end of the book
+    ('CHAPTER 5', 'CHAPTER 5\n\nThe last.', True),
+    ])
+def test_rescan(commands, tmp_path, old, new, resumed):
+    """A rescan gives the XML of a full scan"""
+    path = tmp_path / 'source.txt'
+    path.write_text(SOURCE, encoding='utf-8')
+    scan.scan(str(path))
+
+    path.write_text(SOURCE.replace(old, new), encoding='utf-8')
+    del commands[:]
+    xml, _ = scan.scan(str(path))
+
+    assert xml == full_scan(path)
+    assert ('-r' in commands[0]) == resumed
+
+def test_unchanged(commands, tmp_path):
+    """An unchanged source is not scanned again"""
+    path = tmp_path / 'source.txt'
+    path.write_text(SOURCE, encoding='utf-8')
+
+    assert scan.scan(str(path)) == scan.scan(str(path))
+    assert len(commands) == 1
@@ -0,0 +1,45 @@
+"""
+Test the full-text search index.
+"""
+import io
+import json
+import sys
+
+sys.path.insert(0, 'ppx')
+
+# pylint: disable=wrong-import-position
+import search
+
+def written(index):
+    """The index as search.js reads it"""
+    file = io.StringIO()
+    index.write(file)
+    return json.loads(file.getvalue())
+
+def test_index():
+    """Words are indexed once per place, across inline markup, without
+    case or accents
+    """
+    index = search.Index()
+    index.add('Before any place.')
+    index.chapter('', 'chapter_1', 'CHAPTER I')
+    index.add('The caf')
+    index.add('é opened; the ')
+    index.move('', 'Page_2', 'Page 2')
+    index.add('CAFÉ closed')
+    index.stop()
+    index.add('Not indexed.')
+    index.move('', 'Footnote_1', 'Footnote 1')
+    index.add('A café.')
+    data = written(index)
+
+    assert data['chapters'] == [['', 'chapter_1', 'CHAPTER I']]
+    assert data['places'] == [['', 'chapter_1', 'CHAPTER I', 0],
+                              ['', 'Page_2', 'Page 2', 0],
+                              ['', 'Footnote_1', 'Footnote 1', 0]]
+    assert list(data['terms']) == ['cafe', 'closed', 'opened', 'the']
+
+    # Places are given as the differences between them
+    assert data['terms']['cafe'] == [0, 1, 1]
+    assert data['terms']['the'] == [0]
+    assert data['terms']['closed'] == [1]
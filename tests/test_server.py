@@ -0,0 +1,124 @@
+"""
+Test the render server.
+"""
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import pytest
+
+sys.path.insert(0, 'ppx')
+
+# pylint: disable=wrong-import-position
+import server as ppx_server
+
+SERVER = os.path.abspath('ppx/server.py')
+LEX_QUOTES = os.path.abspath('lex/quotes')
+LEX_XML = os.path.abspath('lex/xml')
+
+BOOK = """<book>
+<title>A Test Book</title>
+<headgroup><head>CHAPTER I</head></headgroup>
+<p>Some <sc>text</sc>.</p>
+</book>
+"""
+
+@pytest.fixture(name='server')
+def fixture_server(tmp_path):
+    """A running server. Yields the path of its socket."""
+    path = str(tmp_path / 'ppx.sock')
+    proc = subprocess.Popen([sys.executable, SERVER, '--socket', path,
+                             '--workers', '2', '--timeout', '10',
+                             '--cache-dir', str(tmp_path / 'cache')],
+                            stderr=subprocess.DEVNULL)
+
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+
+    yield path
+
+    proc.terminate()
+    assert proc.wait(10) == 0
+    assert not os.path.exists(path)
+
+def request(path, *requests):
+    """Send the requests on one connection. Return the responses."""
+    with socket.socket(socket.AF_UNIX) as sock:
+        sock.connect(path)
+        file = sock.makefile('rwb')
+        responses = []
+
+        for item in requests:
+            file.write(json.dumps(item).encode('utf-8') + b'\n')
+            file.flush()
+            responses.append(json.loads(file.readline()))
+
+        return responses
+
+def test_render(server, tmp_path):
+    """The server should render like the command line."""
+    (tmp_path / 'x.xml').write_text(BOOK, encoding='utf-8')
+    (tmp_path / 'style.css').write_text('.smcap {}\n', encoding='utf-8')
+    subprocess.run([sys.executable, os.path.abspath('ppx/main.py'),
+                    '--no-cache'], cwd=tmp_path, check=True)
+
+    first, second = request(server, {'xml': BOOK, 'style': '.smcap {}\n'},
+                            {'xml': BOOK, 'style': '.smcap {}\n'})
+
+    for response in (first, second):
+        assert response['html'] == (tmp_path / 'out.html').read_text('utf-8')
+        assert response['text'] == (tmp_path / 'out.txt').read_text('utf-8')
+        assert 'warnings' not in response
+
+    assert len(os.listdir(tmp_path / 'cache')) == 1
+
+def test_source(server, tmp_path):
+    """Source text should have its quotes converted, as in a build."""
+    source = '<title>A Test Book</title>\nCHAPTER I\n\n"Some" text.\n'
+    result = subprocess.run([LEX_QUOTES], input=source.encode('utf-8'),
+                            capture_output=True, check=True)
+    (tmp_path / 'x.xml').write_bytes(subprocess.run(
+        [LEX_XML], input=result.stdout, capture_output=True,
+        check=True).stdout)
+    (tmp_path / 'style.css').write_text('', encoding='utf-8')
+    subprocess.run([sys.executable, os.path.abspath('ppx/main.py'),
+                    '--no-cache'], cwd=tmp_path, check=True)
+
+    response, = request(server, {'source': source})
+
+    assert '“Some”' in response['text']
+    assert response['text'] == (tmp_path / 'out.txt').read_text('utf-8')
+
+def test_errors(server):
+    """Bad requests and books get errors, and the metrics count them."""
+    bad, malformed, untitled, metrics = request(
+        server, {'book': BOOK}, {'xml': '<book>'},
+        {'xml': BOOK.replace('<title>A Test Book</title>', '')},
+        {'command': 'metrics'})
+
+    assert bad == {'error': 'bad request'}
+    assert 'error' in malformed
+    assert untitled['error'] == 'Missing title element\n'
+    assert metrics['requests'] == 3
+    assert metrics['bad'] == 1
+    assert metrics['error'] == 2
+
+def test_deadline():
+    """A render past its deadline is not started, and one that runs over it
+    is stopped."""
+    assert ppx_server.render({'xml': BOOK}, time.monotonic(), {}, False) == {
+        'error': 'timed out'}
+
+    long_book = BOOK.replace('<p>', '<p>Text.</p>\n' * 100000 + '<p>')
+    previous = signal.signal(signal.SIGALRM, ppx_server.on_alarm)
+
+    try:
+        assert ppx_server.render({'xml': long_book}, time.monotonic() + 0.05,
+                                 {}, False) == {'error': 'timed out'}
+    finally:
+        signal.signal(signal.SIGALRM, previous)
@@ -0,0 +1,67 @@
+"""
+Test that ppx commands start quickly, importing only what they need.
+
+Import times come from python -X importtime, less the modules that the
+interpreter imports at startup anyway.
+"""
+import os
+import subprocess
+import sys
+import pytest
+
+PPX = os.path.abspath('ppx')
+
+BOOK = """<book>
+<title>A Test Book</title>
+<p>Some text.</p>
+</book>
+"""
+
+# Modules that belong to other commands or formats
+BACKENDS = {'html', 'text', 'textwrap', 'css', 'server', 'multiprocessing',
+            'socketserver', 'gzip', 'zipfile'}
+
+# Modules for options that are not given
+OPTIONS = {'sampler', 'search'}
+
+def import_times(args, cwd):
+    """Run python -X importtime. Return the self times of the imported
+    modules, in microseconds, by module name.
+    """
+    env = dict(os.environ, XDG_CACHE_HOME=str(cwd / 'cache'))
+    result = subprocess.run([sys.executable, '-S', '-X', 'importtime', *args],
+                            cwd=cwd, env=env, capture_output=True,
+                            encoding='utf-8', check=True)
+    times = {}
+
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and 'self [us]' not in line:
+            self_time, _, name = line[len('import time:'):].split('|')
+            times[name.strip()] = int(self_time)
+
+    return times
+
+@pytest.mark.parametrize('args, unwanted, budget', [
+    (['check'], BACKENDS | {'hashlib', 'sink'}, 100),
+    (['render', '--only', 'text', '--no-cache'],
+        (BACKENDS | OPTIONS) - {'text', 'textwrap'}, 150),
+    (['render', '--no-cache'],
+        (BACKENDS | OPTIONS) - {'html', 'text', 'textwrap', 'css'}, 200),
+    ])
+def test_startup(tmp_path, args, unwanted, budget):
+    """Each command should import only its own modules, within its budget
+    in milliseconds
+    """
+    (tmp_path / 'x.xml').write_text(BOOK, encoding='utf-8')
+    (tmp_path / 'style.css').write_text('', encoding='utf-8')
+
+    startup = import_times(['-c', 'pass'], tmp_path)
+    times = import_times([PPX, *args], tmp_path)
+    imported = {name: time for name, time in times.items()
+                if name not in startup}
+
+    assert not unwanted & imported.keys()
+
+    total = sum(imported.values()) / 1000
+    assert total < budget, (
+        f'{" ".join(args)}: {len(imported)} modules in {total:.1f} ms')
@@ -0,0 +1,282 @@
+"""
+Stress the flex scanners with adversarial input.
+
+Each scanner is fed pathological input at two sizes. Throughput must scale
+linearly, and the scanners must terminate cleanly when their fixed size
+stacks overflow. Run with -s to see the throughput report.
+
+The comparisons of the times of two runs are only reported, as they are
+noise on a loaded machine. Set PPX_PERF=1 to check them as well.
+"""
+import os
+import random
+import shutil
+import subprocess
+import time
+import pytest
+
+SCANNERS = ['quotes', 'syntax', 'xml']
+
+# The files the scanners read from beside their programs
+DATA = {'quotes': ['contractions.txt']}
+
+# Table compression variants. -Cem is flex's default and what lex/Makefile
+# builds.
+VARIANTS = ['-Cem', '-Cf', '-CF']
+
+SMALL = 1 << 20 # bytes
+SCALE = 4       # the large input is SCALE times the small one
+SLACK = 2.5     # allowed deviation from linear scaling
+GROWTH = 4      # flex doubles its buffer until the longest token fits
+REPEAT = 3      # best of REPEAT timings
+MARKUP = 1.1    # allowed slowdown of marked up text against plain text
+LEXICON = 1.1   # allowed slowdown of the largest lexicon against the smallest
+
+# Whether to check the timing comparisons, not only report them
+PERF = bool(os.environ.get('PPX_PERF'))
+
+def repeat_to(unit, size):
+    """Repeat the unit string until it is at least size bytes long."""
+    count = size // len(unit.encode('utf-8')) + 1
+    return unit * count
+
+# Adversarial inputs, by scanner. Each generator makes an input of roughly
+# the requested size in bytes.
+CASES = {
+    'quotes': {
+        'long line': lambda n: repeat_to('''said "I'm 'fine'"--'twas ''', n),
+        'quote run': lambda n: ' ' + repeat_to("'", n) + 'x\n',
+        'short lines': lambda n: repeat_to('''"a" 'em 'b'\n''', n),
+    },
+    'syntax': {
+        'long line': lambda n: repeat_to('word, word. (word) “quote” ', n),
+        'start marker': lambda n: repeat_to('*** START ', n) + '\n',
+        'short lines': lambda n: repeat_to('a,,b ( c )\n', n),
+    },
+    'xml': {
+        'long line': lambda n: repeat_to('text & text [A] text ', n) + '\n',
+        'file marker': lambda n: repeat_to('-----File: x', n) + '\n',
+        'tn changes': lambda n: '<tn>' + repeat_to('{a [b] ', n) + '</tn>\n',
+        'paragraphs': lambda n: repeat_to('line one\nline two\n\n', n),
+    },
+}
+
+# A line dense with inline markup, and the same line with the markup
+# characters replaced by letters
+MARKED = ('The 2^{nd} ed. of H_{2}O, 1^s, [=a]ra, [Greek: logos] and '
+          '<g>spaced</g> text[A].\n')
+PLAIN = MARKED.translate(str.maketrans('^_{}[]=<>/:', 'xxxxxxxxxxx'))
+
+# Text dense with words after apostrophes, in and out of the lexicon
+CANDIDATES = '''"'Tis 'em," he said, "'bout 'undreds o' 'em 'twasn't 'word'."\n'''
+LEXICON_SIZES = [0, 1000, 10000] # words added to the shipped lexicon
+
+def make_lexicon(count):
+    """The shipped lexicon with count random words, a tenth of them
+    prefixes
+    """
+    rng = random.Random(count)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz')
+                     for _ in range(rng.randint(6, 12)))
+             + ('*' if rng.random() < 0.1 else '') for _ in range(count)]
+
+    with open('lex/contractions.txt', encoding='utf-8') as file:
+        return file.read() + '\n'.join(words) + '\n'
+
+def build(directory, name, flag, defines=()):
+    """Build a scanner from its flex source in the given directory."""
+    shutil.copy(f'lex/{name}.l', directory)
+    shutil.copy('lex/io.h', directory)
+
+    for data in DATA.get(name, ()):
+        shutil.copy(f'lex/{data}', directory)
+
+    subprocess.run(['flex', flag, f'{name}.l'], cwd=directory, check=True)
+    subprocess.run(['cc', '-O2', '-Wall', '-Wno-unused-function', *defines,
+                    '-o', name, f'{name}.c'], cwd=directory, check=True)
+    return os.path.join(directory, name)
+
+@pytest.fixture(scope='module')
+def binaries(tmp_path_factory):
+    """Scanner executables, by variant and scanner name."""
+    built = {}
+
+    for flag in VARIANTS:
+        directory = tmp_path_factory.mktemp(f'variant{flag}')
+        built[flag] = {name: build(directory, name, flag) for name in SCANNERS}
+
+    # Output through stdio, as the scanners did before the output arena
+    directory = tmp_path_factory.mktemp('stdio')
+    built['stdio'] = {name: build(directory, name, '-Cem', ['-DLEX_STDIO'])
+                      for name in SCANNERS}
+
+    return built
+
+def run(command, path):
+    """Scan the input file from standard input. Return the elapsed time,
+    peak memory in KiB, and the exit status.
+    """
+    with open(path, 'rb') as stdin:
+        start = time.perf_counter()
+        proc = subprocess.Popen(command, stdin=stdin, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        _, status, usage = os.wait4(proc.pid, 0)
+        elapsed = time.perf_counter() - start
+
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return elapsed, usage.ru_maxrss, proc.returncode
+
+def measure(command, path):
+    """Best of REPEAT runs."""
+    results = [run(command, path) for _ in range(REPEAT)]
+    elapsed = min(r[0] for r in results)
+    rss = max(r[1] for r in results)
+    assert all(r[2] >= 0 for r in results), 'scanner killed by a signal'
+    return elapsed, rss
+
+def write_input(tmp_path, name, text):
+    """Write the input file. Return its path and size in bytes."""
+    path = tmp_path / name
+    path.write_text(text, encoding='utf-8')
+    return path, path.stat().st_size
+
+def check_scaling(binary, generate, tmp_path, label):
+    """Verify that scanning time and memory grow linearly with input size."""
+    small, small_size = write_input(tmp_path, 'small', generate(SMALL))
+    large, large_size = write_input(tmp_path, 'large', generate(SMALL * SCALE))
+
+    small_time, small_rss = measure(binary, small)
+    large_time, large_rss = measure(binary, large)
+
+    ratio = large_time / max(small_time, 1e-6)
+    expect = large_size / small_size
+    mb_per_s = large_size / large_time / 1e6
+
+    print(f'\n{label}: {mb_per_s:.1f} MB/s, time x{ratio:.1f} for size '
+          f'x{expect:.1f}, peak {large_rss} KiB')
+
+    assert ratio < expect * SLACK, f'{label}: throughput does not scale'
+
+    # Memory may grow with the longest token (yytext), but only linearly
+    growth = (large_rss - small_rss) * 1024
+    assert growth < (large_size - small_size) * GROWTH, \
+        f'{label}: memory grows faster than the input'
+
+@pytest.mark.parametrize('name, case', [
+    (name, case) for name, cases in CASES.items() for case in cases
+    ])
+def test_scaling(binaries, tmp_path, name, case):
+    """Throughput should scale linearly on adversarial input."""
+    check_scaling(binaries['-Cem'][name], CASES[name][case], tmp_path,
+                  f'{name} {case}')
+
+@pytest.mark.parametrize('flag', VARIANTS[1:])
+@pytest.mark.parametrize('name', SCANNERS)
+def test_variants(binaries, tmp_path, flag, name):
+    """The table compression variants should produce identical output and
+    scale linearly too.
+    """
+    generate = next(iter(CASES[name].values()))
+    path, _ = write_input(tmp_path, 'input', generate(SMALL))
+
+    outputs = []
+    for binary in (binaries['-Cem'][name], binaries[flag][name]):
+        with open(path, 'rb') as stdin:
+            result = subprocess.run(binary, stdin=stdin, capture_output=True,
+                                    check=False)
+        outputs.append((result.returncode, result.stdout, result.stderr))
+
+    assert outputs[0] == outputs[1]
+
+    for case, generate in CASES[name].items():
+        check_scaling(binaries[flag][name], generate, tmp_path,
+                      f'{name} {flag} {case}')
+
+@pytest.mark.parametrize('name', SCANNERS)
+def test_mmap(binaries, tmp_path, name):
+    """Scanning a mapped file into the output arena should give the same
+    output as stdio, and be faster where the output is heavy.
+    """
+    generate = next(iter(CASES[name].values()))
+    path, size = write_input(tmp_path, 'input', generate(SMALL * SCALE))
+
+    stdio = [binaries['stdio'][name]]
+    mapped = [binaries['-Cem'][name], str(path)]
+
+    # The mapped scanner gets nothing on standard input, so it must read
+    # the file it is given
+    with open(path, 'rb') as stdin:
+        expected = subprocess.run(stdio, stdin=stdin, capture_output=True,
+                                  check=False)
+    result = subprocess.run(mapped, stdin=subprocess.DEVNULL,
+                            capture_output=True, check=False)
+
+    assert (result.returncode, result.stdout, result.stderr) == (
+        expected.returncode, expected.stdout, expected.stderr)
+
+    stdio_time, _ = measure(stdio, path)
+    mapped_time, _ = measure(mapped, path)
+
+    print(f'\n{name}: stdio {size / stdio_time / 1e6:.1f} MB/s, '
+          f'mmap {size / mapped_time / 1e6:.1f} MB/s')
+
+    # The syntax checker writes almost nothing
+    if PERF and name != 'syntax':
+        assert mapped_time < stdio_time
+
+@pytest.mark.parametrize('name, line, message', [
+    ('syntax', '(' * 64, 'Fatal: Stack full'),
+    ('syntax', '[' * 16, "Unclosed '['"),
+    ('xml', '[' * 64, 'Tag stack full'),
+    ('xml', '[Footnote A: [Illustration: ', 'Unclosed'),
+    ])
+def test_deep_nesting(name, line, message):
+    """Nesting beyond the 32 entry stacks should stop with a diagnostic,
+    not crash.
+    """
+    result = subprocess.run(f'lex/{name}', input=f'{line}\n',
+                            encoding='utf-8', capture_output=True, check=False)
+    assert result.returncode >= 0
+    assert message in result.stdout + result.stderr
+
+def test_markup(binaries, tmp_path):
+    """Heavily marked up text should scan nearly as fast as plain text of
+    the same size.
+    """
+    binary = binaries['-Cem']['xml']
+    times = {}
+
+    for name, unit in (('plain', PLAIN), ('marked', MARKED)):
+        text = repeat_to(unit, SMALL * SCALE)
+        path, size = write_input(tmp_path, name, text)
+        times[name], _ = measure(binary, path)
+        print(f'\nxml {name}: {size / times[name] / 1e6:.1f} MB/s')
+
+    if PERF:
+        assert times['marked'] < times['plain'] * MARKUP
+
+def test_lexicon(binaries, tmp_path):
+    """Scanning should be as fast with thousands of words in the lexicon
+    of contractions as with the few that ship, and give the same output.
+    """
+    binary = binaries['-Cem']['quotes']
+    path, size = write_input(tmp_path, 'input',
+                             repeat_to(CANDIDATES, SMALL * SCALE))
+    times = {}
+    outputs = set()
+
+    for count in LEXICON_SIZES:
+        lexicon = tmp_path / f'lexicon{count}.txt'
+        lexicon.write_text(make_lexicon(count), encoding='utf-8')
+        command = [binary, '-l', str(lexicon), str(path)]
+
+        outputs.add(subprocess.run(command, capture_output=True,
+                                   check=True).stdout)
+        times[count], _ = measure(command, path)
+        print(f'\nquotes with {count} more words: '
+              f'{size / times[count] / 1e6:.1f} MB/s')
+
+    assert len(outputs) == 1
+
+    if PERF:
+        assert times[LEXICON_SIZES[-1]] < times[LEXICON_SIZES[0]] * LEXICON
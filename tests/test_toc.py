@@ -0,0 +1,54 @@
+"""
+Test linking a table of contents to the pages of the book.
+"""
+import sys
+
+sys.path.insert(0, 'ppx')
+
+# pylint: disable=wrong-import-position
+import cache
+import main
+
+BOOK = """<book>
+<title>A Test Book</title>
+<pb n='1' />
+<toc>CONTENTS<br />
+CHAPTER I. <i>The Beginning</i>   2<br />
+APPENDIX  99</toc>
+<pb />
+<headgroup><head>CHAPTER I</head></headgroup>
+
+<p>Some text.</p>
+</book>
+"""
+
+def test_toc(capsys):
+    """Page numbers at the ends of lines link to their pages; numbers of
+    pages that do not exist are reported and left as they are
+    """
+    html, text = main.render(BOOK.encode('utf-8'), use_cache=False)
+
+    assert ('<div class="toc"><a id="Page_1"></a>CONTENTS<br>\n'
+            'CHAPTER I. <i>The Beginning</i>   <a href="#Page_2">2</a><br>\n'
+            'APPENDIX  99</div>') in html
+    assert '<h2 class="nobreak"><a id="Page_2"></a>CHAPTER I</h2>' in html
+
+    # The text keeps a line per entry, indented as a block quote
+    assert text.startswith('\n  CONTENTS\n'
+                           '  CHAPTER I. _The Beginning_   2\n'
+                           '  APPENDIX  99\n')
+
+    assert capsys.readouterr().err == 'Contents: no page 99 for "APPENDIX"\n'
+
+def test_cached(capsys, tmp_path, monkeypatch):
+    """A book read from the cache reports its missing pages again"""
+    monkeypatch.setattr(cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    books = main.render(BOOK.encode('utf-8'), use_cache=False)
+    capsys.readouterr()
+
+    for _ in range(2):
+        assert main.render(BOOK.encode('utf-8')) == books
+        assert capsys.readouterr().err == (
+            'Contents: no page 99 for "APPENDIX"\n')
+
+    assert len(list((tmp_path / 'cache').iterdir())) == 1